@@ -7,9 +7,18 @@ rm ./package/widgets/widgets-test-session.log
 # Clear Cache
 rm -rf ./package/__pycache__
 rm -rf ./package/widgets/__pycache__
+rm -rf ./package/widgets/mail/__pycache__
+rm -rf ./package/widgets/database/__pycache__
+rm -rf ./package/widgets/speech/__pycache__
+rm -rf ./package/widgets/voice/__pycache__
 rm -rf ./package/widgets/fps/__pycache__
 rm -rf ./package/widgets/fps/r307/__pycache__
 
 # Clear Databases
-rm ./database.json
+rm ./database.json*
+rm ./database.db*
 rm ./package/widgets/database.json
+rm ./messages.db
+
+# Clear Speech Cache
+rm -rf ./speech-cache
@@ -7,11 +7,13 @@
 
 import logging
 
+from collections import deque
+
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QApplication, QMainWindow
 
-from package.views import DashboardView, LoginView, RegistrationView
-from package.widgets import EmailWidget, FingerprintWidget, DatabaseWidget
+from package.views import ComposeView, DashboardView, LoginView, RegistrationView
+from package.widgets import EmailWidget, FingerprintRegistry, DatabaseWidget, SpeechWidget, VoiceWidget
 
 
 # Controller
@@ -39,18 +41,29 @@ class MainWindow(QMainWindow):
         self.login = LoginView()
         self.register = RegistrationView()
         self.dashboard = DashboardView()
+        self.compose = ComposeView()
         self.views.addWidget(self.login)
         self.views.addWidget(self.register)
         self.views.addWidget(self.dashboard)
+        self.views.addWidget(self.compose)
         # Handle signals
         ## Login
-        self.login.login_signal.connect(self.check_login)
+        self.login.login_signal.connect(lambda creds: self.check_login(creds, "login"))
         self.login.switch_to_registration_signal.connect(self.switch_to_registration)
         ## Registration
-        self.register.check_credentials_signal.connect(self.check_login)
+        self.register.check_credentials_signal.connect(lambda creds: self.check_login(creds, "register"))
         self.register.switch_to_login_signal.connect(self.switch_to_login)
         ## Dashboard
         self.dashboard.logout_signal.connect(self.logout_handler)
+        self.dashboard.open_email_signal.connect(self.open_email_handler)
+        self.dashboard.compose_signal.connect(lambda: self.goto("compose"))
+        self.dashboard.next_page_signal.connect(self.next_page_handler)
+        self.dashboard.save_attachment_signal.connect(self.save_attachment_handler)
+        self.dashboard.stop_reading_signal.connect(self.stop_reading_handler)
+        self.dashboard.search_signal.connect(self.search_handler)
+        ## Compose
+        self.compose.send_email_signal.connect(self.send_email_handler)
+        self.compose.cancel_signal.connect(lambda: self.goto("dashboard"))
         # Setup Backend Services
         ## Email
         self.email_thread = QtCore.QThread()
@@ -59,18 +72,48 @@ class MainWindow(QMainWindow):
         ### Setup communication signals with email worker
         self.email_worker.auth_reply_signal.connect(self.login_handler)
         self.email_worker.unread_email_signal.connect(self.add_unread_email)
+        self.email_worker.folder_email_signal.connect(self.add_folder_email)
+        self.email_worker.search_results_signal.connect(self.dashboard.show_search_results)
+        self.email_worker.body_loaded_signal.connect(self.dashboard.show_email)
+        self.email_worker.attachments_loaded_signal.connect(self.dashboard.show_attachments)
+        self.email_worker.attachment_saved_signal.connect(self.attachment_saved_handler)
+        self.email_worker.email_sent_signal.connect(self.email_sent_handler)
+        self.email_worker.page_loaded_signal.connect(self.dashboard.set_has_more)
         self.email_thread.start()
+        ## Speech
+        self.speech_thread = QtCore.QThread()
+        self.speech_worker = SpeechWidget()
+        self.speech_worker.moveToThread(self.speech_thread)
+        ### Emails are read aloud when opened, upcoming ones are synthesized ahead of time
+        self.email_worker.unread_email_signal.connect(self.speech_worker.add_email)
+        self.email_worker.body_prefetched_signal.connect(self.speech_worker.add_body)
+        self.email_worker.body_loaded_signal.connect(self.speech_worker.read_email)
+        self.speech_worker.body_needed_signal.connect(self.prefetch_body_handler)
+        self.speech_thread.start()
+        ## Voice commands
+        self.voice_thread = QtCore.QThread()
+        self.voice_worker = VoiceWidget()
+        self.voice_worker.moveToThread(self.voice_thread)
+        self.voice_worker.command_signal.connect(self.voice_command_handler)
+        self.voice_thread.start()
+        QtCore.QMetaObject.invokeMethod(self.voice_worker, 'listen', QtCore.Qt.QueuedConnection)
         ## Fingerprint sensor
-        self.fps_thread = QtCore.QThread()
-        self.fps_state = { "idle": True }
-        self.fps_worker = FingerprintWidget(self.fps_state)
-        self.fps_worker.moveToThread(self.fps_thread)
+        ### One worker thread per connected sensor, results are tagged with the device id
+        self.fps = FingerprintRegistry()
         ### Setup communication signals with fingerprint sensor
-        self.fps_worker.scan_complete_signal.connect(self.scan_handler)
-        self.fps_worker.error_encountered_signal.connect(self.reconnect_fps)
-        self.fps_worker.enrollment_stage_one_complete_signal.connect(self.register.continue_enrollment)
-        self.fps_worker.enrollment_stage_two_complete_signal.connect(self.enrollment_handler)
-        self.fps_thread.start()
+        self.fps.scan_complete_signal.connect(self.scan_handler)
+        self.fps.connected_signal.connect(self.fps_connected_handler)
+        self.fps.disconnected_signal.connect(self.fps_disconnected_handler)
+        self.fps.enrollment_stage_one_complete_signal.connect(self.enrollment_stage_one_handler)
+        self.fps.enrollment_stage_two_complete_signal.connect(self.enrollment_handler)
+        ### Waits (on a worker thread) until a sensor is found
+        self.fps.start()
+        ### closeEvent only tells the workers to stop, their threads are waited for once the window is gone
+        QApplication.instance().aboutToQuit.connect(self.fps.wait)
+        # Devices whose matches are being looked up, the database worker answers in order
+        self.pending_lookups = deque()
+        # "login" or "register" while credentials are being checked, None otherwise
+        self.auth_mode = None
         ## Database
         self.db_thread = QtCore.QThread()
         self.db_worker = DatabaseWidget()
@@ -86,7 +129,92 @@ class MainWindow(QMainWindow):
         ''' Passes emails to dashboard for display '''
         self.dashboard.add_email(email)
 
-    def enrollment_handler(self, message):
+    def add_folder_email(self, folder, email):
+        ''' Passes emails of the other folders (sent, archive) to the dashboard '''
+        self.dashboard.add_email(email, folder)
+
+    def search_handler(self, query):
+        ''' Called directly (not queued), searching only reads the local store so it does not wait for a fetch '''
+        self.email_worker.search(query)
+
+    def next_page_handler(self):
+        ''' Loads older emails once the dashboard is scrolled to the bottom '''
+        QtCore.QMetaObject.invokeMethod(self.email_worker, 'fetch_next_page', QtCore.Qt.QueuedConnection)
+
+    def open_email_handler(self, email):
+        ''' Loads the body of an email selected on the dashboard '''
+        self.speech_worker.stop_reading()
+        QtCore.QMetaObject.invokeMethod(self.email_worker, 'load_body', QtCore.Qt.QueuedConnection, QtCore.Q_ARG(object, email))
+
+    def stop_reading_handler(self):
+        ''' Called directly (not queued), the speech worker is busy while it reads '''
+        self.speech_worker.stop_reading()
+
+    def voice_command_handler(self, command):
+        ''' Runs a spoken command, commands only work on the dashboard (and 'stop' anywhere) '''
+        self.logger.debug(f"Voice command: {command}")
+        if command == "stop":
+            self.stop_reading_handler()
+        elif self.views.currentWidget() is not self.dashboard:
+            return
+        elif command == "read":
+            email = self.dashboard.current_email()
+            if email is not None:
+                self.open_email_handler(email)
+        elif command == "next":
+            email = self.dashboard.select_next()
+            if email is not None:
+                self.open_email_handler(email)
+        elif command == "reply":
+            email = self.dashboard.current_email()
+            if email is not None:
+                self.compose.reply(email)
+                self.goto("compose")
+        elif command == "compose":
+            self.compose.reset()
+            self.goto("compose")
+        elif command == "logout":
+            self.dashboard.logout()
+
+    def closeEvent(self, event):
+        ''' Stops the voice and fingerprint workers, both may be blocked (listening/waiting for the sensor) '''
+        self.voice_worker.stop_listening()
+        self.voice_thread.quit()
+        self.voice_thread.wait(1000)
+        # Also ends a running search for the fingerprint sensor
+        self.fps.close()
+        super().closeEvent(event)
+
+    def prefetch_body_handler(self, email):
+        ''' Loads the body of an upcoming email so it can be synthesized before it is opened '''
+        QtCore.QMetaObject.invokeMethod(self.email_worker, 'prefetch_body', QtCore.Qt.QueuedConnection, QtCore.Q_ARG(object, email))
+
+    def save_attachment_handler(self, details):
+        ''' Downloads an attachment selected on the dashboard '''
+        QtCore.QMetaObject.invokeMethod(self.email_worker, 'save_attachment', QtCore.Qt.QueuedConnection, QtCore.Q_ARG(tuple, details))
+
+    def attachment_saved_handler(self, name, path):
+        if path:
+            self.dashboard.show_status(f"Saved '{name}' to {path}")
+        else:
+            self.dashboard.show_status(f"Could not save '{name}'")
+
+    def send_email_handler(self, details):
+        ''' Hands the email over to the outbox and goes back to the dashboard right away '''
+        QtCore.QMetaObject.invokeMethod(self.email_worker, 'send_email', QtCore.Qt.QueuedConnection, QtCore.Q_ARG(tuple, details))
+        self.dashboard.show_status("Sending...")
+        self.goto("dashboard")
+
+    def email_sent_handler(self, is_sent, subject):
+        if is_sent:
+            self.dashboard.show_status(f"Sent '{subject}'")
+        else:
+            self.dashboard.show_status(f"Could not send '{subject}'")
+
+    def enrollment_stage_one_handler(self, device_id):
+        self.register.continue_enrollment()
+
+    def enrollment_handler(self, device_id, message):
         ''' Adds the credentials to database if the hash is generated '''
         is_finger_enrolled, characteristics_hash = message
         if is_finger_enrolled:
@@ -98,37 +226,57 @@ class MainWindow(QMainWindow):
             QtCore.QMetaObject.invokeMethod(self.db_worker, "add_credentials", QtCore.Qt.QueuedConnection, QtCore.Q_ARG(tuple, details))
         else:
             # Update the message on registration screen and try to enroll the finger again
-            self.fps_state["idle"] = True
             self.logger.debug("Failed to generate hash!")
-            QtCore.QMetaObject.invokeMethod(self.fps_worker, 'enroll_fingerprint', QtCore.Qt.QueuedConnection)
+            self.fps.enroll(device_id)
             self.register.repeat_enrollment()
 
-    def reconnect_fps(self):
-        ''' Reset the Fingerprint sensor '''
-        QtCore.QMetaObject.invokeMethod(self.fps_worker, 'reset_connection', QtCore.Qt.QueuedConnection)
+    def fps_connected_handler(self, device_id):
+        ''' The registry starts scanning (or enrolling) on new sensors by itself '''
+        self.logger.debug(f"Fingerprint sensor '{device_id}' connected")
+
+    def fps_disconnected_handler(self, device_id):
+        ''' The registry waits for the sensor to come back '''
+        self.logger.debug(f"Lost fingerprint sensor '{device_id}', waiting for it to be plugged in again")
 
-    def scan_handler(self, message):
-        ''' Handler fingerprint scan event '''
+    def scan_handler(self, device_id, message):
+        '''
+            Handler fingerprint scan event
+            - The first match stops every sensor until its login is done, matches which were already on
+                their way meanwhile are dropped
+            - A failed scan only restarts the sensor which scanned
+        '''
         is_successful, key = message
-        self.fps_state["idle"] = True
         if is_successful:
+            if self.pending_lookups or self.auth_mode is not None or self.views.currentWidget() is not self.login:
+                self.logger.debug(f"Dropping the match on '{device_id}', a login is already in progress")
+                return
             # Search for matching hash in database and start
-            self.logger.debug("Found a match for the fingerprint!")
+            self.logger.debug(f"Found a match for the fingerprint on '{device_id}'!")
             self.logger.debug("Searching for credentials in the database.")
+            self.fps.stop()
+            self.pending_lookups.append(device_id)
             QtCore.QMetaObject.invokeMethod(self.db_worker, 'fetch_credentials', QtCore.Qt.QueuedConnection, QtCore.Q_ARG(str, key))
         else:
             # Scan again
-            QtCore.QMetaObject.invokeMethod(self.fps_worker, 'scan', QtCore.Qt.QueuedConnection)
+            self.fps.scan(device_id)
 
     def login_handler(self, has_valid_creds):
-        ''' If login credentials are correct, switches view to dashboard '''
+        ''' If login credentials are correct, switches view to dashboard (login) or starts the enrollment (register) '''
+        mode, self.auth_mode = self.auth_mode, None
+        if mode is None:
+            self.logger.debug("Ignoring the reply to an abandoned credential check")
+            return
         if has_valid_creds:
             self.logger.debug("Given credentials were valid!")
-            if self.windowTitle() == self.login.windowTitle():
+            if mode == "login":
+                self.fps.stop()
                 self.dashboard.reset()
                 self.goto("dashboard")
                 # Start fetching emails
-                QtCore.QMetaObject.invokeMethod(self.email_worker, 'fetch_unread', QtCore.Qt.QueuedConnection)
+                QtCore.QMetaObject.invokeMethod(self.speech_worker, 'start', QtCore.Qt.QueuedConnection)
+                QtCore.QMetaObject.invokeMethod(self.email_worker, 'fetch_first_page', QtCore.Qt.QueuedConnection)
+                # Other folders are fetched concurrently on the email worker's asyncio loop
+                QtCore.QMetaObject.invokeMethod(self.email_worker, 'fetch_folders', QtCore.Qt.QueuedConnection)
             else: # else, this signal is for registration window
                 # Promote registration window for fingerprint registration
                 self.logger.debug("Starting fingerprint enrollment procedure")
@@ -136,29 +284,35 @@ class MainWindow(QMainWindow):
                 # Reset email worker
                 QtCore.QMetaObject.invokeMethod(self.email_worker, 'reset', QtCore.Qt.QueuedConnection)
                 # Start enrollment on fingerprint sensor
-                self.fps_state["idle"] = True
-                QtCore.QMetaObject.invokeMethod(self.fps_worker, 'enroll_fingerprint', QtCore.Qt.QueuedConnection)
+                self.fps.enroll()
         else:
             self.logger.debug("Invalid credentials encountered!")
-            if self.windowTitle() == self.login.windowTitle():
-                # Update message on login view
+            if mode == "login":
+                # Update message on login view and wait for the next finger
                 self.login.invalid_creds()
+                self.fps.scan()
             else:
                 self.register.invalid_creds()
 
-    def check_login(self, creds):
-        ''' Passes credentials to EmailWidget to check if these are valid '''
+    def check_login(self, creds, mode):
+        ''' Passes credentials to EmailWidget to check if these are valid, 'mode' ("login" or "register") tells what they are for '''
         self.logger.debug("Checking credentials")
+        self.auth_mode = mode
         QtCore.QMetaObject.invokeMethod(self.email_worker, 'check_credentials', QtCore.Qt.QueuedConnection, QtCore.Q_ARG(tuple, creds))
 
     def registered_user_login_handler(self, message):
         ''' If user credentials were found, pass them to email_worker for login. Else, scan again '''
         found, creds = message
-        if found: self.check_login(creds)
-        else: QtCore.QMetaObject.invokeMethod(self.fps_worker, 'scan', QtCore.Qt.QueuedConnection)
+        device_id = self.pending_lookups.popleft() if self.pending_lookups else None
+        if found: self.check_login(creds, "login")
+        elif device_id is not None:
+            # The cached hash of this template may be outdated, download it on the next match
+            self.fps.forget_last_match(device_id)
+            self.fps.scan()
 
     def logout_handler(self):
         ''' Clear all credentials '''
+        self.speech_worker.reset()
         QtCore.QMetaObject.invokeMethod(self.email_worker, 'reset', QtCore.Qt.QueuedConnection)
         self.login.reset()
         self.switch_to_login()
@@ -167,13 +321,14 @@ class MainWindow(QMainWindow):
 
     def switch_to_login(self):
         ''' Switch to login screen and start Fingerprint Scanning '''
-        self.fps_state["idle"] = True
-        QtCore.QMetaObject.invokeMethod(self.fps_worker, 'scan', QtCore.Qt.QueuedConnection)
+        self.auth_mode = None
+        self.fps.scan()
         self.login.reset()
         self.goto("login")
 
     def switch_to_registration(self):
-        self.fps_state["idle"] = True # Stop fingerprint sensor
+        self.auth_mode = None
+        self.fps.stop() # Stop fingerprint sensors
         self.register.reset()
         self.goto("register")
 
@@ -185,6 +340,8 @@ class MainWindow(QMainWindow):
             w = self.dashboard
         elif name == "register":
             w = self.register
+        elif name == "compose":
+            w = self.compose
         else:
             print(f"'{name}' does not exist.")
             return
@@ -0,0 +1,72 @@
+'''
+    compose.py
+
+    - Defines the view used to write a new email
+'''
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class ComposeView(QtWidgets.QWidget):
+
+    ''' Screen for writing a new email, the email is handed over to the outbox as soon as 'Send' is clicked '''
+
+    send_email_signal = QtCore.pyqtSignal(tuple) # (to, subject, body)
+    cancel_signal = QtCore.pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Compose - Lynx")
+        self.layout = QtWidgets.QVBoxLayout(self)
+        # Init UI Elements
+        self.header = QtWidgets.QLabel()
+        self.header.setText("New Email")
+        self.header.setFont(QtGui.QFont("Monsterrat", 20, 400))
+        self.to_input = QtWidgets.QLineEdit(self)
+        self.to_input.setPlaceholderText("To")
+        self.subject_input = QtWidgets.QLineEdit(self)
+        self.subject_input.setPlaceholderText("Subject")
+        self.body_input = QtWidgets.QPlainTextEdit(self)
+        self.body_input.setPlaceholderText("Message")
+        self.send_button = QtWidgets.QPushButton(self)
+        self.cancel_button = QtWidgets.QPushButton(self)
+        # Setup widgets
+        self.send_button.setText("Send")
+        self.send_button.setStyleSheet("color: white; background-color: #1062a8;")
+        self.send_button.clicked.connect(self.send)
+        self.cancel_button.setText("Cancel")
+        self.cancel_button.clicked.connect(self.cancel)
+        # Add widgets to layout
+        self.layout.addWidget(self.header)
+        self.layout.addWidget(self.to_input)
+        self.layout.addWidget(self.subject_input)
+        self.layout.addWidget(self.body_input)
+        self.layout.addWidget(self.send_button, 0, QtCore.Qt.AlignBottom | QtCore.Qt.AlignCenter)
+        self.layout.addWidget(self.cancel_button, 0, QtCore.Qt.AlignBottom | QtCore.Qt.AlignCenter)
+        # Set layout
+        self.setLayout(self.layout)
+
+    def reply(self, email):
+        ''' Fills in the recipient and subject for a reply to 'email' (MessageSummary) '''
+        self.reset()
+        subject = email.subject or ""
+        self.to_input.setText(email.sender or "")
+        self.subject_input.setText(subject if subject.lower().startswith("re:") else f"Re: {subject}")
+        self.body_input.setFocus()
+
+    def send(self):
+        to = self.to_input.text().strip()
+        subject = self.subject_input.text().strip()
+        body = self.body_input.toPlainText()
+        if len(to) > 0:
+            self.send_email_signal.emit((to, subject, body))
+            self.reset()
+
+    def cancel(self):
+        self.reset()
+        self.cancel_signal.emit()
+
+    def reset(self):
+        self.to_input.clear()
+        self.subject_input.clear()
+        self.body_input.clear()
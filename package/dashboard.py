@@ -7,41 +7,192 @@
 from PyQt5 import QtCore, QtWidgets
 
 
+# Folders which can be shown, the inbox is paged and the others are fetched as a whole (see EmailWidget)
+FOLDERS = (("inbox", "Inbox"), ("sent", "Sent"), ("archive", "Archive"))
+
 class DashboardView(QtWidgets.QWidget):
 
     ''' The main screen to do all Email related activities '''
 
     logout_signal = QtCore.pyqtSignal()
+    compose_signal = QtCore.pyqtSignal()
+    open_email_signal = QtCore.pyqtSignal(object) # MessageSummary
+    next_page_signal = QtCore.pyqtSignal()
+    save_attachment_signal = QtCore.pyqtSignal(tuple) # (MessageSummary, BodyPart)
+    stop_reading_signal = QtCore.pyqtSignal()
+    search_signal = QtCore.pyqtSignal(tuple) # (text, sender)
 
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Email Dashboard - Lynx")
         self.layout = QtWidgets.QVBoxLayout(self)
         # Init UI Elements
+        self.folder_box = QtWidgets.QComboBox(self)
+        self.search_box = QtWidgets.QLineEdit(self)
         self.email_list = QtWidgets.QListWidget(self)
+        self.email_body = QtWidgets.QTextEdit(self)
+        self.attachment_list = QtWidgets.QListWidget(self)
+        self.status = QtWidgets.QLabel(self)
         self.compose_button = QtWidgets.QPushButton(self)
         self.logout_button = QtWidgets.QPushButton(self)
         # Setup widgets
+        for folder, name in FOLDERS:
+            self.folder_box.addItem(name, folder)
+        self.folder_box.currentIndexChanged.connect(self.show_folder)
+        self.search_box.setPlaceholderText("Search mail")
+        self.search_box.returnPressed.connect(self.search)
+        self.folder = "inbox"
+        self.emails = {folder: [] for folder, _ in FOLDERS} # Emails of every folder, shown when it is selected
+        self.searching = False
         self.compose_button.setText("Compose")
         self.compose_button.setStyleSheet("color: white; background-color: #1062a8;")
+        self.compose_button.clicked.connect(self.compose)
         self.logout_button.setText("Logout")
         self.logout_button.setStyleSheet("color: white; background-color: #d90429;")
         self.logout_button.clicked.connect(self.logout)
+        self.email_list.itemActivated.connect(self.open_email)
+        self.email_list.verticalScrollBar().valueChanged.connect(self.scrolled)
+        self.has_more = False
+        self.loading_page = False
+        self.email_body.setReadOnly(True)
+        self.email_body.setVisible(False)
+        self.attachment_list.itemActivated.connect(self.save_attachment)
+        self.stop_shortcut = QtWidgets.QShortcut(QtCore.Qt.Key_Escape, self)
+        self.stop_shortcut.activated.connect(self.stop_reading_signal.emit)
+        self.attachment_list.setVisible(False)
         # Add widgets to layout
+        self.toolbar = QtWidgets.QHBoxLayout()
+        self.toolbar.addWidget(self.folder_box)
+        self.toolbar.addWidget(self.search_box)
+        self.layout.addLayout(self.toolbar)
         self.layout.addWidget(self.email_list)
+        self.layout.addWidget(self.email_body)
+        self.layout.addWidget(self.attachment_list)
+        self.layout.addWidget(self.status, 0, QtCore.Qt.AlignCenter)
         self.layout.addWidget(self.compose_button, 0, QtCore.Qt.AlignBottom | QtCore.Qt.AlignCenter)
         self.layout.addWidget(self.logout_button, 0, QtCore.Qt.AlignBottom | QtCore.Qt.AlignCenter)
         # Set layout        
         self.setLayout(self.layout)
 
-    def add_email(self, email):
-        ''' Adds the given email's 'Subject' to the list '''
-        self.email_list.addItem(email["Subject"])
+    def add_email(self, email, folder="inbox"):
+        ''' Adds an email to a folder, it is listed if that folder is shown '''
+        self.emails[folder].append(email)
+        if folder == self.folder and not self.searching:
+            self.list_email(email)
 
-    def logout(self):
+    def list_email(self, email):
+        '''
+            Adds the given email's 'Subject' to the list
+            - The list is kept newest first (by UID), so new mail goes on top and older pages below
+        '''
+        item = QtWidgets.QListWidgetItem(email.subject or "(No Subject)")
+        item.setData(QtCore.Qt.UserRole, email)
+        low, high = 0, self.email_list.count()
+        while low < high:
+            mid = (low + high) // 2
+            if self.email_list.item(mid).data(QtCore.Qt.UserRole).uid > email.uid:
+                low = mid + 1
+            else:
+                high = mid
+        self.email_list.insertItem(low, item)
+
+    def set_has_more(self, has_more):
+        ''' Called once a page is loaded, the next one is requested when the list is scrolled to the bottom '''
+        self.has_more = has_more
+        self.loading_page = False
+        self.scrolled(self.email_list.verticalScrollBar().value())
+
+    def scrolled(self, value):
+        if self.folder != "inbox" or self.searching:
+            return
+        if self.has_more and not self.loading_page and value >= self.email_list.verticalScrollBar().maximum():
+            self.loading_page = True
+            self.next_page_signal.emit()
+
+    def show_folder(self, index):
+        self.folder = self.folder_box.itemData(index) or "inbox"
+        self.searching = False
+        self.search_box.clear()
+        self.show_list(self.emails[self.folder])
+
+    def show_list(self, emails):
         self.email_list.clear()
+        for email in emails:
+            self.list_email(email)
+
+    def search(self):
+        ''' Searches synced emails, the results are shown by show_search_results. An empty search shows the folder again '''
+        text = self.search_box.text().strip()
+        if text:
+            self.search_signal.emit((text, None))
+        elif self.searching:
+            self.searching = False
+            self.show_list(self.emails[self.folder])
+
+    def show_search_results(self, query, emails):
+        if query[0] != self.search_box.text().strip(): # Results of an older search
+            return
+        self.searching = True
+        self.show_list(emails)
+        self.show_status(f"{len(emails)} email{'' if len(emails) == 1 else 's'} found")
+
+    def open_email(self, item):
+        ''' Asks for the body of the selected email, it is displayed by show_email '''
+        self.open_email_signal.emit(item.data(QtCore.Qt.UserRole))
+
+    def current_email(self):
+        ''' Returns the selected email (or the newest one if none is selected), None if the list is empty '''
+        item = self.email_list.currentItem() or self.email_list.item(0)
+        return item.data(QtCore.Qt.UserRole) if item is not None else None
+
+    def select_next(self):
+        ''' Selects the email below the current one, returns it (None if there is none) '''
+        row = self.email_list.currentRow() + 1
+        if row >= self.email_list.count():
+            return None
+        self.email_list.setCurrentRow(row)
+        self.email_list.scrollToItem(self.email_list.currentItem())
+        return self.email_list.currentItem().data(QtCore.Qt.UserRole)
+
+    def show_email(self, email, body):
+        self.email_body.setPlainText(body)
+        self.email_body.setVisible(True)
+
+    def show_attachments(self, email, attachments):
+        ''' Lists the attachments of the opened email, they are only downloaded when activated '''
+        self.attachment_list.clear()
+        for part in attachments:
+            item = QtWidgets.QListWidgetItem(f"{part.filename or part.section} ({part.size // 1024} KB)")
+            item.setData(QtCore.Qt.UserRole, (email, part))
+            self.attachment_list.addItem(item)
+        self.attachment_list.setVisible(len(attachments) > 0)
+
+    def save_attachment(self, item):
+        self.show_status("Saving...")
+        self.save_attachment_signal.emit(item.data(QtCore.Qt.UserRole))
+
+    def compose(self):
+        self.compose_signal.emit()
+
+    def show_status(self, message):
+        ''' Displays a short message (eg. outbox updates) below the list '''
+        self.status.setText(message)
+
+    def logout(self):
+        self.reset()
         self.logout_signal.emit()
 
     def reset(self):
         ''' Clear the list of emails '''
+        self.emails = {folder: [] for folder, _ in FOLDERS}
+        self.searching = False
+        self.search_box.clear()
+        self.folder_box.setCurrentIndex(0)
         self.email_list.clear()
+        self.has_more = False
+        self.loading_page = False
+        self.status.clear()
+        self.email_body.clear()
+        self.email_body.setVisible(False)
+        self.attachment_list.clear()
+        self.attachment_list.setVisible(False)
@@ -7,3 +7,4 @@
 from .dashboard import DashboardView
 from .login import LoginView
 from .registration import RegistrationView
+from .compose import ComposeView
@@ -1,26 +1,52 @@
 ''' widgets.py - Contains QObject classes wrapped around submodules '''
 
+import threading
+
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QApplication, QMainWindow
 
-from .mail import EmailSession
-from .fps import FingerprintSensor
+from .mail import EmailSession, EventLoopThread
+from .speech import SpeechSession
+from .voice import VoiceSession
+from .fps import FingerprintSensor, SensorRegistry
 from .database import DatabaseSession
 
 
 # Since FingerprintSensor class is already a QObject, it can be used directly
 #   without any wrappers.
 FingerprintWidget = FingerprintSensor
+# Runs one FingerprintWidget (on its own thread) for every connected sensor
+FingerprintRegistry = SensorRegistry
+
+# The inbox is paged (see EmailWidget.fetch_first_page), these folders are fetched with fetch_folders
+OTHER_FOLDERS = ("sent", "archive")
 
 
 class EmailWidget(QtCore.QObject):
 
     auth_reply_signal = QtCore.pyqtSignal(bool)
-    unread_email_signal = QtCore.pyqtSignal(dict)
+    unread_email_signal = QtCore.pyqtSignal(object) # MessageSummary
+    folder_email_signal = QtCore.pyqtSignal(str, object) # (folder, MessageSummary)
+    body_loaded_signal = QtCore.pyqtSignal(object, str) # (MessageSummary, body)
+    body_prefetched_signal = QtCore.pyqtSignal(object, str) # (MessageSummary, body)
+    attachments_loaded_signal = QtCore.pyqtSignal(object, object) # (MessageSummary, [BodyPart])
+    attachment_saved_signal = QtCore.pyqtSignal(str, str) # (file name, saved path or '' on failure)
+    email_sent_signal = QtCore.pyqtSignal(bool, str) # (was sent, subject)
+    page_loaded_signal = QtCore.pyqtSignal(bool) # has more pages
+    search_results_signal = QtCore.pyqtSignal(tuple, object) # ((text, sender), [MessageSummary])
 
     def __init__(self):
         super().__init__()
         self.session = EmailSession()
+        # Outbox reports back from its own thread
+        self.session.on_sent = lambda _, subject: self.email_sent_signal.emit(True, str(subject))
+        self.session.on_failed = lambda _, subject: self.email_sent_signal.emit(False, str(subject))
+        self.watch_stop = threading.Event()
+        # asyncio loop used for concurrent folder fetching
+        self.loop = EventLoopThread()
+        self.folder_fetch = None
+        # UID of the oldest message shown on the dashboard
+        self.page_cursor = None
 
     @QtCore.pyqtSlot(tuple)
     def check_credentials(self, creds):
@@ -32,12 +58,193 @@ class EmailWidget(QtCore.QObject):
     def fetch_unread(self):
         for email in self.session.fetch_unread():
             self.unread_email_signal.emit(email)
+        # Push new mail to the dashboard once the first sync is done
+        self.start_watching()
+
+    @QtCore.pyqtSlot()
+    def fetch_first_page(self):
+        ''' Syncs new messages and emits the newest page of the inbox '''
+        self.page_cursor = None
+        self.fetch_page()
+        # Push new mail to the dashboard once the first page is shown
+        self.start_watching()
+
+    @QtCore.pyqtSlot()
+    def fetch_next_page(self):
+        ''' Emits the next (older) page, called when the dashboard is scrolled to the bottom '''
+        if self.page_cursor is not None:
+            self.fetch_page()
+
+    def fetch_page(self):
+        emails, has_more = self.session.fetch_page(self.page_cursor)
+        for email in emails:
+            self.unread_email_signal.emit(email)
+        if emails:
+            self.page_cursor = emails[-1].uid
+        self.page_loaded_signal.emit(has_more)
+
+    def start_watching(self):
+        '''
+            Watches the inbox (IDLE/NOOP) on a separate thread so this worker can still receive
+                other requests, only newly arrived messages are emitted
+        '''
+        self.stop_watching()
+        self.watch_stop = threading.Event()
+        watcher = threading.Thread(target=self.watch, args=(self.watch_stop,), daemon=True)
+        watcher.start()
+
+    def watch(self, stop):
+        for email in self.session.watch(stop):
+            if stop.is_set():
+                return
+            self.unread_email_signal.emit(email)
+
+    def stop_watching(self):
+        self.watch_stop.set()
+
+    @QtCore.pyqtSlot(tuple)
+    def search(self, query):
+        '''
+            Searches synced emails locally, 'query' is (text, sender), either can be None
+            - Does not touch the IMAP connection, so it may also be called directly from the GUI thread
+                while this worker is busy fetching
+        '''
+        text, sender = query
+        self.search_results_signal.emit(query, self.session.search(text, sender))
+
+    @QtCore.pyqtSlot(tuple)
+    def send_email(self, details):
+        ''' Queues an email, returns immediately (the outbox sends it in the background) '''
+        to, subject, body = details
+        self.session.send_email(to, subject, body)
+
+    @QtCore.pyqtSlot(object)
+    def load_body(self, summary):
+        ''' Downloads (or takes from cache) the body of an opened message '''
+        try:
+            body = self.session.load_body(summary)
+            attachments = self.session.attachments(summary)
+        except Exception as err:
+            self.session.logger.error(f"Could not load message body [{err}]")
+            return
+        self.body_loaded_signal.emit(summary, body)
+        self.attachments_loaded_signal.emit(summary, attachments)
+
+    @QtCore.pyqtSlot(object)
+    def prefetch_body(self, summary):
+        ''' Loads a body before it is opened (i.e. so it can be synthesized ahead of time), it stays cached '''
+        try:
+            body = self.session.load_body(summary)
+        except Exception as err:
+            self.session.logger.debug(f"Could not prefetch message body [{err}]")
+            return
+        self.body_prefetched_signal.emit(summary, body)
+
+    @QtCore.pyqtSlot(tuple)
+    def save_attachment(self, details):
+        ''' Streams an attachment to disk, 'details' is (MessageSummary, BodyPart) '''
+        summary, part = details
+        try:
+            path = self.session.save_attachment(summary, part)
+        except Exception as err:
+            self.session.logger.error(f"Could not save attachment [{err}]")
+            path = ""
+        self.attachment_saved_signal.emit(part.filename or part.section, path)
+
+    @QtCore.pyqtSlot()
+    def fetch_folders(self):
+        '''
+            Fetches the OTHER_FOLDERS concurrently on the asyncio loop, returns at once
+            - Every message is emitted through 'folder_email_signal' as soon as it is parsed
+        '''
+        if not self.session.has_valid_creds:
+            return
+        self.cancel_folder_fetch()
+        self.folder_fetch = self.loop.submit(self.stream_folders(self.session.fetch_folders(OTHER_FOLDERS)))
+
+    async def stream_folders(self, results):
+        async for folder, email in results:
+            self.folder_email_signal.emit(folder, email)
+
+    def cancel_folder_fetch(self):
+        if self.folder_fetch is not None:
+            self.folder_fetch.cancel()
+            self.folder_fetch = None
 
     @QtCore.pyqtSlot()
     def reset(self):
+        self.page_cursor = None
+        self.stop_watching()
+        self.cancel_folder_fetch()
         self.session.reset()
 
 
+class SpeechWidget(QtCore.QObject):
+
+    '''
+        - Reads emails aloud, clips for the next few emails are synthesized ahead of time
+        - stop_reading and reset may be called directly from the GUI thread, since this worker is
+            blocked while it reads
+    '''
+
+    body_needed_signal = QtCore.pyqtSignal(object) # MessageSummary, body is needed for prefetching
+    reading_done_signal = QtCore.pyqtSignal(bool) # was read completely
+
+    def __init__(self):
+        super().__init__()
+        self.session = SpeechSession()
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        self.session.start()
+
+    @QtCore.pyqtSlot(object)
+    def add_email(self, email):
+        self.session.add_email(email)
+        self.request_bodies()
+
+    @QtCore.pyqtSlot(object, str)
+    def add_body(self, email, body):
+        self.session.add_body(email, body)
+
+    @QtCore.pyqtSlot(object, str)
+    def read_email(self, email, body):
+        done = self.session.read_email(email, body)
+        self.request_bodies()
+        self.reading_done_signal.emit(done)
+
+    def request_bodies(self):
+        for email in self.session.missing_bodies():
+            self.body_needed_signal.emit(email)
+
+    def stop_reading(self):
+        self.session.stop_reading()
+
+    def reset(self):
+        self.session.reset()
+
+
+class VoiceWidget(QtCore.QObject):
+
+    '''
+        - Listens for voice commands, each one is emitted as soon as it is recognized
+        - stop_listening may be called directly from the GUI thread, since this worker is blocked while it listens
+    '''
+
+    command_signal = QtCore.pyqtSignal(str) # command (see voice.COMMANDS)
+
+    def __init__(self):
+        super().__init__()
+        self.session = VoiceSession()
+
+    @QtCore.pyqtSlot()
+    def listen(self):
+        self.session.listen(lambda detection: self.command_signal.emit(detection.command))
+
+    def stop_listening(self):
+        self.session.stop_listening()
+
+
 class DatabaseWidget(QtCore.QObject):
     
     added_credentials_signal = QtCore.pyqtSignal()
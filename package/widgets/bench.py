@@ -0,0 +1,454 @@
+'''
+    widgets/bench.py - Benchmarks for submodules
+
+    - Mail benchmarks run against the local fake server (see mail/fakeserver.py), so they need no network
+    - Voice command benchmarks decode recorded 16-bit mono WAV files (see voice/)
+    - Run from the project root: python -m package.widgets.bench [--sizes 100 10000 100000] [--latency 0.01]
+        or python -m package.widgets.bench --voice command.wav [...]
+        or python -m package.widgets.bench --users [10 1000 10000 100000]
+        or python -m package.widgets.bench --readers [1 4 8] [--duration 5]
+        or python -m package.widgets.bench --fingerprint [--rounds 5] (R307 emulator, see fps/emulator.py)
+        or python -m package.widgets.bench --sensors [1 2 4] [--duration 5] (several R307 emulators)
+        or python -m package.widgets.bench --library [100 1000] (template backup/restore on R307 emulators)
+'''
+
+import os
+import time
+import random
+import secrets
+import threading
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+
+from package.widgets.mail import EmailSession, MessageStore
+from package.widgets.mail.fakeserver import FakeMailServer
+from package.widgets.voice import VoiceSession, wav_frames
+from package.widgets.database import DatabaseSession
+from package.widgets.fps.emulator import SensorEmulator, R307_LATENCY, CharBuffer, characteristics
+from package.widgets.fps.scheduler import DetectionScheduler
+
+
+MAIL_SIZES = (100, 10000, 100000)
+LOGIN_ROUNDS = 5
+USER_COUNTS = (10, 1000, 10000, 100000)
+LOOKUP_ROUNDS = 20
+STRESS_READERS = (1, 4, 8)
+SENSOR_COUNTS = (1, 2, 4)
+LIBRARY_SIZES = (100, 1000)
+# Polling strategies compared by the fingerprint benchmark
+POLLING = {
+    "busy": dict(min_interval=0, max_interval=0), # readImage in a loop, as before the scheduler
+    "active": dict(), # Finger placed shortly after activity
+    "idle": dict(fast_period=0), # Finger placed after the sensor was idle for a long time
+}
+# Seconds the sensor waits for a finger in every scan round
+FINGER_DELAY = 1
+
+EMAIL, PWD = "user@example.com", "password"
+
+
+def serve_mail(messages, latency, pipe):
+    ''' Runs the fake server in its own process, so it does not show up in the measured memory '''
+    server = FakeMailServer(messages, EMAIL, PWD, latency).start()
+    pipe.send((server.imap_address, server.smtp_address))
+    pipe.recv() # Wait until the benchmark is done
+    server.stop()
+
+
+def new_session(imap, smtp, directory):
+    store = MessageStore(os.path.join(directory, f"messages-{time.monotonic_ns()}.db"))
+    return EmailSession(store=store, imap_server=imap[0], imap_port=imap[1], smtp_server=smtp[0],
+        smtp_port=smtp[1], use_ssl=False)
+
+
+def bench_mail(messages, latency=0):
+    '''
+        Returns the measurements for an inbox of 'messages' messages:
+            - login: median check_credentials time (s)
+            - first_page: time until the first dashboard page is ready, starting from an empty store (s)
+            - fetch_rate: messages per second yielded by fetch_unread, starting from an empty store
+            - peak_memory: peak memory allocated while fetch_unread runs (MB)
+    '''
+    pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve_mail, args=(messages, latency, child_pipe), daemon=True)
+    server.start()
+    imap, smtp = pipe.recv()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            session = new_session(imap, smtp, directory)
+            timings = []
+            for _ in range(LOGIN_ROUNDS):
+                start = time.perf_counter()
+                assert session.check_credentials(EMAIL, PWD)
+                timings.append(time.perf_counter() - start)
+            results["login"] = statistics.median(timings)
+            session.reset()
+
+            session = new_session(imap, smtp, directory)
+            session.check_credentials(EMAIL, PWD)
+            start = time.perf_counter()
+            session.fetch_page()
+            results["first_page"] = time.perf_counter() - start
+            session.reset()
+
+            session = new_session(imap, smtp, directory)
+            session.check_credentials(EMAIL, PWD)
+            start = time.perf_counter()
+            count = sum(1 for _ in session.fetch_unread())
+            results["fetch_rate"] = count / (time.perf_counter() - start)
+            assert count == messages, f"fetched {count} of {messages} messages"
+            session.reset()
+
+            # Measured separately, tracing slows everything down
+            session = new_session(imap, smtp, directory)
+            session.check_credentials(EMAIL, PWD)
+            tracemalloc.start()
+            for _ in session.fetch_unread():
+                pass
+            results["peak_memory"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            session.reset()
+    finally:
+        pipe.send(None)
+        server.join()
+    return results
+
+
+def bench_database(users, extension=".db"):
+    '''
+        Returns the measurements for a database of 'users' enrolled users, the storage engine is picked
+        by 'extension' (see database/storage.py):
+            - open: time to open the database (s)
+            - add: median add_credentials time (s)
+            - hit: median get_credentials time for an enrolled finger (s)
+            - miss: median get_credentials time for an unknown finger (s)
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"database{extension}")
+        db = DatabaseSession(path)
+        keys = [secrets.token_hex(16) for _ in range(users)]
+        db.storage.add_many(db.record((f"user{i}@example.com", "password"), key) for i, key in enumerate(keys))
+        db.close()
+
+        results = {}
+        start = time.perf_counter()
+        db = DatabaseSession(path)
+        results["open"] = time.perf_counter() - start
+        timings = []
+        for i in range(LOOKUP_ROUNDS):
+            start = time.perf_counter()
+            db.add_credentials((f"new{i}@example.com", "password"), secrets.token_hex(16))
+            timings.append(time.perf_counter() - start)
+        results["add"] = statistics.median(timings)
+        for name, pick in (("hit", lambda: random.choice(keys)), ("miss", lambda: secrets.token_hex(16))):
+            timings = []
+            for _ in range(LOOKUP_ROUNDS):
+                key = pick()
+                start = time.perf_counter()
+                found, _ = db.get_credentials(key)
+                timings.append(time.perf_counter() - start)
+                assert found == (name == "hit")
+            results[name] = statistics.median(timings)
+        db.close()
+    return results
+
+
+def stress_writer(path, duration, written):
+    ''' Enrolls users one at a time for 'duration' seconds, 'written' holds the number enrolled so far '''
+    db = DatabaseSession(path)
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        i = written.value
+        db.add_credentials((f"writer{i}@example.com", "password"), f"w{i:031d}")
+        written.value = i + 1
+    db.close()
+
+
+def stress_reader(path, duration, seeded, written, results):
+    ''' Looks up random users for 'duration' seconds, every other lookup is for the newest enrolled user '''
+    db = DatabaseSession(path)
+    lookups, unseen = 0, 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        if lookups % 2 and written.value:
+            # Enrolled (committed) before this lookup started, so it must be found
+            i = written.value - 1
+            found, creds = db.get_credentials(f"w{i:031d}")
+            unseen += creds != (f"writer{i}@example.com", "password")
+        else:
+            i = random.randrange(seeded)
+            found, creds = db.get_credentials(f"s{i:031d}")
+            assert creds == (f"seed{i}@example.com", "password")
+        lookups += 1
+    db.close()
+    results.put((lookups, unseen))
+
+
+def bench_store(readers, duration=5, extension=".db", seeded=1000):
+    '''
+        Stress test for a database shared by 'readers' reader processes and one writer process:
+            - reads, writes: lookups and enrollments per second (all processes together)
+            - unseen: lookups of a committed enrollment which did not find it (must be 0)
+            - intact: every enrollment is stored once and readable afterwards
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"database{extension}")
+        db = DatabaseSession(path)
+        db.add_many_credentials(((f"seed{i}@example.com", "password"), f"s{i:031d}") for i in range(seeded))
+        db.close()
+
+        written, results = multiprocessing.Value("i", 0), multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=stress_writer, args=(path, duration, written))]
+        processes += [multiprocessing.Process(target=stress_reader, args=(path, duration, seeded, written, results))
+            for _ in range(readers)]
+        for process in processes:
+            process.start()
+        counts = [results.get() for _ in range(readers)]
+        for process in processes:
+            process.join()
+        assert all(process.exitcode == 0 for process in processes), "a stress test process failed"
+
+        db = DatabaseSession(path)
+        intact = db.storage.count() == seeded + written.value and all(
+            db.get_credentials(f"w{i:031d}") == (True, (f"writer{i}@example.com", "password"))
+            for i in range(written.value))
+        db.close()
+    return {
+        "reads": sum(lookups for lookups, _ in counts) / duration,
+        "writes": written.value / duration,
+        "unseen": sum(unseen for _, unseen in counts),
+        "intact": intact
+    }
+
+
+def bench_fingerprint(rounds=5, latency=R307_LATENCY, baud_rate=57600):
+    '''
+        Returns the measurements per polling strategy (see POLLING), on the R307 emulator:
+            - scan: median time from placing an enrolled finger to scan_complete_signal (s), cached hash
+            - cold_scan: the same when the template has to be downloaded (s)
+            - cpu: CPU used by the scanning thread while waiting for the finger (share of one core)
+            - polls: readImage commands per second while waiting
+        and 'enroll': time from placing the finger to enrollment_stage_two_complete_signal, including the
+        2s pause between the two scans (s)
+    '''
+    from package.widgets.fps import R307
+    results = {}
+    with SensorEmulator(latency, baud_rate) as emulator:
+        os.environ["LYNX_FPS_PORT"] = emulator.port
+        sensor = R307()
+        sensor.reset_connection()
+        events = []
+        sensor.scan_complete_signal.connect(lambda message: events.append(time.perf_counter()))
+        sensor.enrollment_stage_two_complete_signal.connect(lambda message: events.append(time.perf_counter()))
+        sensor.enrollment_stage_one_complete_signal.connect(lambda: threading.Timer(1, emulator.place_finger, ("enrolled",)).start())
+
+        emulator.place_finger("enrolled")
+        start = time.perf_counter()
+        sensor.enroll_fingerprint()
+        results["enroll"] = events[-1] - start
+
+        for name, settings in POLLING.items():
+            sensor.scheduler = DetectionScheduler(**settings)
+            timings, cold, cpu, polls = [], [], [], []
+            for round in range(rounds + 1):
+                emulator.remove_finger()
+                if round == 0:
+                    sensor.cache.clear()
+                placed = []
+                timer = threading.Timer(FINGER_DELAY, lambda: (placed.append(time.perf_counter()), emulator.place_finger("enrolled")))
+                reads, thread_time = emulator.commands.get("readImage", 0), time.thread_time()
+                timer.start()
+                sensor.scan()
+                (cold if round == 0 else timings).append(events[-1] - placed[0])
+                cpu.append((time.thread_time() - thread_time) / (events[-1] - placed[0] + FINGER_DELAY))
+                polls.append((emulator.commands["readImage"] - reads) / FINGER_DELAY)
+            results[name] = {"scan": statistics.median(timings), "cold_scan": cold[0],
+                "cpu": statistics.median(cpu), "polls": statistics.median(polls)}
+        sensor.dev = None
+    return results
+
+
+def bench_sensors(count, duration=5, latency=R307_LATENCY, baud_rate=57600):
+    '''
+        Runs a SensorRegistry on 'count' R307 emulators which scan (unknown fingers) in a loop, returns:
+            - connect: time until all sensors were connected (s)
+            - scan: median time of one scan on the first sensor (s)
+            - rate: scans per second on the first sensor, and 'total' on all of them
+    '''
+    from PyQt5 import QtCore
+    from package.widgets.fps import SensorRegistry
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    emulators = [SensorEmulator(latency, baud_rate).start() for _ in range(count)]
+    os.environ["LYNX_FPS_PORT"] = os.pathsep.join(emulator.port for emulator in emulators)
+    for emulator in emulators:
+        emulator.place_finger("unknown")
+    registry = SensorRegistry()
+    first, scans, connected = emulators[0].port, {}, []
+
+    def scan_handler(device_id, message):
+        scans.setdefault(device_id, []).append(time.perf_counter())
+        registry.scan(device_id)
+
+    def connected_handler(device_id):
+        connected.append(time.perf_counter())
+        if len(connected) == count:
+            QtCore.QTimer.singleShot(int(duration * 1000), app.quit)
+
+    registry.scan_complete_signal.connect(scan_handler)
+    registry.connected_signal.connect(connected_handler)
+    start = time.perf_counter()
+    registry.scan()
+    registry.start()
+    app.exec_()
+    registry.close()
+    registry.wait()
+    for emulator in emulators:
+        emulator.stop()
+    # Scans started before the last sensor connected are left out
+    times = [t for t in scans.get(first, []) if t > connected[-1]]
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    return {
+        "connect": connected[-1] - start,
+        "scan": statistics.median(intervals),
+        "rate": len(intervals) / (times[-1] - times[0]),
+        "total": sum(len([t for t in device if t > connected[-1]]) for device in scans.values()) / duration
+    }
+
+
+def bench_library(count, latency=R307_LATENCY, baud_rate=57600):
+    '''
+        Returns the transfer times (s) of a library of 'count' templates between R307 emulators:
+            - backup: sensor -> file
+            - restore: file -> empty sensor
+            - sync: sensor -> empty sensor, pipelined, and 'sequential': the same without the reader thread
+    '''
+    from package.widgets.fps import library
+    from package.widgets.fps.discovery import probe
+    results = {}
+    emulators = [SensorEmulator(latency, baud_rate).start() for _ in range(4)]
+    try:
+        source, restored, synced, sequential = (library.SensorLibrary(probe(emulator.port, 57600), emulator.port)
+            for emulator in emulators)
+        for position in range(count):
+            emulators[0].templates[position] = CharBuffer(position, characteristics(position, "template"))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "templates.fpl")
+            start = time.perf_counter()
+            library.backup(source.dev, path)
+            results["backup"] = time.perf_counter() - start
+            start = time.perf_counter()
+            library.restore(path, restored.dev)
+            results["restore"] = time.perf_counter() - start
+        start = time.perf_counter()
+        library.sync(source, synced)
+        results["sync"] = time.perf_counter() - start
+        start = time.perf_counter()
+        for position in sorted(source.positions()):
+            sequential.write(position, source.read(position))
+        results["sequential"] = time.perf_counter() - start
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+    return results
+
+
+def bench_voice(path, model_path=None):
+    '''
+        Returns the measurements for one recording:
+            - commands: [Detection] in the order they were recognized
+            - realtime_factor: decoding time / duration of the audio (must stay well below 1 for live use)
+        - Detection.latency is the delay between the end of a spoken command and it being reported
+    '''
+    session = VoiceSession() if model_path is None else VoiceSession(model_path)
+    if session.load_model() is None:
+        raise RuntimeError("vosk and a voice model are needed for voice benchmarks")
+    frames = list(wav_frames(path))
+    duration = sum(len(frame) // 2 / rate for frame, rate in frames)
+    start = time.perf_counter()
+    commands = list(session.recognize(frames))
+    elapsed = time.perf_counter() - start
+    return {"commands": commands, "realtime_factor": elapsed / duration if duration else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lynx benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=MAIL_SIZES, help="inbox sizes to benchmark")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every server response")
+    parser.add_argument("--voice", nargs="+", metavar="WAV", help="benchmark voice commands on these recordings")
+    parser.add_argument("--model", help="directory of the voice model")
+    parser.add_argument("--users", type=int, nargs="*", help="benchmark credential lookups for these user counts")
+    parser.add_argument("--readers", type=int, nargs="*", help="stress test a shared database with this many reader processes")
+    parser.add_argument("--duration", type=float, default=5, help="seconds each stress test runs")
+    parser.add_argument("--fingerprint", action="store_true", help="benchmark scans and enrollment on the R307 emulator")
+    parser.add_argument("--rounds", type=int, default=5, help="scans per polling strategy")
+    parser.add_argument("--sensors", type=int, nargs="*", help="benchmark scanning on this many emulated sensors at once")
+    parser.add_argument("--library", type=int, nargs="*", help="benchmark template backup/restore/sync for these library sizes")
+    args = parser.parse_args()
+
+    if args.voice:
+        print(f"{'recording':>24} {'realtime factor':>16}  commands (latency)")
+        for path in args.voice:
+            results = bench_voice(path, args.model)
+            commands = ", ".join(f"{detection.command} ({detection.latency * 1000:.0f} ms)"
+                if detection.latency is not None else detection.command for detection in results["commands"])
+            print(f"{os.path.basename(path):>24} {results['realtime_factor']:>16.2f}  {commands or '-'}")
+        return
+
+    if args.users is not None:
+        print(f"{'engine':>8} {'users':>10} {'open (ms)':>10} {'add (ms)':>9} {'hit (ms)':>9} {'miss (ms)':>10}")
+        for users in args.users or USER_COUNTS:
+            for engine, extension in (("tinydb", ".json"), ("sqlite", ".db")):
+                results = bench_database(users, extension)
+                print(f"{engine:>8} {users:>10} {results['open'] * 1000:>10.1f} {results['add'] * 1000:>9.2f} "
+                    f"{results['hit'] * 1000:>9.2f} {results['miss'] * 1000:>10.2f}")
+        return
+
+    if args.fingerprint:
+        print(f"{'sensor':>8} {'polling':>8} {'scan (ms)':>10} {'cold scan (ms)':>15} {'cpu (%)':>8} {'polls/s':>8} {'enroll (s)':>11}")
+        # R307 timings on a 57600 baud link, and a sensor which answers at once (worst case for polling)
+        for sensor, latency, baud_rate in (("r307", R307_LATENCY, 57600), ("instant", 0, None)):
+            results = bench_fingerprint(args.rounds, latency, baud_rate)
+            for name in POLLING:
+                r = results[name]
+                print(f"{sensor:>8} {name:>8} {r['scan'] * 1000:>10.0f} {r['cold_scan'] * 1000:>15.0f} "
+                    f"{r['cpu'] * 100:>8.1f} {r['polls']:>8.1f} {results['enroll']:>11.2f}")
+        return
+
+    if args.library is not None:
+        print(f"{'templates':>10} {'backup (s)':>11} {'restore (s)':>12} {'sync (s)':>9} {'sequential (s)':>15}")
+        for count in args.library or LIBRARY_SIZES:
+            results = bench_library(count)
+            print(f"{count:>10} {results['backup']:>11.1f} {results['restore']:>12.1f} {results['sync']:>9.1f} "
+                f"{results['sequential']:>15.1f}")
+        return
+
+    if args.sensors is not None:
+        print(f"{'sensors':>8} {'connect (s)':>12} {'scan (ms)':>10} {'scans/s':>8} {'total scans/s':>14}")
+        for count in args.sensors or SENSOR_COUNTS:
+            results = bench_sensors(count, args.duration)
+            print(f"{count:>8} {results['connect']:>12.2f} {results['scan'] * 1000:>10.0f} "
+                f"{results['rate']:>8.2f} {results['total']:>14.2f}")
+        return
+
+    if args.readers is not None:
+        print(f"{'engine':>8} {'readers':>8} {'reads/s':>9} {'writes/s':>9} {'unseen':>7} {'intact':>7}")
+        for readers in args.readers or STRESS_READERS:
+            for engine, extension in (("tinydb", ".json"), ("sqlite", ".db")):
+                results = bench_store(readers, args.duration, extension)
+                print(f"{engine:>8} {readers:>8} {results['reads']:>9.0f} {results['writes']:>9.0f} "
+                    f"{results['unseen']:>7} {'yes' if results['intact'] else 'NO':>7}")
+        return
+
+    print(f"{'messages':>10} {'login (ms)':>11} {'first page (ms)':>16} {'fetch (msg/s)':>14} {'peak (MB)':>10}")
+    for size in args.sizes:
+        results = bench_mail(size, args.latency)
+        print(f"{size:>10} {results['login'] * 1000:>11.1f} {results['first_page'] * 1000:>16.1f} "
+            f"{results['fetch_rate']:>14.0f} {results['peak_memory']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+'''
+    database [module]
+
+    - Encrypted credential store, records are looked up by fingerprint key
+'''
+
+from .session import DatabaseSession
+from .storage import TinyDBStorage, SQLiteStorage, open_storage
+from .migrate import migrate
+from .bulk import export_file, import_file
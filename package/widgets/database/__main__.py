@@ -0,0 +1,46 @@
+'''
+    Command line tools for the credential database, run from the project root:
+        - python -m package.widgets.database migrate [source] [target]
+        - python -m package.widgets.database export FILE [--database PATH]
+        - python -m package.widgets.database import FILE [--database PATH]
+'''
+
+import sys
+import time
+import argparse
+
+from .session import DatabaseSession
+from .migrate import migrate
+from .bulk import export_file, import_file
+
+
+def show_progress(count):
+    print(f"\r{count} records", end="", file=sys.stderr, flush=True)
+
+
+parser = argparse.ArgumentParser(description="Lynx credential database tools")
+commands = parser.add_subparsers(dest="command", required=True)
+command = commands.add_parser("migrate", help="copy the database to another storage engine")
+command.add_argument("source", nargs="?", default=DatabaseSession.LEGACY_DATABASE_PATH, help="database to copy (default: %(default)s)")
+command.add_argument("target", nargs="?", default=DatabaseSession.DATABASE_PATH, help="new database (default: %(default)s)")
+for name, description in (("export", "write every user to a JSON lines file"),
+        ("import", "add the users of an export (.jsonl) or provisioning (.csv: email, password, key) file")):
+    command = commands.add_parser(name, help=description)
+    command.add_argument("file")
+    command.add_argument("--database", default=DatabaseSession.DATABASE_PATH, help="default: %(default)s")
+args = parser.parse_args()
+
+start = time.perf_counter()
+if args.command == "migrate":
+    count = migrate(args.source, args.target)
+    print(f"Copied {count} records from '{args.source}' to '{args.target}'")
+else:
+    session = DatabaseSession(args.database)
+    try:
+        if args.command == "export":
+            count = export_file(session, args.file, show_progress)
+        else:
+            count = import_file(session, args.file, show_progress)
+    finally:
+        session.close()
+    print(f"\r{args.command.capitalize()}ed {count} records in {time.perf_counter() - start:.1f}s", file=sys.stderr)
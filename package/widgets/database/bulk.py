@@ -0,0 +1,51 @@
+'''
+    bulk.py
+
+    - Moves many users in and out of a database at once, files are streamed line by line
+    - Export files are JSON lines: the index key of the database first ({"index_key": ...}), then one
+        encrypted record per line, so they can be imported into another kiosk as they are
+    - Provisioning files are CSV files with 'email', 'password' and 'key' (fingerprint key) columns,
+        their users are encrypted while they are imported, keys are cut to 32 characters like the keys
+        of enrolled users
+    - Export files hold every user's encrypted credentials and the index key, they are only readable by
+        their owner
+'''
+
+import os
+import csv
+import json
+import itertools
+
+
+def export_file(session, path, progress=None):
+    ''' Writes every record of 'session' (DatabaseSession) to 'path', returns the number of records '''
+    count = 0
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+        if hasattr(os, "fchmod"): # An existing file keeps its mode otherwise
+            os.fchmod(descriptor, 0o600)
+        file.write(json.dumps({"index_key": session.storage.get_meta("index_key")}) + "\n")
+        for record in session.export_records(progress):
+            file.write(json.dumps(record) + "\n")
+            count += 1
+    return count
+
+
+def import_file(session, path, progress=None):
+    ''' Adds the users of an export ('.jsonl') or provisioning ('.csv') file, returns the number of users added '''
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(file)
+            missing = {"email", "password", "key"} - set(rows.fieldnames or ())
+            if missing:
+                raise ValueError(f"'{path}' has no {', '.join(sorted(missing))} column")
+            entries = (((row["email"], row["password"]), row["key"][:32]) for row in rows)
+            return session.add_many_credentials(entries, progress)
+        lines = (line for line in file if line.strip())
+        first = next(lines, None)
+        header = json.loads(first) if first is not None else {}
+        if "index_key" not in header and first is not None:
+            # Files without a header start with a record
+            header, lines = {}, itertools.chain([first], lines)
+        records = (json.loads(line) for line in lines)
+        return session.import_records(records, header.get("index_key"), progress)
@@ -0,0 +1,64 @@
+'''
+    lock.py
+
+    - Advisory file locks shared between processes (flock), many readers or one writer
+    - Locks are taken on a separate '<path>.lock' file, so the database file itself can be replaced
+    - Platforms without fcntl (Windows) get no locking, one instance at a time is safe there
+'''
+
+import logging
+
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock():
+
+    '''
+        FileLock - Lock on '<path>.lock'
+        - with lock.shared(): ... for readers, with lock.exclusive(): ... for the writer
+        - Not reentrant, threads of one process are serialized by a thread lock as well
+    '''
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.path = f"{path}.lock"
+        self.thread_lock = threading.Lock()
+        self.file = None
+        if fcntl is None:
+            self.logger.debug("File locks are not available on this platform")
+
+    def shared(self):
+        return self.Hold(self, fcntl.LOCK_SH if fcntl else None)
+
+    def exclusive(self):
+        return self.Hold(self, fcntl.LOCK_EX if fcntl else None)
+
+    def close(self):
+        with self.thread_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    class Hold():
+
+        def __init__(self, lock, mode):
+            self.lock = lock
+            self.mode = mode
+
+        def __enter__(self):
+            self.lock.thread_lock.acquire()
+            if self.mode is not None:
+                if self.lock.file is None:
+                    self.lock.file = open(self.lock.path, "a")
+                fcntl.flock(self.lock.file, self.mode)
+            return self
+
+        def __exit__(self, *args):
+            if self.mode is not None:
+                fcntl.flock(self.lock.file, fcntl.LOCK_UN)
+            self.lock.thread_lock.release()
@@ -0,0 +1,67 @@
+'''
+    migrate.py
+
+    - Copies a credential database from one storage engine to another (eg. database.json -> database.db)
+    - Records are copied as they are (still encrypted) along with the blind index key, so every user
+        can log in to the new database right away
+    - Run from the project root: python -m package.widgets.database migrate [source] [target]
+'''
+
+import logging
+
+import os
+
+from .storage import open_storage
+
+
+def migrate(source, target):
+    '''
+        Copies every record of 'source' into 'target' (both database paths), returns the number of records
+        - 'target' must not have any records yet, the source is left untouched
+        - The copy is made in a temporary file next to 'target' which replaces it once complete, so an
+            interrupted migration leaves no partial database behind and runs again on the next start
+    '''
+    logger = logging.getLogger(__name__)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"'{source}' does not exist")
+    if os.path.exists(target):
+        existing = open_storage(target)
+        try:
+            if existing.count() > 0:
+                raise ValueError(f"'{target}' already has records")
+        finally:
+            existing.close()
+    # Same extension, so the temporary file gets the same storage engine
+    root, extension = os.path.splitext(target)
+    temporary = f"{root}.migrating{extension}"
+    remove(temporary)
+    try:
+        old, new = open_storage(source), open_storage(temporary)
+        try:
+            for name, value in old.meta().items():
+                new.set_meta(name, value)
+            count = new.add_many(record for _, record in old.records())
+        finally:
+            old.close()
+            new.close()
+        # Closing the last connection checkpoints SQLite's write-ahead log into the file
+        descriptor = os.open(temporary, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+        os.replace(temporary, target)
+    except BaseException:
+        remove(temporary)
+        raise
+    finally:
+        remove(f"{temporary}.lock")
+    logger.debug(f"Migrated {count} records from '{source}' to '{target}'")
+    return count
+
+
+def remove(path):
+    ''' Removes a database file along with the journals SQLite may have left next to it '''
+    for name in (path, f"{path}-wal", f"{path}-shm", f"{path}-journal"):
+        if os.path.exists(name):
+            os.remove(name)
@@ -0,0 +1,174 @@
+''' 
+    session.py 
+    
+    - Contains handler class for database used in this project 
+    - By default, database is set to 'database.db' (SQLite, see storage.py) in the project root directory,
+        an existing 'database.json' is copied into it the first time (see migrate.py)
+    - Several processes (kiosk instances, provisioning tools) may use the same database at once, new
+        enrollments are seen by all of them (see storage.py)
+    - Records are found through a blind index (keyed hash of the fingerprint key), so a login costs one
+        index probe and one decrypt however many users are enrolled
+'''
+
+import logging
+
+import os
+import hmac
+import base64
+import hashlib
+import secrets
+from cryptography.fernet import Fernet
+
+from .storage import open_storage
+from .migrate import migrate
+from .lock import FileLock
+
+
+class DatabaseSession():
+
+    PUBLIC_KEY = "lynx"
+    DATABASE_PATH = "./database.db"
+    # Database used before SQLite storage, copied into DATABASE_PATH once
+    LEGACY_DATABASE_PATH = "./database.json"
+    # Size (bytes) of the secret the blind index is keyed with
+    INDEX_KEY_SIZE = 32
+    # Bulk imports and exports report progress every this many records
+    PROGRESS_INTERVAL = 1000
+
+    def __init__(self, path=DATABASE_PATH):
+        self.logger = logging.getLogger(__name__)
+        if path == self.DATABASE_PATH and os.path.exists(self.LEGACY_DATABASE_PATH):
+            # Other instances may start at the same time, only one of them copies the old database
+            lock = FileLock(path)
+            with lock.exclusive():
+                if not os.path.exists(path):
+                    count = migrate(self.LEGACY_DATABASE_PATH, path)
+                    self.logger.debug(f"Copied {count} users from '{self.LEGACY_DATABASE_PATH}' to '{path}'")
+            lock.close()
+        self.storage = open_storage(path)
+        self.index_key = self.load_index_key()
+
+    def load_index_key(self):
+        ''' Returns the secret the blind index is keyed with, creating it for a new database '''
+        index_key = self.storage.get_meta('index_key')
+        if index_key is None:
+            # Another process may have created it in the meantime, the first one wins
+            index_key = base64.b64encode(secrets.token_bytes(self.INDEX_KEY_SIZE)).decode('ascii')
+            index_key = self.storage.setdefault_meta('index_key', index_key)
+        return base64.b64decode(index_key)
+
+    def blind_index(self, key):
+        ''' Keyed hash of a fingerprint key, identifies its record without revealing the key '''
+        return hmac.new(self.index_key, key.encode('ascii'), hashlib.sha256).hexdigest()
+
+    def encrypt(self, data, key):
+        '''
+            data: given list of strings to be encrypted
+            key: base64 encoded key
+        '''
+        f, results = Fernet(key), []
+        for s in data:
+            token = f.encrypt(bytes(s, 'utf-8'))
+            results.append(token.decode('ascii'))
+        return results
+
+    def decrypt(self, data, key):
+        f, results = Fernet(key), []
+        for s in data:
+            try:
+                token = f.decrypt(bytes(s, 'utf-8'))
+                results.append(token.decode('ascii'))
+            except:
+                results.append("0x0")
+        return results
+
+    def record(self, creds, encryption_key):
+        ''' Returns the encrypted, indexed record for the given credentials '''
+        b64_key = base64.b64encode(encryption_key.encode('ascii'))
+        public_key, email, pwd = self.encrypt([self.PUBLIC_KEY, *creds], b64_key)
+        return {
+            'key': public_key,
+            'email': email,
+            'password': pwd,
+            'index': self.blind_index(encryption_key)
+        }
+
+    def add_credentials(self, creds, encryption_key):
+        # Add encrypted credentials to database
+        self.storage.add(self.record(creds, encryption_key))
+        self.logger.debug("Added new user to the database!")
+
+    def add_many_credentials(self, entries, progress=None):
+        '''
+            Adds many users at once, returns the number of users added
+            - entries: iterable of (creds, encryption_key), read one at a time so a generator keeps memory flat
+            - All users are written in one transaction (SQLite) or one file write (TinyDB)
+            - 'progress' is called with the number of users encrypted so far
+        '''
+        records = (self.record(creds, key) for creds, key in entries)
+        count = self.storage.add_many(self.counted(records, progress))
+        self.logger.debug(f"Added {count} users to the database!")
+        return count
+
+    def export_records(self, progress=None):
+        ''' Yields every record as it is stored (encrypted), 'progress' is called with the number yielded so far '''
+        return self.counted((record for _, record in self.storage.records()), progress)
+
+    def import_records(self, records, index_key=None, progress=None):
+        '''
+            Adds records exported from another database (see export_records) in one transaction,
+            returns the number of records added
+            - index_key: index key of the database the records come from (base64), an empty database takes
+                it over, otherwise indexes made with a different key are dropped and rebuilt at each user's
+                next login
+        '''
+        if index_key is not None and base64.b64decode(index_key) != self.index_key and self.storage.count() == 0:
+            self.storage.set_meta('index_key', index_key)
+            self.index_key = base64.b64decode(index_key)
+        keep_index = index_key is not None and base64.b64decode(index_key) == self.index_key
+        records = ({**record, 'index': record.get('index') if keep_index else None} for record in records)
+        count = self.storage.add_many(self.counted(records, progress))
+        self.logger.debug(f"Imported {count} records!")
+        return count
+
+    def counted(self, items, progress):
+        ''' Passes 'items' through, calling 'progress' every PROGRESS_INTERVAL items and at the end '''
+        count = 0
+        for item in items:
+            yield item
+            count += 1
+            if progress is not None and count % self.PROGRESS_INTERVAL == 0:
+                progress(count)
+        if progress is not None and count % self.PROGRESS_INTERVAL != 0:
+            progress(count)
+
+    def get_credentials(self, decryption_key):
+        b64_key = base64.b64encode(decryption_key.encode('ascii'))
+        index = self.blind_index(decryption_key)
+        found = self.storage.find(index)
+        if found is not None and self.decrypt([found[1]['key']], b64_key)[0] == self.PUBLIC_KEY:
+            return self.found(found[1], b64_key)
+        # Records from before the index are searched the old way, and indexed once found
+        for doc_id in self.storage.unindexed():
+            item = self.storage.get(doc_id)
+            if item is not None and self.decrypt([item['key']], b64_key)[0] == self.PUBLIC_KEY:
+                self.storage.set_index(doc_id, index)
+                self.logger.debug("Indexed user record!")
+                return self.found(item, b64_key)
+        # User not found!
+        self.logger.debug("Could not find the user!")
+        return (False, None)
+
+    def found(self, item, b64_key):
+        # Get credentials
+        email, pwd = item['email'], item['password']
+        email, pwd = self.decrypt([email, pwd], b64_key)
+        self.logger.debug("Found user record!")
+        return (True, (email, pwd))
+
+    def close(self):
+        self.storage.close()
+
+    # Only used for tests
+    def erase_everything(self):
+        self.storage.truncate()
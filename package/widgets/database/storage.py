@@ -0,0 +1,334 @@
+'''
+    storage.py
+
+    - Storage engines for DatabaseSession, picked by file extension (see open_storage)
+        - TinyDBStorage: '.json' files, the original format
+        - SQLiteStorage: everything else, SQLite in WAL mode
+    - Records are dicts with the encrypted 'key', 'email' and 'password' fields and the blind 'index'
+        (None for records added before the index existed)
+    - Every engine provides:
+        - get_meta(name), set_meta(name, value), setdefault_meta(name, value), meta(): small settings
+            (eg. the blind index key)
+        - add(record) -> id, add_many(records) -> count: add_many writes all records at once
+        - get(id), find(index) -> (id, record) of the oldest record with that index, or None
+        - unindexed() -> ids of records without an index, set_index(id, index)
+        - records() -> (id, record) of every record, count(), truncate(), close()
+'''
+
+import logging
+
+import os
+import sqlite3
+import threading
+from tinydb import TinyDB, Query
+from tinydb.storages import JSONStorage
+from tinydb.middlewares import CachingMiddleware
+
+from .lock import FileLock
+
+
+FIELDS = ("key", "email", "password", "index")
+# Records read at a time by SQLiteStorage.records
+BATCH_SIZE = 1000
+# Seconds an SQLite connection waits for another process to finish writing
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS credentials (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        email TEXT NOT NULL,
+        password TEXT NOT NULL,
+        blind_index TEXT
+    );
+    CREATE INDEX IF NOT EXISTS credentials_blind_index ON credentials (blind_index);
+"""
+
+
+def open_storage(path):
+    ''' Returns the engine for a database file, '.json' files are TinyDB databases '''
+    if str(path).endswith(".json"):
+        return TinyDBStorage(path)
+    return SQLiteStorage(path)
+
+
+class TinyDBStorage():
+
+    '''
+        TinyDBStorage - Records in a TinyDB JSON file
+        - Records are read from memory, every write is flushed to disk right away (rewriting the whole file)
+        - The blind index is kept in memory, it is rebuilt whenever the file was changed by another process
+        - Processes share the file through a FileLock: many readers, or one writer which reloads the
+            file first if it changed, so no write is lost
+    '''
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.lock = FileLock(path)
+        self.db = None
+        self.version = None # (mtime, size) of the file when it was loaded
+        self.index = {} # blind index -> document id
+        self.missing = set() # Document ids of records without an index
+        with self.lock.exclusive():
+            self.reload()
+
+    def file_version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        ''' Reads the file again, called with the lock held '''
+        if self.db is not None:
+            self.db.close()
+        self.db = TinyDB(self.path, storage=CachingMiddleware(JSONStorage))
+        self.meta_table = self.db.table("meta")
+        self.index.clear()
+        self.missing.clear()
+        for item in self.db:
+            self.track(item.doc_id, item)
+        self.version = self.file_version()
+
+    def refresh(self):
+        ''' Picks up changes made by other processes, called with the lock held '''
+        if self.file_version() != self.version:
+            self.logger.debug("Database was changed by another process, reloading")
+            self.reload()
+
+    def reading(self):
+        return Access(self, self.lock.shared())
+
+    def writing(self):
+        return Access(self, self.lock.exclusive())
+
+    def track(self, doc_id, record):
+        if record.get('index') is not None:
+            # The oldest record wins if a finger was enrolled twice
+            self.index.setdefault(record['index'], doc_id)
+        else:
+            self.missing.add(doc_id)
+
+    def flush(self):
+        self.db.storage.flush()
+        self.version = self.file_version()
+
+    def get_meta(self, name):
+        with self.reading():
+            item = self.meta_table.get(Query()[name].exists())
+        return item[name] if item is not None else None
+
+    def set_meta(self, name, value):
+        with self.writing():
+            self.meta_table.upsert({name: value}, Query()[name].exists())
+            self.flush()
+
+    def setdefault_meta(self, name, value):
+        ''' Stores 'value' unless 'name' is set already, returns the stored value '''
+        with self.writing():
+            item = self.meta_table.get(Query()[name].exists())
+            if item is not None:
+                return item[name]
+            self.meta_table.insert({name: value})
+            self.flush()
+        return value
+
+    def meta(self):
+        meta = {}
+        with self.reading():
+            for item in self.meta_table:
+                meta.update(item)
+        return meta
+
+    def add(self, record):
+        record = {field: record.get(field) for field in FIELDS}
+        with self.writing():
+            doc_id = self.db.insert(record)
+            self.flush()
+            self.track(doc_id, record)
+        return doc_id
+
+    def add_many(self, records):
+        records = [{field: record.get(field) for field in FIELDS} for record in records]
+        with self.writing():
+            for doc_id, record in zip(self.db.insert_multiple(records), records):
+                self.track(doc_id, record)
+            self.flush()
+        return len(records)
+
+    def get(self, doc_id):
+        with self.reading():
+            item = self.db.get(doc_id=doc_id)
+        return dict(item) if item is not None else None
+
+    def find(self, index):
+        with self.reading():
+            doc_id = self.index.get(index)
+            item = self.db.get(doc_id=doc_id) if doc_id is not None else None
+        return (doc_id, dict(item)) if item is not None else None
+
+    def unindexed(self):
+        with self.reading():
+            return sorted(self.missing)
+
+    def set_index(self, doc_id, index):
+        with self.writing():
+            self.db.update({'index': index}, doc_ids=[doc_id])
+            self.flush()
+            self.missing.discard(doc_id)
+            self.index.setdefault(index, doc_id)
+
+    def records(self):
+        with self.reading():
+            items = [(item.doc_id, dict(item)) for item in self.db]
+        yield from items
+
+    def count(self):
+        with self.reading():
+            return len(self.db)
+
+    def truncate(self):
+        with self.writing():
+            self.db.truncate()
+            self.flush()
+            self.index.clear()
+            self.missing.clear()
+
+    def close(self):
+        self.db.close()
+        self.lock.close()
+
+
+class Access():
+
+    ''' Holds a lock of a TinyDBStorage, the file is reloaded first if another process changed it '''
+
+    def __init__(self, storage, hold):
+        self.storage = storage
+        self.hold = hold
+
+    def __enter__(self):
+        self.hold.__enter__()
+        try:
+            self.storage.refresh()
+        except BaseException:
+            self.hold.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *args):
+        self.hold.__exit__(*args)
+
+
+class SQLiteStorage():
+
+    '''
+        SQLiteStorage - Records in an SQLite database
+        - WAL mode, so other connections (and processes) keep reading while a record is written
+        - Lookups go through an SQL index on the blind index, inserts only append a row, so neither
+            depends on the number of users
+        - Can be used from multiple threads and processes, each statement sees every write committed
+            before it started (new enrollments show up without reopening)
+    '''
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        mode, = self.db.execute("PRAGMA journal_mode = WAL").fetchone()
+        if mode != "wal": # eg. in-memory databases
+            self.logger.debug(f"Database is in '{mode}' journal mode")
+        # Committed transactions survive a crash, only a power loss may undo the last ones
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    @staticmethod
+    def record(row):
+        return dict(zip(FIELDS, row))
+
+    def get_meta(self, name):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, name, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def setdefault_meta(self, name, value):
+        ''' Stores 'value' unless 'name' is set already, returns the stored value '''
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES (?, ?)", (name, value))
+            return self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()[0]
+
+    def meta(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT name, value FROM meta"))
+
+    def add(self, record):
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO credentials (key, email, password, blind_index) VALUES (?, ?, ?, ?)",
+                tuple(record.get(field) for field in FIELDS))
+        return cursor.lastrowid
+
+    def add_many(self, records):
+        ''' Adds all records in one transaction, 'records' may be any iterable (eg. a generator) '''
+        with self.lock, self.db:
+            cursor = self.db.executemany(
+                "INSERT INTO credentials (key, email, password, blind_index) VALUES (?, ?, ?, ?)",
+                (tuple(record.get(field) for field in FIELDS) for record in records))
+        return cursor.rowcount
+
+    def get(self, doc_id):
+        with self.lock:
+            row = self.db.execute("SELECT key, email, password, blind_index FROM credentials WHERE id = ?",
+                (doc_id,)).fetchone()
+        return self.record(row) if row is not None else None
+
+    def find(self, index):
+        with self.lock:
+            row = self.db.execute("SELECT id, key, email, password, blind_index FROM credentials "
+                "WHERE blind_index = ? ORDER BY id LIMIT 1", (index,)).fetchone()
+        return (row[0], self.record(row[1:])) if row is not None else None
+
+    def unindexed(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute(
+                "SELECT id FROM credentials WHERE blind_index IS NULL ORDER BY id")]
+
+    def set_index(self, doc_id, index):
+        with self.lock, self.db:
+            self.db.execute("UPDATE credentials SET blind_index = ? WHERE id = ?", (index, doc_id))
+
+    def records(self):
+        ''' Reads the records in batches, so the lock is not held while the caller works on them '''
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute("SELECT id, key, email, password, blind_index FROM credentials "
+                    "WHERE id > ? ORDER BY id LIMIT ?", (last_id, BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], self.record(row[1:])
+            last_id = rows[-1][0]
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM credentials").fetchone()[0]
+
+    def truncate(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM credentials")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
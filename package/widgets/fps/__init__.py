@@ -7,6 +7,13 @@
 # Custom classess can also be added here for other sensors
 # [NOTE] They must have the same interface/functions as the default class
 from .r307 import R307
+from .scheduler import DetectionScheduler
+from .cache import TemplateCache
+from .discovery import DeviceManager
+from .library import LibraryFile, SensorLibrary, backup, restore, diff, sync
 
 # Set to the fingerprint sensor you want to use
 FingerprintSensor = R307
+
+# Serves several sensors of this class at once
+from .registry import SensorRegistry
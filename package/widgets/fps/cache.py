@@ -0,0 +1,79 @@
+'''
+    cache.py
+
+    - Remembers the characteristics hash of every template position on the sensor, so a match can go
+        straight to the database instead of downloading the template again
+    - Entries are only trusted while the sensor's template index (the positions in use, a few short
+        commands to read) is the same as when they were cached, any change elsewhere (another tool, a cleared
+        sensor) starts over
+    - Templates written by this process without the cache (eg. a restore or sync, see fps/library.py) drop
+        the entries of every cache (see TemplateCache.invalidate), since a template replaced at the same
+        position does not change the index
+    - Kept in memory only, the hashes are the keys of the stored credentials and must not be written to disk
+'''
+
+import logging
+
+import threading
+
+
+class TemplateCache():
+
+    '''
+        TemplateCache - Template position -> characteristics hash for one sensor
+        - 'positions' is the set of template positions in use the sensor reported, entries cached while other
+            positions were in use, or before the last invalidate(), are dropped
+    '''
+
+    # Bumped by invalidate(), shared by the caches of all sensors
+    generation = 0
+    generation_lock = threading.Lock()
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.state = None # (generation, positions in use) at which the entries are valid
+        self.hashes = {}
+
+    @classmethod
+    def invalidate(cls):
+        ''' Drops the entries of every cache, called after templates were written to a sensor behind their back '''
+        with cls.generation_lock:
+            cls.generation += 1
+
+    def current(self, positions):
+        return (TemplateCache.generation, frozenset(positions))
+
+    def lookup(self, position, positions):
+        ''' Returns the cached hash for a position, or None if it is unknown or the cache is stale '''
+        with self.lock:
+            if self.current(positions) != self.state:
+                return None
+            return self.hashes.get(position)
+
+    def store(self, position, characteristics_hash, positions):
+        ''' Caches the hash of a template which was downloaded while 'positions' were in use on the sensor '''
+        state = self.current(positions)
+        with self.lock:
+            if state != self.state:
+                if self.state is not None:
+                    self.logger.debug("Templates on the sensor changed, dropping cached hashes")
+                self.state, self.hashes = state, {}
+            self.hashes[position] = characteristics_hash
+
+    def enrolled(self, position, characteristics_hash, positions_before):
+        ''' Caches a template this host just stored, earlier entries stay valid if nothing else changed '''
+        state = self.current(positions_before)
+        with self.lock:
+            if state != self.state:
+                self.hashes = {}
+            self.state = (state[0], state[1] | {position})
+            self.hashes[position] = characteristics_hash
+
+    def forget(self, position):
+        with self.lock:
+            self.hashes.pop(position, None)
+
+    def clear(self):
+        with self.lock:
+            self.state, self.hashes = None, {}
@@ -0,0 +1,165 @@
+'''
+    discovery.py
+
+    - Finds the fingerprint sensor: every candidate serial port (USB serial adapters, or LYNX_FPS_PORT)
+        is probed with verifyPassword
+    - Waits for hot-plug events while no sensor answers, through udev (if 'pyudev' is installed) or by
+        looking for new devices in /dev every POLL_INTERVAL, so an absent sensor costs next to no CPU
+    - Ports which are there but do not answer are retried with exponential backoff and jitter, a new
+        device resets the backoff and is probed at once
+    - Several managers (one per sensor, see fps/registry.py) can share a set of claimed ports, a port is
+        only probed and used by one of them
+'''
+
+import logging
+
+import os
+import glob
+import random
+import threading
+from sys import platform
+
+from pyfingerprint.pyfingerprint import PyFingerprint
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+# Device files of USB serial adapters, in order of preference
+PORT_PATTERNS = ("/dev/ttyUSB*", "/dev/ttyACM*", "/dev/cu.usbserial*", "/dev/cu.SLAB*", "/dev/cu.usbmodem*")
+# Seconds between looks for new devices (without udev)
+POLL_INTERVAL = 0.5
+# Seconds before the first retry of ports which did not answer, doubled up to MAX_BACKOFF
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+WINDOWS = platform.startswith("win")
+
+# Guards the claimed ports shared between managers
+CLAIM_LOCK = threading.Lock()
+
+
+def candidate_ports():
+    '''
+        Serial ports the sensor may be on
+        - LYNX_FPS_PORT (eg. the emulator) replaces the search, several ports are separated by os.pathsep
+    '''
+    ports = os.environ.get("LYNX_FPS_PORT")
+    if ports:
+        return [port for port in ports.split(os.pathsep) if port and (os.path.exists(port) or WINDOWS)]
+    if WINDOWS:
+        from serial.tools import list_ports
+        return [info.device for info in list_ports.comports() if "USB" in (info.hwid or "")]
+    return [port for pattern in PORT_PATTERNS for port in sorted(glob.glob(pattern))]
+
+
+def probe(port, baud_rate, password=0):
+    ''' Returns a connected PyFingerprint if a sensor answers on 'port', otherwise None '''
+    logger = logging.getLogger(__name__)
+    try:
+        dev = PyFingerprint(port, baud_rate, password=password)
+        if dev.verifyPassword():
+            return dev
+        logger.error(f"Sensor on '{port}' rejected the password")
+    except Exception as err:
+        logger.debug(f"No sensor on '{port}' [{err}]")
+    return None
+
+
+class DeviceManager():
+
+    '''
+        DeviceManager - Connects to the sensor and waits for it to come back after it was unplugged
+        Args:
+            baud_rate: baud rate of the sensor
+            closed: threading.Event which ends a running connect() (eg. when the app quits)
+            claimed: set of ports in use, shared with the managers of other sensors
+    '''
+
+    def __init__(self, baud_rate, closed=None, claimed=None):
+        self.logger = logging.getLogger(__name__)
+        self.baud_rate = baud_rate
+        self.closed = closed if closed is not None else threading.Event()
+        self.claimed = claimed if claimed is not None else set()
+        self.port = None # Port of the last connection, tried first
+        self.monitor = None
+        if pyudev is not None:
+            try:
+                self.monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+                self.monitor.filter_by("tty")
+                self.monitor.start()
+            except Exception as err:
+                self.logger.debug(f"udev is not available, polling for devices [{err}]")
+                self.monitor = None
+
+    def ports(self):
+        ''' Candidate ports which are not claimed, the port of the last connection first '''
+        ports = [port for port in candidate_ports() if port not in self.claimed]
+        if self.port in ports:
+            ports.remove(self.port)
+            ports.insert(0, self.port)
+        return ports
+
+    def claim(self, port):
+        ''' Returns False if another manager uses the port '''
+        with CLAIM_LOCK:
+            if port in self.claimed:
+                return False
+            self.claimed.add(port)
+            return True
+
+    def release(self, port):
+        with CLAIM_LOCK:
+            self.claimed.discard(port)
+
+    def connect(self):
+        '''
+            Blocks until a sensor answers, returns (port, PyFingerprint)
+            - The port stays claimed until release() is called
+            - Returns (None, None) if 'closed' was set
+        '''
+        backoff = MIN_BACKOFF
+        while not self.closed.is_set():
+            ports = self.ports()
+            for port in ports:
+                if not self.claim(port):
+                    continue
+                dev = probe(port, self.baud_rate)
+                if dev is not None:
+                    self.port = port
+                    self.logger.debug(f"Found the fingerprint sensor on '{port}'")
+                    return port, dev
+                self.release(port)
+            if ports:
+                # Something is plugged in but does not answer (yet), try again later unless a device is added
+                timeout = backoff / 2 + random.uniform(0, backoff / 2)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            else:
+                self.logger.debug("No serial ports found, waiting for the sensor to be plugged in")
+                timeout = None
+            if self.wait_for_change(ports, timeout):
+                backoff = MIN_BACKOFF
+        return None, None
+
+    def wait_for_change(self, ports, timeout=None):
+        '''
+            Waits until the set of unclaimed candidate ports changes (True), 'timeout' passes or 'closed'
+                is set (False)
+            - Ports released by other managers do not cause udev events, so they are checked every POLL_INTERVAL too
+        '''
+        known = set(ports)
+        remaining = timeout
+        while not self.closed.is_set() and (remaining is None or remaining > 0):
+            interval = POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining)
+            if self.monitor is not None:
+                # Returns at once when a device is added or removed
+                self.monitor.poll(interval)
+            elif self.closed.wait(interval):
+                break
+            if set(self.ports()) != known:
+                return True
+            if remaining is not None:
+                remaining -= interval
+        return False
@@ -0,0 +1,412 @@
+'''
+    emulator.py
+
+    - Emulates an R307 fingerprint sensor on a pseudo-terminal, so the app, the tests and benchmarks can run
+        without hardware: PyFingerprint opens the pty like any serial port and speaks the normal packet
+        protocol to it
+    - Keeps the template library in memory, fingers are simulated with place_finger/remove_finger
+    - Every command can be delayed (per command) to simulate the sensor, serial transfer time can be
+        simulated for a given baud rate
+    - Implements the commands PyFingerprint uses except image upload/download
+    - Linux/macOS only (needs a pty)
+    - Can also be started on its own (the app picks it up through LYNX_FPS_PORT), fingers are placed
+        by typing 'place <finger>' and 'remove':
+        python -m package.widgets.fps.emulator --latency 0.05
+'''
+
+import logging
+
+import os
+import sys
+import tty
+import time
+import random
+import select
+import hashlib
+import argparse
+import threading
+
+
+# Packet types
+COMMAND_PACKET = 0x01
+DATA_PACKET = 0x02
+ACK_PACKET = 0x07
+END_DATA_PACKET = 0x08
+
+# Confirmation codes
+OK = 0x00
+ERROR_COMMUNICATION = 0x01
+ERROR_NO_FINGER = 0x02
+ERROR_CHARACTERISTICS_MISMATCH = 0x0A
+ERROR_NOT_MATCHING = 0x08
+ERROR_NO_TEMPLATE_FOUND = 0x09
+ERROR_INVALID_POSITION = 0x0B
+ERROR_LOAD_TEMPLATE = 0x0C
+ERROR_DOWNLOAD_CHARACTERISTICS = 0x0D
+ERROR_DOWNLOAD_IMAGE = 0x0F
+ERROR_WRONG_PASSWORD = 0x13
+
+# Instruction codes -> names used for the latency settings
+COMMANDS = {
+    0x01: "readImage",
+    0x02: "convertImage",
+    0x03: "compareCharacteristics",
+    0x04: "searchTemplate",
+    0x05: "createTemplate",
+    0x06: "storeTemplate",
+    0x07: "loadTemplate",
+    0x08: "downloadCharacteristics",
+    0x09: "uploadCharacteristics",
+    0x0A: "downloadImage",
+    0x0C: "deleteTemplate",
+    0x0D: "clearDatabase",
+    0x0E: "setSystemParameter",
+    0x0F: "getSystemParameters",
+    0x12: "setPassword",
+    0x13: "verifyPassword",
+    0x14: "generateRandomNumber",
+    0x15: "setAddress",
+    0x1D: "getTemplateCount",
+    0x1F: "getTemplateIndex",
+}
+
+# Rough timings of a real sensor (seconds), the rest answers at once
+R307_LATENCY = {
+    "readImage": 0.12,
+    "convertImage": 0.08,
+    "searchTemplate": 0.05,
+    "createTemplate": 0.03,
+    "storeTemplate": 0.04,
+    "loadTemplate": 0.03,
+    "deleteTemplate": 0.04,
+    "clearDatabase": 0.2,
+}
+
+CAPACITY = 1000
+CHARACTERISTICS_SIZE = 512
+# Data packet size code: 0 = 32, 1 = 64, 2 = 128, 3 = 256 bytes
+PACKET_SIZE_CODE = 2
+SECURITY_LEVEL = 5
+MATCH_SCORE = 120
+
+
+def characteristics(finger, kind):
+    ''' Deterministic characteristics (CHARACTERISTICS_SIZE bytes) for a simulated finger '''
+    data, counter = b"", 0
+    while len(data) < CHARACTERISTICS_SIZE:
+        data += hashlib.sha256(f"{kind}:{finger}:{counter}".encode('utf-8')).digest()
+        counter += 1
+    return list(data[:CHARACTERISTICS_SIZE])
+
+
+class CharBuffer():
+
+    ''' Characteristics in a char buffer or template slot, 'finger' is None for uploaded data '''
+
+    __slots__ = ("finger", "data")
+
+    def __init__(self, finger, data):
+        self.finger = finger
+        self.data = data
+
+    def matches(self, other):
+        if self.finger is not None and other.finger is not None:
+            return self.finger == other.finger
+        # Uploaded templates (eg. restored from a backup) match scans of the finger they were made from
+        for uploaded, scanned in ((self, other), (other, self)):
+            if uploaded.finger is None and scanned.finger is not None:
+                return uploaded.data == characteristics(scanned.finger, "template")
+        return self.data == other.data
+
+
+class SensorEmulator():
+
+    '''
+        SensorEmulator - An R307 on a pseudo-terminal
+        Args:
+            latency: seconds every command takes, or {command name: seconds} (see COMMANDS, R307_LATENCY)
+            baud_rate: if set, responses are delayed by the time they would take on a serial link
+            capacity: number of template slots
+            password: sensor password (as given to PyFingerprint)
+        - 'port' is the device path to give to PyFingerprint/R307
+    '''
+
+    def __init__(self, latency=0, baud_rate=None, capacity=CAPACITY, password=0):
+        self.logger = logging.getLogger(__name__)
+        self.latency = latency
+        self.baud_rate = baud_rate
+        self.capacity = capacity
+        self.password = password
+        self.templates = {} # position -> CharBuffer
+        self.buffers = {1: None, 2: None}
+        self.image = None # Finger in the image buffer
+        self.finger = None # Finger on the sensor
+        self.scans = 0 # Scans taken, every scan of a finger gives slightly different characteristics
+        self.packet_size_code = PACKET_SIZE_CODE
+        self.commands = {} # command name -> times received, for measurements
+        self.upload, self.upload_buffer = [], 1 # Characteristics being uploaded
+        self.lock = threading.Lock()
+        self.master, self.slave = None, None
+        self.thread = None
+        self.running = False
+
+    @property
+    def port(self):
+        return os.ttyname(self.slave)
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        # No echo or line editing, the link is binary
+        tty.setraw(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        self.logger.debug(f"Sensor emulator listening on {self.port}")
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master, self.slave = None, None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def place_finger(self, finger):
+        ''' Puts a (simulated) finger on the sensor, the same 'finger' always matches its own templates '''
+        with self.lock:
+            self.finger = finger
+
+    def remove_finger(self):
+        with self.lock:
+            self.finger = None
+
+    def serve(self):
+        ''' Emulator thread, answers packets until stopped '''
+        received = b""
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                received += os.read(self.master, 4096)
+            except OSError:
+                continue
+            while True:
+                packet, received = self.parse(received)
+                if packet is None:
+                    break
+                self.handle(*packet)
+
+    def parse(self, received):
+        ''' Returns ((address, type, payload), rest) for the first complete packet, or (None, received) '''
+        start = received.find(b"\xef\x01")
+        if start < 0:
+            return None, received[-1:]
+        received = received[start:]
+        if len(received) < 9:
+            return None, received
+        length = received[7] << 8 | received[8]
+        if len(received) < 9 + length:
+            return None, received
+        packet, rest = received[:9 + length], received[9 + length:]
+        checksum = sum(packet[6:-2]) & 0xFFFF
+        if checksum != (packet[-2] << 8 | packet[-1]):
+            self.logger.error("Dropping packet with a bad checksum")
+            return self.parse(rest)
+        address = int.from_bytes(packet[2:6], "big")
+        return (address, packet[6], list(packet[9:-2])), rest
+
+    def write(self, address, packet_type, payload):
+        length = len(payload) + 2
+        body = bytes([packet_type, length >> 8, length & 0xFF, *payload])
+        checksum = sum(body) & 0xFFFF
+        packet = b"\xef\x01" + address.to_bytes(4, "big") + body + bytes([checksum >> 8, checksum & 0xFF])
+        if self.baud_rate:
+            # 8 data bits, a start and a stop bit per byte
+            time.sleep(len(packet) * 10 / self.baud_rate)
+        os.write(self.master, packet)
+
+    def delay(self, name):
+        latency = self.latency.get(name, 0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            time.sleep(latency)
+
+    def handle(self, address, packet_type, payload):
+        if packet_type == COMMAND_PACKET and payload:
+            code, args = payload[0], payload[1:]
+            name = COMMANDS.get(code)
+            self.commands[name or hex(code)] = self.commands.get(name or hex(code), 0) + 1
+            self.delay(name)
+            handler = getattr(self, f"do_{name}", None) if name else None
+            with self.lock:
+                reply = handler(args) if handler is not None else [ERROR_COMMUNICATION]
+            if isinstance(reply, tuple): # (ack payload, data to send after the ack)
+                reply, data = reply
+            else:
+                data = None
+            self.write(address, ACK_PACKET, reply)
+            if data is not None:
+                self.send_data(address, data)
+        elif packet_type in (DATA_PACKET, END_DATA_PACKET):
+            with self.lock:
+                self.receive_data(packet_type, payload)
+
+    def send_data(self, address, data):
+        size = 32 << self.packet_size_code
+        for offset in range(0, len(data), size):
+            last = offset + size >= len(data)
+            self.write(address, END_DATA_PACKET if last else DATA_PACKET, data[offset:offset + size])
+
+    def receive_data(self, packet_type, payload):
+        self.upload += payload
+        if packet_type == END_DATA_PACKET:
+            self.buffers[self.upload_buffer] = CharBuffer(None, self.upload)
+
+    ''' Commands, called with the lock held, return the ack payload '''
+
+    def do_verifyPassword(self, args):
+        return [OK if int.from_bytes(bytes(args[:4]), "big") == self.password else ERROR_WRONG_PASSWORD]
+
+    def do_setPassword(self, args):
+        self.password = int.from_bytes(bytes(args[:4]), "big")
+        return [OK]
+
+    def do_setAddress(self, args):
+        return [OK]
+
+    def do_setSystemParameter(self, args):
+        if args[0] == 6:
+            self.packet_size_code = args[1]
+        return [OK]
+
+    def do_getSystemParameters(self, args):
+        return [OK, 0, 0, 0, 0, self.capacity >> 8, self.capacity & 0xFF, 0, SECURITY_LEVEL,
+            0xFF, 0xFF, 0xFF, 0xFF, 0, self.packet_size_code, 0, 12]
+
+    def do_getTemplateCount(self, args):
+        count = len(self.templates)
+        return [OK, count >> 8, count & 0xFF]
+
+    def do_getTemplateIndex(self, args):
+        page = args[0]
+        index = []
+        for byte in range(32):
+            positions = range(page * 256 + byte * 8, page * 256 + byte * 8 + 8)
+            index.append(sum(1 << bit for bit, position in enumerate(positions) if position in self.templates))
+        return [OK, *index]
+
+    def do_readImage(self, args):
+        if self.finger is None:
+            return [ERROR_NO_FINGER]
+        self.image = self.finger
+        self.scans += 1
+        return [OK]
+
+    def do_downloadImage(self, args):
+        return [ERROR_DOWNLOAD_IMAGE]
+
+    def do_convertImage(self, args):
+        if self.image is None:
+            return [ERROR_COMMUNICATION]
+        self.buffers[args[0]] = CharBuffer(self.image, characteristics(self.image, f"scan{self.scans}"))
+        return [OK]
+
+    def do_compareCharacteristics(self, args):
+        first, second = self.buffers[1], self.buffers[2]
+        if first is None or second is None or not first.matches(second):
+            return [ERROR_NOT_MATCHING]
+        return [OK, 0, MATCH_SCORE]
+
+    def do_createTemplate(self, args):
+        first, second = self.buffers[1], self.buffers[2]
+        if first is None or second is None or not first.matches(second):
+            return [ERROR_CHARACTERISTICS_MISMATCH]
+        # The template of a finger is always the same, so its hash is stable
+        template = CharBuffer(first.finger, characteristics(first.finger, "template")) if first.finger is not None else first
+        self.buffers[1] = self.buffers[2] = template
+        return [OK]
+
+    def do_storeTemplate(self, args):
+        position = args[1] << 8 | args[2]
+        if position >= self.capacity or self.buffers[args[0]] is None:
+            return [ERROR_INVALID_POSITION]
+        self.templates[position] = self.buffers[args[0]]
+        return [OK]
+
+    def do_searchTemplate(self, args):
+        buffer = self.buffers[args[0]]
+        start, count = args[1] << 8 | args[2], args[3] << 8 | args[4]
+        if buffer is not None:
+            for position in sorted(self.templates):
+                if start <= position < start + count and self.templates[position].matches(buffer):
+                    return [OK, position >> 8, position & 0xFF, 0, MATCH_SCORE]
+        return [ERROR_NO_TEMPLATE_FOUND]
+
+    def do_loadTemplate(self, args):
+        position = args[1] << 8 | args[2]
+        if position >= self.capacity:
+            return [ERROR_INVALID_POSITION]
+        if position not in self.templates:
+            return [ERROR_LOAD_TEMPLATE]
+        self.buffers[args[0]] = self.templates[position]
+        return [OK]
+
+    def do_deleteTemplate(self, args):
+        position, count = args[0] << 8 | args[1], args[2] << 8 | args[3]
+        if position >= self.capacity:
+            return [ERROR_INVALID_POSITION]
+        for slot in range(position, position + count):
+            self.templates.pop(slot, None)
+        return [OK]
+
+    def do_clearDatabase(self, args):
+        self.templates.clear()
+        return [OK]
+
+    def do_generateRandomNumber(self, args):
+        return [OK, *random.getrandbits(32).to_bytes(4, "big")]
+
+    def do_downloadCharacteristics(self, args):
+        buffer = self.buffers[args[0]]
+        if buffer is None:
+            return [ERROR_DOWNLOAD_CHARACTERISTICS]
+        return ([OK], buffer.data)
+
+    def do_uploadCharacteristics(self, args):
+        self.upload, self.upload_buffer = [], args[0]
+        return [OK]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="R307 fingerprint sensor emulator")
+    parser.add_argument("--latency", type=float, help="seconds every command takes (default: R307 timings)")
+    parser.add_argument("--baud-rate", type=int, default=57600, help="simulated serial speed, 0 for none")
+    args = parser.parse_args()
+    latency = R307_LATENCY if args.latency is None else args.latency
+    emulator = SensorEmulator(latency, args.baud_rate or None).start()
+    print(f"LYNX_FPS_PORT={emulator.port}")
+    print("Commands: 'place <finger>', 'remove', 'quit'")
+    try:
+        for line in sys.stdin:
+            command = line.split()
+            if command[:1] == ["place"] and len(command) == 2:
+                emulator.place_finger(command[1])
+            elif command[:1] == ["remove"]:
+                emulator.remove_finger()
+            elif command[:1] == ["quit"]:
+                break
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+'''
+    library.py
+
+    - Bulk transfer of template libraries, so a replaced sensor (or a new kiosk) does not need every user
+        to enroll again: backup (sensor -> file), restore (file -> sensor), diff and sync of any two libraries
+    - Templates are copied byte for byte, their hashes (the keys of the stored credentials) stay the same
+    - Transfers are pipelined: templates are read on a separate thread while earlier ones are written, so
+        a copy between two sensors takes about as long as the slower of the two links
+    - Transfers are resumable: every template is stored on its own (the file is flushed after every record,
+        a template only exists on a sensor once storeTemplate ran), a new sync skips what is already there
+    - Library files only hold (position, template) records, last record of a position wins. They are only
+        readable by their owner and must be protected like the database (templates are the keys of the credentials)
+    - Command line (a library is a serial port or a file, names in /dev and COM1, COM2... are always ports,
+        so a missing sensor is an error instead of a new file):
+        python -m package.widgets.fps.library backup templates.fpl [--port /dev/ttyUSB0]
+        python -m package.widgets.fps.library restore templates.fpl [--port /dev/ttyUSB0]
+        python -m package.widgets.fps.library diff /dev/ttyUSB0 templates.fpl
+        python -m package.widgets.fps.library sync /dev/ttyUSB0 /dev/ttyUSB1 [--compare] [--delete]
+'''
+
+import logging
+
+import os
+import re
+import sys
+import stat
+import time
+import queue
+import struct
+import argparse
+import threading
+
+from pyfingerprint.pyfingerprint import FINGERPRINT_CHARBUFFER1
+
+from .cache import TemplateCache
+from .discovery import DeviceManager, probe
+
+
+MAGIC = b"LYNXFPL1"
+CHARACTERISTICS_SIZE = 512
+# Record: position (high bit set for a deleted template) and the template
+RECORD = struct.Struct(f">H{CHARACTERISTICS_SIZE}s")
+DELETED = 0x8000
+# Templates read ahead of the writer
+PIPELINE_DEPTH = 8
+# Template positions per page of the sensor's template index
+INDEX_PAGE_SIZE = 256
+
+
+class LibraryFile():
+
+    '''
+        LibraryFile - Templates stored on the host
+        Args:
+            path: library file, created if it does not exist
+        - A record cut off by an interruption is dropped when the file is opened
+    '''
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.templates = {} # position -> template (list of ints)
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.file = os.fdopen(descriptor, "r+b")
+        header = self.file.read(len(MAGIC))
+        if not header:
+            self.file.write(MAGIC)
+        elif header != MAGIC:
+            self.file.close()
+            raise ValueError(f"'{path}' is not a template library")
+        end = len(MAGIC)
+        while True:
+            record = self.file.read(RECORD.size)
+            if len(record) < RECORD.size:
+                break
+            position, template = RECORD.unpack(record)
+            if position & DELETED:
+                self.templates.pop(position & ~DELETED, None)
+            else:
+                self.templates[position] = list(template)
+            end += RECORD.size
+        if self.file.tell() != end:
+            self.logger.debug(f"Dropping an incomplete record at the end of '{path}'")
+        self.file.seek(end)
+        self.file.truncate()
+
+    def __str__(self):
+        return self.path
+
+    def positions(self):
+        return set(self.templates)
+
+    def read(self, position):
+        return self.templates[position]
+
+    def write(self, position, template):
+        self.append(position, bytes(template))
+        self.templates[position] = list(template)
+
+    def delete(self, position):
+        self.append(position | DELETED, bytes(CHARACTERISTICS_SIZE))
+        self.templates.pop(position, None)
+
+    def append(self, position, data):
+        # RECORD would pad or cut the template without a word
+        if len(data) != CHARACTERISTICS_SIZE:
+            raise ValueError(f"Templates must have {CHARACTERISTICS_SIZE} bytes, got {len(data)}")
+        self.file.write(RECORD.pack(position, data))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class SensorLibrary():
+
+    '''
+        SensorLibrary - Templates stored on a sensor
+        Args:
+            dev: connected PyFingerprint (eg. R307.dev), must not be used by anything else meanwhile
+            name: shown in logs and messages, eg. the port
+    '''
+
+    def __init__(self, dev, name="sensor"):
+        self.dev = dev
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def positions(self):
+        return template_positions(self.dev, self.dev.getStorageCapacity())
+
+    def read(self, position):
+        self.dev.loadTemplate(position, FINGERPRINT_CHARBUFFER1)
+        return self.dev.downloadCharacteristics(FINGERPRINT_CHARBUFFER1)
+
+    def write(self, position, template):
+        template = list(template)
+        if len(template) != CHARACTERISTICS_SIZE:
+            raise ValueError(f"Templates must have {CHARACTERISTICS_SIZE} bytes, got {len(template)}")
+        # PyFingerprint reads the uploaded template back, so a damaged transfer is never stored
+        if not self.dev.uploadCharacteristics(FINGERPRINT_CHARBUFFER1, template):
+            raise IOError(f"Template {position} was damaged while uploading to {self.name}")
+        # The template may replace another one at the same position, cached hashes are not valid anymore
+        TemplateCache.invalidate()
+        self.dev.storeTemplate(position, FINGERPRINT_CHARBUFFER1)
+
+    def delete(self, position):
+        TemplateCache.invalidate()
+        self.dev.deleteTemplate(position)
+
+    def close(self):
+        self.dev = None
+
+
+def template_positions(dev, capacity):
+    ''' Positions in use on a sensor (PyFingerprint) of 'capacity' templates, from its template index (a few small packets) '''
+    pages = (capacity + INDEX_PAGE_SIZE - 1) // INDEX_PAGE_SIZE
+    return {page * INDEX_PAGE_SIZE + offset for page in range(pages)
+        for offset, used in enumerate(dev.getTemplateIndex(page)) if used}
+
+
+def diff(source, target, compare=False):
+    '''
+        Compares two libraries, returns {"missing": [...], "changed": [...], "extra": [...]} positions
+        - missing: only in 'source', extra: only in 'target'
+        - changed: in both but different, only checked with 'compare' (reads both templates, slow on sensors)
+    '''
+    source_positions, target_positions = source.positions(), target.positions()
+    changed = []
+    if compare:
+        changed = [position for position in sorted(source_positions & target_positions)
+            if list(source.read(position)) != list(target.read(position))]
+    return {
+        "missing": sorted(source_positions - target_positions),
+        "changed": changed,
+        "extra": sorted(target_positions - source_positions)
+    }
+
+
+def copy(source, target, positions, progress=None, stop=None):
+    '''
+        Copies templates from 'source' to 'target' at the same positions, returns the number copied
+        - Reading runs on its own thread, up to PIPELINE_DEPTH templates ahead of writing
+        - 'progress' is called with (copied, total) after every template
+        - Setting 'stop' (threading.Event) ends the copy after the current template, a later copy resumes
+    '''
+    stop = stop if stop is not None else threading.Event()
+    finished = threading.Event()
+    templates = queue.Queue(PIPELINE_DEPTH)
+
+    def reader():
+        try:
+            for position in positions:
+                if stop.is_set() or finished.is_set():
+                    break
+                templates.put((position, source.read(position)))
+        except Exception as err:
+            templates.put((None, err))
+            return
+        templates.put((None, None))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    count = 0
+    try:
+        while True:
+            position, template = templates.get()
+            if position is None:
+                if template is not None:
+                    raise template
+                return count
+            target.write(position, template)
+            count += 1
+            if progress is not None:
+                progress(count, len(positions))
+            if stop.is_set():
+                return count
+    finally:
+        # Let a reader blocked on a full queue finish
+        finished.set()
+        while thread.is_alive():
+            try:
+                templates.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def sync(source, target, compare=False, delete=False, progress=None, stop=None):
+    '''
+        Makes 'target' hold the templates of 'source', returns the diff it worked from (see diff) with the
+            number of templates copied as "copied"
+        - Missing templates are copied (changed ones too with 'compare'), templates only on 'target' are
+            removed with 'delete'
+        - Resumable: templates copied by an interrupted sync are not missing anymore
+    '''
+    logger = logging.getLogger(__name__)
+    changes = diff(source, target, compare)
+    positions = changes["missing"] + changes["changed"]
+    logger.debug(f"Syncing {len(positions)} templates from {source} to {target}")
+    changes["copied"] = copy(source, target, positions, progress, stop)
+    if delete and not (stop is not None and stop.is_set()):
+        for position in changes["extra"]:
+            target.delete(position)
+    return changes
+
+
+def backup(dev, path, progress=None, stop=None):
+    ''' Copies every template of a sensor (PyFingerprint) to a library file, returns the number copied '''
+    library = LibraryFile(path)
+    try:
+        changes = sync(SensorLibrary(dev), library, progress=progress, stop=stop)
+    finally:
+        library.close()
+    return changes["copied"]
+
+
+def restore(path, dev, progress=None, stop=None):
+    ''' Copies the templates of a library file to a sensor, at their original positions '''
+    library = LibraryFile(path)
+    try:
+        changes = sync(library, SensorLibrary(dev), progress=progress, stop=stop)
+    finally:
+        library.close()
+    return changes["copied"]
+
+
+def is_port(name):
+    ''' Whether 'name' is a serial port, plugged in or not (anything in /dev, COM ports, character devices) '''
+    return (name.startswith("/dev/") or re.fullmatch(r"COM\d+", name.upper()) is not None
+        or (os.path.exists(name) and stat.S_ISCHR(os.stat(name).st_mode)))
+
+
+def open_sensor(port, baud_rate):
+    ''' Returns a SensorLibrary for the sensor on 'port', raises IOError if no sensor answers '''
+    dev = probe(port, baud_rate)
+    if dev is None:
+        raise IOError(f"No fingerprint sensor answers on '{port}'")
+    return SensorLibrary(dev, port)
+
+
+def open_library(name, baud_rate):
+    ''' Opens a serial port as a SensorLibrary (see is_port), anything else as a LibraryFile '''
+    if is_port(name):
+        return open_sensor(name, baud_rate)
+    return LibraryFile(name)
+
+
+def show_progress(count, total):
+    print(f"\r{count}/{total} templates", end="", file=sys.stderr, flush=True)
+
+
+def main():
+    from .r307 import R307
+    parser = argparse.ArgumentParser(description="Lynx fingerprint template library tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, description in (("backup", "copy the templates of a sensor to a file"),
+            ("restore", "copy the templates of a file to a sensor")):
+        command = commands.add_parser(name, help=description)
+        command.add_argument("file", help="library file")
+        command.add_argument("--port", help="serial port of the sensor (default: search for it)")
+    for name, description in (("diff", "compare two libraries"), ("sync", "make the target hold the templates of the source")):
+        command = commands.add_parser(name, help=description)
+        command.add_argument("source", help="serial port or library file")
+        command.add_argument("target", help="serial port or library file")
+        command.add_argument("--compare", action="store_true", help="also compare templates at the same position (slow)")
+        if name == "sync":
+            command.add_argument("--delete", action="store_true", help="remove templates which are not in the source")
+    args = parser.parse_args()
+
+    if args.command in ("backup", "restore"):
+        if is_port(args.file):
+            parser.error(f"'{args.file}' is a serial port, give the library file first")
+        if args.port:
+            sensor = open_sensor(args.port, R307.BAUD_RATE)
+        else:
+            print("Waiting for a fingerprint sensor...", file=sys.stderr)
+            port, dev = DeviceManager(R307.BAUD_RATE).connect()
+            sensor = SensorLibrary(dev, port)
+        library = LibraryFile(args.file)
+        source, target = (sensor, library) if args.command == "backup" else (library, sensor)
+        args.delete, args.compare = False, False
+    else:
+        source, target = open_library(args.source, R307.BAUD_RATE), open_library(args.target, R307.BAUD_RATE)
+
+    start = time.perf_counter()
+    try:
+        if args.command == "diff":
+            changes = diff(source, target, args.compare)
+        else:
+            changes = sync(source, target, args.compare, args.delete, show_progress)
+    except KeyboardInterrupt:
+        print("\nInterrupted, run the same command again to resume", file=sys.stderr)
+        return
+    finally:
+        source.close()
+        target.close()
+    if args.command == "diff":
+        for name in ("missing", "changed", "extra"):
+            positions = " ".join(map(str, changes[name]))
+            print(f"{name}: {len(changes[name])}" + (f" [{positions}]" if positions else ""))
+        return
+    removed = len(changes["extra"]) if args.delete else 0
+    print(f"\r{args.command.capitalize()} done in {time.perf_counter() - start:.1f}s: {changes['copied']} templates copied, "
+        f"{removed} removed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,33 +7,38 @@
         be more complicated if we depend on a wrapper class for message passing.
 
     [NOTE]:
-    Only configured for Windows (COM3) and Linux (/dev/ttyUSB with root privileges)
+    The sensor is searched on USB serial ports (see fps/discovery.py), Linux needs access to /dev/ttyUSB*
+    The port can be overridden with LYNX_FPS_PORT (eg. for the emulator in fps/emulator.py)
 '''
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QApplication, QMainWindow
 
-from sys import platform
 import logging
-import time
 import hashlib
+import threading
 
 # from pyfingerprint import pyfingerprint
-from pyfingerprint.pyfingerprint import PyFingerprint
 from pyfingerprint.pyfingerprint import FINGERPRINT_CHARBUFFER1
 from pyfingerprint.pyfingerprint import FINGERPRINT_CHARBUFFER2
 
+from ..scheduler import DetectionScheduler
+from ..cache import TemplateCache
+from ..discovery import DeviceManager
+from ..library import template_positions
+
 
 class R307(QtCore.QObject):
 
     '''
         R307 - Handles basic operations on r307
-        Args:
-            state:dictionary
-                - Passed and maintained by Controller
-                - Since python dictionaries are thread safe and mutable, they can be used to
-                    easily get out of a while loop running in another QThread.
-                - Should contain the key 'idle' mapped to a boolean value
+        - Waiting for a finger is paced by a DetectionScheduler, so the sensor is not polled in a busy loop
+        - stop() may be called directly from the controller thread to end a running scan/enrollment,
+            the worker wakes up at once
+        - Not connected when created, reset_connection (on the worker thread) waits until a sensor is found
+        - 'claimed' is the set of ports used by other sensors (see fps/registry.py), they are skipped
+        - Hashes of enrolled/matched templates are cached (see fps/cache.py), a match only downloads the
+            template when its hash is not known yet or the template index of the sensor changed
     '''
 
     # Signals
@@ -41,46 +46,56 @@ class R307(QtCore.QObject):
     enrollment_stage_one_complete_signal = QtCore.pyqtSignal()
     enrollment_stage_two_complete_signal = QtCore.pyqtSignal(tuple)
     error_encountered_signal = QtCore.pyqtSignal(str)
+    connected_signal = QtCore.pyqtSignal(str) # port
 
     BAUD_RATE = 115200 # Do not change
 
-    def __init__(self, state):
+    def __init__(self, claimed=None):
         super().__init__()
-        self.state = state
+        self.scheduler = DetectionScheduler()
+        self.cache = TemplateCache()
+        self.last_position = None # Template position of the last match
         self.logger = logging.getLogger(__name__) # Use global default logger
-        self.reset_connection() # Sets connection
-
-    def set_port(self):
-        ''' Set access port based on OS '''
-        if 'linux' in platform.lower():
-            self.port = "/dev/ttyUSB0"
-        elif 'win' in platform.lower():
-            self.port = "COM3"
-        else:
-            raise Exception("Could not set port")
-        # Log final selection
-        self.logger.debug(f"Setting port to {self.port}")
+        self.closed = threading.Event()
+        self.devices = DeviceManager(self.BAUD_RATE, self.closed, claimed)
+        self.dev = None
+        self.port = None
+        self.capacity = None # Templates the connected sensor holds
 
     @QtCore.pyqtSlot()
     def reset_connection(self):
-        ''' Resets the connection to fingerprint sensor '''
-        try:
-            # Make sure previous connection session is discarded
-            self.dev = None
-            time.sleep(1)
-            # Reset port
-            self.set_port()
-            # Open a connection to r307
-            self.logger.debug(f"Opening a serial connection to '{self.port}'")
-            self.dev = PyFingerprint(self.port, self.BAUD_RATE)
-            # Make sure connection was successful
-            if self.dev.verifyPassword() == False:
-                raise Exception("Could not connect to the fingerprint sensor!")
-            self.logger.debug("Successfully connected to the fingerprint sensor!")
-        except Exception as e:
-            e_message = str(e)
-            self.logger.error(f"Error Encountered: {e_message}")
-            self.error_encountered_signal.emit(e_message)
+        '''
+            Resets the connection to fingerprint sensor
+            - Blocks until a sensor answers (see fps/discovery.py) or close() is called, then emits connected_signal
+        '''
+        # Make sure previous connection session is discarded
+        self.dev = None
+        self.capacity = None
+        self.cache.clear() # May be another sensor after reconnecting
+        if self.port is not None:
+            self.devices.release(self.port)
+        self.port, dev = self.devices.connect()
+        if dev is None:
+            return
+        self.dev = dev
+        self.logger.debug(f"Successfully connected to the fingerprint sensor on '{self.port}'!")
+        self.connected_signal.emit(self.port)
+
+    def close(self):
+        ''' Ends a running reset_connection, called directly (not queued) when the app quits '''
+        self.closed.set()
+        self.stop()
+
+    def stop(self):
+        ''' Stops a running scan or enrollment, called directly (not queued) since the worker is busy '''
+        self.scheduler.cancel()
+
+    def wait_for_finger(self):
+        ''' Returns True once a finger was read into the image buffer, False if stopped '''
+        if self.scheduler.wait_for(self.dev.readImage):
+            return True
+        self.logger.debug("Stop requested! Scanning Stopped.")
+        return False
 
     @QtCore.pyqtSlot()
     def enroll_fingerprint(self):
@@ -89,29 +104,24 @@ class R307(QtCore.QObject):
             - Keeps running until a finger enrolled (2 successful scans)
             - Returns True if both fingers matched, otherwise returns False
         '''
-        self.state["idle"] = False
+        self.scheduler.start()
         try:
             # Scan 1
             self.logger.debug("Enrolling new user")
-            while(self.dev.readImage() == False):
-                if self.state["idle"]: # Check if controller wants to stop this loop
-                    self.logger.debug(f"State:Idle encountered! Scanning Stopped.")
-                    return
-                continue
+            if not self.wait_for_finger():
+                return
 
             # Save new scan characteristics to buffer
             self.dev.convertImage(FINGERPRINT_CHARBUFFER1)
             self.logger.debug("First scan complete")
             self.enrollment_stage_one_complete_signal.emit()
 
-            time.sleep(2)
+            if not self.scheduler.sleep(2):
+                return
 
             # Scan 2
-            while(self.dev.readImage() == False):
-                if self.state["idle"]:
-                    self.logger.debug(f"State:Idle encountered! Scanning Stopped.")
-                    return
-                continue
+            if not self.wait_for_finger():
+                return
 
             # Save new scan characteristics to buffer
             self.dev.convertImage(FINGERPRINT_CHARBUFFER2)
@@ -125,12 +135,12 @@ class R307(QtCore.QObject):
 
             # Add this template to database
             self.dev.createTemplate()
+            positions = self.template_positions()
             position = self.dev.storeTemplate()
 
             # Convert characteristics to hash
-            characteristics = self.dev.downloadCharacteristics(FINGERPRINT_CHARBUFFER1)
-            characteristics = str(characteristics).encode('utf-8')
-            characteristics_hash = hashlib.sha256(characteristics).hexdigest()
+            characteristics_hash = self.characteristics_hash()
+            self.cache.enrolled(position, characteristics_hash, positions)
 
             # Send the hash back to controller
             self.logger.debug(f"Caputured hash {characteristics_hash[:8]}*")
@@ -147,14 +157,11 @@ class R307(QtCore.QObject):
             - Reads a fingerprint and tries to match it with an existing template in the database
             - If a match is found, returns the hash of the characteristics of matching template
         '''
-        self.state['idle'] = False # Reset this to false, since scan is just called!
+        self.scheduler.start() # Clears an earlier stop, since scan is just called!
         try:
             self.logger.debug("Scanning finger!")
-            while self.dev.readImage() == False:
-                if self.state["idle"]: # Check if controller wants to stop this loop
-                    self.logger.debug(f"State:Idle encountered! Scanning Stopped.")
-                    return
-                continue
+            if not self.wait_for_finger():
+                return
 
             self.dev.convertImage(FINGERPRINT_CHARBUFFER1)
             position, accuracy = self.dev.searchTemplate()
@@ -164,11 +171,15 @@ class R307(QtCore.QObject):
                 self.scan_complete_signal.emit((False, None))
                 return
 
-            # Load characteristics in buffer and compute hash
-            self.dev.loadTemplate(position, FINGERPRINT_CHARBUFFER1)
-            characteristics = self.dev.downloadCharacteristics(FINGERPRINT_CHARBUFFER1)
-            characteristics = str(characteristics).encode('utf-8')
-            characteristics_hash = hashlib.sha256(characteristics).hexdigest()
+            # Known templates skip the download, the template index tells if the cache is still valid
+            positions = self.template_positions()
+            characteristics_hash = self.cache.lookup(position, positions)
+            if characteristics_hash is None:
+                # Load characteristics in buffer and compute hash
+                self.dev.loadTemplate(position, FINGERPRINT_CHARBUFFER1)
+                characteristics_hash = self.characteristics_hash()
+                self.cache.store(position, characteristics_hash, positions)
+            self.last_position = position
 
             self.logger.debug(f"Found match: {characteristics_hash[:8]}*")
             self.scan_complete_signal.emit((True, characteristics_hash))
@@ -178,8 +189,28 @@ class R307(QtCore.QObject):
             self.logger.debug("Encountered error while scanning finger: " + e_message)
             self.error_encountered_signal.emit(e_message)
 
+    def template_positions(self):
+        ''' Template positions in use on the sensor '''
+        if self.capacity is None:
+            self.capacity = self.dev.getStorageCapacity()
+        return template_positions(self.dev, self.capacity)
+
+    def characteristics_hash(self):
+        ''' Downloads the template in char buffer 1 and returns its hash '''
+        characteristics = self.dev.downloadCharacteristics(FINGERPRINT_CHARBUFFER1)
+        characteristics = str(characteristics).encode('utf-8')
+        return hashlib.sha256(characteristics).hexdigest()
+
+    @QtCore.pyqtSlot()
+    def forget_last_match(self):
+        ''' Drops the cached hash of the last match (eg. no user has it), the next match downloads it again '''
+        if self.last_position is not None:
+            self.cache.forget(self.last_position)
+            self.last_position = None
+
     # Used for tests only
     def clear_database(self):
         ''' Clears all saved fingerprint '''
         self.logger.debug("Clearing fingerprint database.")
         self.dev.clearDatabase()
+        self.cache.clear()
@@ -0,0 +1,186 @@
+'''
+    registry.py
+
+    - Serves several fingerprint sensors at once (eg. a kiosk with more than one entry point), every sensor
+        has its own worker thread, scheduler (cancellation) and template cache, so one sensor never waits
+        for another
+    - One spare worker always waits for a sensor which is not in use yet (see fps/discovery.py), it becomes
+        the worker of that sensor once connected and a new spare is started
+    - A worker whose sensor fails is retired, the spare picks the sensor up again once it answers
+    - Retiring never blocks the GUI thread: the port of a retired worker is only released (and may be opened
+        again) once its thread finished, a worker may still be inside a serial command until then
+    - Results are tagged with the device id (the port of the sensor)
+'''
+
+import logging
+
+import time
+import functools
+
+from PyQt5 import QtCore
+
+
+# Milliseconds wait() gives the retired worker threads in total, a serial command times out after 2 seconds
+THREAD_TIMEOUT = 3000
+
+
+class SensorRegistry(QtCore.QObject):
+
+    '''
+        SensorRegistry - Runs one worker per connected sensor
+        - Lives on the controller (GUI) thread, all methods are called from there and return at once
+        Args:
+            sensor_class: class of the sensors, defaults to fps.FingerprintSensor
+    '''
+
+    scan_complete_signal = QtCore.pyqtSignal(str, tuple) # (device id, (is_successful, key))
+    enrollment_stage_one_complete_signal = QtCore.pyqtSignal(str) # device id
+    enrollment_stage_two_complete_signal = QtCore.pyqtSignal(str, tuple) # (device id, (is_enrolled, key))
+    connected_signal = QtCore.pyqtSignal(str) # device id
+    disconnected_signal = QtCore.pyqtSignal(str) # device id
+
+    def __init__(self, sensor_class=None):
+        super().__init__()
+        if sensor_class is None:
+            from . import FingerprintSensor as sensor_class
+        self.logger = logging.getLogger(__name__)
+        self.sensor_class = sensor_class
+        self.claimed = set() # Ports in use, shared by the device managers of all workers
+        self.sensors = {} # device id -> sensor
+        self.threads = {} # sensor -> QThread
+        self.retiring = {} # sensor -> QThread, retired but not finished yet
+        self.spare = None # Worker waiting for a new sensor
+        self.mode = None # "scan", "enroll" or None, sensors which connect later join in
+        self.enrolling = None # Device id of the sensor used for enrollment
+        self.closed = False
+
+    def start(self):
+        ''' Starts waiting for sensors '''
+        if self.spare is None and not self.closed:
+            self.spare = self.add_worker()
+
+    def add_worker(self):
+        thread = QtCore.QThread()
+        sensor = self.sensor_class(claimed=self.claimed)
+        sensor.moveToThread(thread)
+        # Handlers run on this thread, partial tells which sensor the signal came from
+        sensor.connected_signal.connect(functools.partial(self.connected_handler, sensor))
+        sensor.error_encountered_signal.connect(functools.partial(self.error_handler, sensor))
+        sensor.scan_complete_signal.connect(functools.partial(self.forward, sensor, self.scan_complete_signal))
+        sensor.enrollment_stage_one_complete_signal.connect(functools.partial(self.forward, sensor, self.enrollment_stage_one_complete_signal))
+        sensor.enrollment_stage_two_complete_signal.connect(functools.partial(self.forward, sensor, self.enrollment_stage_two_complete_signal))
+        self.threads[sensor] = thread
+        thread.start()
+        QtCore.QMetaObject.invokeMethod(sensor, 'reset_connection', QtCore.Qt.QueuedConnection)
+        return sensor
+
+    def forward(self, sensor, signal, *message):
+        ''' Emits a sensor's signal tagged with its device id '''
+        if self.sensors.get(sensor.port) is sensor:
+            signal.emit(sensor.port, *message)
+
+    def connected_handler(self, sensor, port):
+        if self.closed:
+            return
+        self.sensors[port] = sensor
+        self.logger.debug(f"Fingerprint sensor '{port}' connected ({len(self.sensors)} in use)")
+        self.connected_signal.emit(port)
+        if self.mode == "scan":
+            self.invoke(sensor, 'scan')
+        elif self.mode == "enroll" and self.enrolling is None:
+            self.enrolling = port
+            self.invoke(sensor, 'enroll_fingerprint')
+        if sensor is self.spare:
+            self.spare = None
+            self.start()
+
+    def error_handler(self, sensor, message):
+        ''' The sensor is retired, the spare worker connects to it again once it answers '''
+        port = sensor.port
+        self.logger.error(f"Fingerprint sensor '{port}' failed [{message}]")
+        if sensor is self.spare or self.sensors.get(port) is not sensor:
+            return
+        self.retire(sensor)
+        del self.sensors[port]
+        if self.enrolling == port:
+            self.enrolling = None
+        self.disconnected_signal.emit(port)
+
+    def retire(self, sensor):
+        ''' Ends a worker, returns at once (see retired_handler) '''
+        sensor.close()
+        thread = self.threads.pop(sensor)
+        self.retiring[sensor] = thread
+        thread.finished.connect(functools.partial(self.retired_handler, sensor))
+        thread.quit()
+
+    def retired_handler(self, sensor):
+        ''' The worker's thread finished, nothing uses its serial port anymore '''
+        if self.retiring.pop(sensor, None) is None:
+            return
+        # Close the serial port before another worker may open it
+        sensor.dev = None
+        if sensor.port is not None:
+            sensor.devices.release(sensor.port)
+
+    def invoke(self, sensor, method):
+        sensor.stop()
+        QtCore.QMetaObject.invokeMethod(sensor, method, QtCore.Qt.QueuedConnection)
+
+    def targets(self, device_id):
+        if device_id is None:
+            return list(self.sensors.values())
+        return [self.sensors[device_id]] if device_id in self.sensors else []
+
+    def devices(self):
+        ''' Device ids of the connected sensors '''
+        return list(self.sensors)
+
+    def scan(self, device_id=None):
+        ''' (Re)starts scanning on one sensor, or on all of them (including sensors connected later) '''
+        if device_id is None:
+            self.mode, self.enrolling = "scan", None
+        for sensor in self.targets(device_id):
+            self.invoke(sensor, 'scan')
+
+    def enroll(self, device_id=None):
+        '''
+            Starts an enrollment on one sensor (the first one by default), all other sensors are stopped
+            - Without a sensor, the first one to connect is used
+        '''
+        self.stop()
+        self.mode = "enroll"
+        self.enrolling = device_id if device_id in self.sensors else next(iter(self.sensors), None)
+        if self.enrolling is not None:
+            self.invoke(self.sensors[self.enrolling], 'enroll_fingerprint')
+
+    def stop(self, device_id=None):
+        ''' Stops one sensor, or all of them '''
+        if device_id is None:
+            self.mode, self.enrolling = None, None
+        for sensor in self.targets(device_id):
+            sensor.stop()
+
+    def forget_last_match(self, device_id):
+        for sensor in self.targets(device_id):
+            QtCore.QMetaObject.invokeMethod(sensor, 'forget_last_match', QtCore.Qt.QueuedConnection)
+
+    def close(self):
+        ''' Stops all workers, including a spare waiting for a sensor, returns at once '''
+        self.closed = True
+        for sensor in list(self.threads):
+            self.retire(sensor)
+        self.sensors.clear()
+        self.spare = None
+
+    def wait(self, timeout=THREAD_TIMEOUT):
+        '''
+            Waits up to 'timeout' milliseconds (for all of them together) until the retired workers finished,
+                returns True if they did
+            - Blocks, for when the window is gone (eg. the application quits after close())
+        '''
+        deadline = time.monotonic() + timeout / 1000
+        for sensor, thread in list(self.retiring.items()):
+            if thread.wait(max(0, int((deadline - time.monotonic()) * 1000))):
+                self.retired_handler(sensor)
+        return not self.retiring
@@ -0,0 +1,83 @@
+'''
+    scheduler.py
+
+    - Decides when the sensor is asked for an image while waiting for a finger
+    - Polls fast right after activity (a scan was started or a finger was read), then backs off
+        gradually while nobody uses the sensor, so an idle login screen costs next to no CPU or serial traffic
+    - Waiting is cancelled with a threading.Event, which wakes the waiting thread at once
+'''
+
+import logging
+
+import time
+import threading
+
+
+# Seconds between polls right after activity
+MIN_INTERVAL = 0.02
+# Seconds between polls once the sensor has been idle for a while, also the worst added response time
+MAX_INTERVAL = 0.15
+# Seconds of fast polling after activity, before backing off
+FAST_PERIOD = 10
+# Growth of the interval per idle poll once backing off
+BACKOFF = 1.2
+
+
+class DetectionScheduler():
+
+    '''
+        DetectionScheduler - Paces the polling of one sensor
+        - start() before waiting, cancel() from any thread to stop the wait
+    '''
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, fast_period=FAST_PERIOD, backoff=BACKOFF):
+        self.logger = logging.getLogger(__name__)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.fast_period = fast_period
+        self.backoff = backoff
+        self.cancelled = threading.Event()
+        self.interval = min_interval
+        self.last_activity = time.monotonic()
+        self.polls = 0 # Polls since the scheduler was created, for measurements
+
+    def start(self):
+        ''' Called when a scan or enrollment starts, clears an earlier cancel '''
+        self.cancelled.clear()
+        self.activity()
+
+    def activity(self):
+        ''' Something happened on the sensor, poll fast again '''
+        self.last_activity = time.monotonic()
+        self.interval = self.min_interval
+
+    def cancel(self):
+        ''' Stops the current wait at once, safe to call from any thread '''
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def next_interval(self):
+        if time.monotonic() - self.last_activity < self.fast_period:
+            return self.min_interval
+        self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+    def wait_for(self, poll):
+        '''
+            Calls 'poll' until it returns True, pausing between calls
+            - Returns True once 'poll' succeeded, False if the wait was cancelled
+        '''
+        while not self.cancelled.is_set():
+            self.polls += 1
+            if poll():
+                self.activity()
+                return True
+            if self.cancelled.wait(self.next_interval()):
+                break
+        return False
+
+    def sleep(self, seconds):
+        ''' Pauses unless cancelled, returns False if the pause was cancelled '''
+        return not self.cancelled.wait(seconds)
@@ -0,0 +1,12 @@
+'''
+    mail [module]
+
+    - Provides easy API to access an email account
+'''
+
+from .session import EmailSession
+from .pool import IMAPConnectionPool
+from .store import MessageStore
+from .message import MessageSummary, BodyCache
+from .aio import AsyncIMAPConnection, EventLoopThread
+from .outbox import Outbox
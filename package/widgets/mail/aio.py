@@ -0,0 +1,238 @@
+'''
+    aio.py
+
+    - asyncio based IMAP engine used to fetch several folders at the same time
+    - Every folder gets its own connection, so a slow folder (or a slow response) does not hold up the others
+    - Messages are handed over as soon as their FETCH response is parsed
+    - The message store (SQLite) is only used from the loop's executor, so its disk writes never block the loop
+    - EventLoopThread runs the asyncio loop next to Qt's event loop, results are passed back with Qt signals
+'''
+
+import logging
+
+import re
+import ssl
+import asyncio
+import imaplib
+import functools
+import itertools
+import threading
+
+from .pool import quote
+from .session import FETCH_BATCH_SIZE, HEADER_QUERY, message_sets, parse_header_response
+
+
+# Folders fetched by default, 'sent' and 'archive' are resolved with special-use attributes (RFC 6154)
+FOLDERS = ("inbox", "sent", "archive")
+SPECIAL_USE = {
+    "sent": (b"\\Sent",),
+    "archive": (b"\\Archive", b"\\All"),
+}
+
+# Seconds to wait for a single response line before the folder is given up
+RESPONSE_TIMEOUT = 30
+# SEARCH responses of big mailboxes come in a single (very long) line
+LINE_LIMIT = 2 ** 24
+
+LITERAL_PATTERN = re.compile(rb"\{(\d+)\}\r\n$")
+STATUS_CODE_PATTERN = re.compile(rb"\[(UIDVALIDITY|UIDNEXT) (\d+)\]")
+LIST_PATTERN = re.compile(rb'\* LIST \(([^)]*)\) (?:"[^"]*"|NIL) (.+)\r\n$')
+
+
+async def in_executor(function, *args):
+    ''' Runs a blocking call (i.e. a MessageStore method) on the default executor of the running loop '''
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+
+
+class AsyncIMAPConnection():
+
+    '''
+        AsyncIMAPConnection - A single IMAP connection driven by asyncio
+        - Only implements the commands needed to fetch message headers
+        - Connects without TLS if 'use_ssl' is False (local test servers only)
+    '''
+
+    def __init__(self, host, port, timeout=RESPONSE_TIMEOUT, ssl_context=None, use_ssl=True):
+        self.logger = logging.getLogger(__name__)
+        self.host, self.port = host, port
+        self.timeout = timeout
+        if use_ssl:
+            self.ssl_context = ssl_context if ssl_context is not None else ssl.create_default_context()
+        else:
+            self.ssl_context = None
+        self.tags = itertools.count(1)
+        self.reader, self.writer = None, None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context, limit=LINE_LIMIT),
+            self.timeout)
+        greeting = await self.readline()
+        if not greeting.startswith(b"* OK"):
+            raise imaplib.IMAP4.error(f"Unexpected greeting [{greeting}]")
+
+    async def login(self, email, pwd):
+        await self.execute(f"LOGIN {quote(email)} {quote(pwd)}")
+
+    async def logout(self):
+        try:
+            await self.execute("LOGOUT")
+        except Exception:
+            pass
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+
+    async def readline(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        return line
+
+    async def read_response(self):
+        '''
+            Reads one complete response
+            - Literals are returned the same way imaplib returns them: (line, literal) tuples
+                followed by the rest of the line
+        '''
+        parts, line = [], await self.readline()
+        while True:
+            match = LITERAL_PATTERN.search(line)
+            if match is None:
+                parts.append(line)
+                return parts
+            literal = await asyncio.wait_for(self.reader.readexactly(int(match.group(1))), self.timeout)
+            parts.append((line, literal))
+            line = await self.readline()
+
+    async def stream(self, command):
+        ''' Sends a command and yields its untagged responses as they arrive '''
+        tag = f"A{next(self.tags):04d}".encode('ascii')
+        self.writer.write(tag + b" " + command.encode('utf-8') + b"\r\n")
+        await self.writer.drain()
+        while True:
+            response = await self.read_response()
+            first = response[0][0] if isinstance(response[0], tuple) else response[0]
+            if first.startswith(tag + b" "):
+                if not first.startswith(tag + b" OK"):
+                    raise imaplib.IMAP4.error(first.decode('utf-8', 'replace').strip())
+                return
+            yield response
+
+    async def execute(self, command):
+        ''' Sends a command and returns all of its untagged responses '''
+        return [response async for response in self.stream(command)]
+
+    async def resolve(self, folder):
+        ''' Returns the mailbox name for a folder, special folders ('sent', 'archive') are looked up with LIST '''
+        attributes = SPECIAL_USE.get(folder.lower())
+        if attributes is None:
+            return folder
+        mailboxes = {}
+        for response in await self.execute('LIST "" "*"'):
+            match = LIST_PATTERN.match(response[0]) if isinstance(response[0], bytes) else None
+            if match is None:
+                continue
+            for flag in match.group(1).split():
+                mailboxes.setdefault(flag, match.group(2).strip(b'"').replace(b'\\"', b'"').decode('utf-8'))
+        for attribute in attributes:
+            if attribute in mailboxes:
+                return mailboxes[attribute]
+        raise imaplib.IMAP4.error(f"Server has no '{folder}' folder")
+
+    async def fetch_new(self, account, mailbox, store, batch_size=FETCH_BATCH_SIZE):
+        '''
+            Fetches headers of messages which are not in the local store yet (read-only, flags are untouched)
+            - Messages are yielded as soon as their FETCH response is parsed
+        '''
+        status = {}
+        for response in await self.execute(f"EXAMINE {quote(mailbox)}"):
+            for key, value in STATUS_CODE_PATTERN.findall(response[-1] if isinstance(response[-1], bytes) else b""):
+                status[key.decode('ascii')] = int(value)
+        uidvalidity = status.get("UIDVALIDITY", 0)
+        state = await in_executor(store.get_state, account, mailbox)
+        if state is not None and state[0] != uidvalidity:
+            await in_executor(store.reset_mailbox, account, mailbox)
+            state = None
+        # Folders synced here for the first time are fetched completely (oldest first)
+        _, last_uid, modseq, first_uid = state or (uidvalidity, 0, 0, 1)
+        if status.get("UIDNEXT", last_uid + 2) - 1 <= last_uid:
+            return
+        uids = []
+        for response in await self.execute(f"UID SEARCH UID {last_uid + 1}:*"):
+            if response[0].startswith(b"* SEARCH"):
+                uids += [int(uid) for uid in response[0].split()[2:] if int(uid) > last_uid]
+        for message_set in message_sets(uids, batch_size):
+            mails = []
+            async for response in self.stream(f"UID FETCH {message_set} {HEADER_QUERY}"):
+                for mail in parse_header_response(response, mailbox, uidvalidity):
+                    if mail.uid is None:
+                        continue
+                    mails.append(mail)
+                    yield mail
+            # Save progress after every batch
+            await in_executor(store.add_messages, account, mailbox, uidvalidity, mails)
+            last_uid = max([last_uid, *(mail.uid for mail in mails)])
+            await in_executor(store.set_state, account, mailbox, uidvalidity, last_uid, modseq, first_uid)
+
+
+async def fetch_folders(host, port, email, pwd, store, folders=FOLDERS, batch_size=FETCH_BATCH_SIZE, use_ssl=True):
+    '''
+        Fetches new messages of several folders concurrently, every folder over its own connection
+        - Yields (folder, message) pairs in the order they are parsed
+        - A folder which fails (or times out) is logged and skipped, the others carry on
+    '''
+    logger = logging.getLogger(__name__)
+    queue = asyncio.Queue()
+
+    async def worker(folder):
+        conn = AsyncIMAPConnection(host, port, use_ssl=use_ssl)
+        try:
+            await conn.connect()
+            await conn.login(email, pwd)
+            mailbox = await conn.resolve(folder)
+            async for mail in conn.fetch_new(email, mailbox, store, batch_size):
+                await queue.put((folder, mail))
+        except Exception as err:
+            logger.error(f"Could not fetch '{folder}' [{err}]")
+        finally:
+            await queue.put((folder, None)) # Folder is done
+            await conn.logout()
+
+    tasks = [asyncio.ensure_future(worker(folder)) for folder in folders]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            folder, mail = await queue.get()
+            if mail is None:
+                remaining -= 1
+                continue
+            yield folder, mail
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class EventLoopThread():
+
+    '''
+        EventLoopThread - Runs an asyncio event loop on a daemon thread
+        - Coroutines can be submitted from any thread (including Qt threads)
+        - Qt signals emitted from the coroutines are delivered by Qt to the receiver's thread
+    '''
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        ''' Schedules a coroutine on the loop, returns a concurrent.futures.Future '''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
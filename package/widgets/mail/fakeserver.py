@@ -0,0 +1,478 @@
+'''
+    fakeserver.py
+
+    - Local stand-in for the IMAP and SMTP servers, so the mail code can be tested and benchmarked offline
+    - Mailboxes are filled with synthetic messages which are generated when they are fetched, so even
+        100k messages take little memory
+    - Every response can be delayed to simulate a slow network
+    - Only implements what EmailSession uses: LOGIN, CAPABILITY, LIST, STATUS, SELECT/EXAMINE, NOOP, IDLE,
+        UID SEARCH, UID FETCH (headers, flags, BODYSTRUCTURE, sections and partial sections) and
+        SMTP with AUTH PLAIN (messages for the recipients in 'refused' are answered with an error, to test retries)
+    - Plain TCP only, sessions have to be created with use_ssl=False
+    - Can also be started on its own (the app picks it up through the LYNX_* environment variables):
+        python -m package.widgets.mail.fakeserver --messages 10000 --latency 0.05
+'''
+
+import logging
+
+import re
+import time
+import base64
+import bisect
+import random
+import select
+import argparse
+import threading
+import socketserver
+from functools import lru_cache
+
+
+SENDERS = ("Alice Smith", "Bob Jones", "Carol White", "Dan Brown", "Eve Black")
+WORDS = ("invoice", "meeting", "report", "lunch", "project", "update", "holiday", "receipt", "payment", "order")
+# Synthetic messages use the same date, only the time of day changes
+DATE = "Mon, 1 Jun 2020 {:02d}:{:02d}:{:02d} +0000"
+
+ATOM_PATTERN = re.compile(rb'"((?:[^"\\]|\\.)*)"|(\S+)')
+SECTION_PATTERN = re.compile(rb'BODY(?:\.PEEK)?\[([\d.]*)\](?:<(\d+)\.(\d+)>)?')
+HEADER_FIELDS_PATTERN = re.compile(rb'BODY(?:\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]')
+CHANGEDSINCE_PATTERN = re.compile(rb'CHANGEDSINCE (\d+)')
+
+
+class SyntheticMessage():
+
+    ''' A generated message, the same UID always gives the same message '''
+
+    def __init__(self, uid, attachment_size=0):
+        sender = SENDERS[uid % len(SENDERS)]
+        address = sender.split()[0].lower() + "@example.com"
+        words = random.Random(uid).sample(WORDS, 2)
+        self.headers = [
+            ("From", f"{sender} <{address}>"),
+            ("To", "user@example.com"),
+            ("Subject", f"{words[0].title()} {words[1]} #{uid}"),
+            ("Date", DATE.format(uid // 3600 % 24, uid // 60 % 60, uid % 60)),
+            ("Message-ID", f"<{uid}@fakeserver.lynx>"),
+            ("MIME-Version", "1.0"),
+        ]
+        text = (f"Hello,\r\n\r\nThis is synthetic message {uid} about the {words[0]} and the {words[1]}.\r\n"
+            "\r\nRegards\r\n").encode('ascii')
+        lines = text.count(b"\n")
+        if attachment_size:
+            payload = base64.encodebytes(random.Random(uid).randbytes(attachment_size)).replace(b"\n", b"\r\n")
+            boundary = f"part-{uid}"
+            self.headers.append(("Content-Type", f'multipart/mixed; boundary="{boundary}"'))
+            self.parts = [
+                (b"Content-Type: text/plain; charset=utf-8\r\nContent-Transfer-Encoding: 7bit\r\n", text),
+                (f'Content-Type: application/octet-stream; name="file-{uid}.bin"\r\n'
+                    "Content-Transfer-Encoding: base64\r\n"
+                    f'Content-Disposition: attachment; filename="file-{uid}.bin"\r\n'.encode('ascii'), payload),
+            ]
+            body = b"".join(
+                f"--{boundary}\r\n".encode('ascii') + headers + b"\r\n" + content + b"\r\n"
+                for headers, content in self.parts
+            ) + f"--{boundary}--\r\n".encode('ascii')
+            self.bodystructure = (
+                f'(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" {len(text)} {lines} NIL NIL NIL NIL)'
+                f'("APPLICATION" "OCTET-STREAM" ("NAME" "file-{uid}.bin") NIL NIL "BASE64" {len(payload)} NIL '
+                f'("ATTACHMENT" ("FILENAME" "file-{uid}.bin")) NIL NIL) "MIXED" ("BOUNDARY" "{boundary}") NIL NIL NIL)'
+            ).encode('ascii')
+        else:
+            self.headers += [("Content-Type", "text/plain; charset=utf-8"), ("Content-Transfer-Encoding", "7bit")]
+            self.parts = [(b"", text)]
+            body = text
+            self.bodystructure = (
+                f'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" {len(text)} {lines} NIL NIL NIL NIL)'
+            ).encode('ascii')
+        self.raw = self.header_block() + b"\r\n" + body
+
+    def header_block(self, fields=None):
+        ''' Returns the header lines, only the ones in 'fields' (upper case names) if given '''
+        return b"".join(
+            f"{name}: {value}\r\n".encode('utf-8') for name, value in self.headers
+            if fields is None or name.upper() in fields
+        )
+
+    def section(self, section):
+        if section in ("", "TEXT"):
+            return self.raw
+        return self.parts[int(section.split(".")[0]) - 1][1]
+
+
+class Mailbox():
+
+    '''
+        Mailbox - UIDs and flags of a synthetic mailbox, messages themselves are generated on demand
+        - 'seen_ratio' of the messages get the \\Seen flag
+    '''
+
+    def __init__(self, name, count=0, seen_ratio=1.0, attachment_size=0, attributes=()):
+        self.name = name
+        self.attributes = attributes
+        self.uidvalidity = 1
+        self.attachment_size = attachment_size
+        self.lock = threading.Lock()
+        self.uids = list(range(1, count + 1))
+        self.flags = {uid: ("\\Seen",) if (uid * 7919) % 100 < seen_ratio * 100 else () for uid in self.uids}
+        self.modseqs = {uid: uid for uid in self.uids}
+        self.highestmodseq = count
+        self.uidnext = count + 1
+        self.generate = lru_cache(maxsize=8)(lambda uid: SyntheticMessage(uid, self.attachment_size))
+
+    def append(self, flags=()):
+        ''' Adds a new message and returns its UID '''
+        with self.lock:
+            uid = self.uidnext
+            self.uidnext += 1
+            self.highestmodseq += 1
+            self.uids.append(uid)
+            self.flags[uid] = tuple(flags)
+            self.modseqs[uid] = self.highestmodseq
+        return uid
+
+    def expunge(self, uid):
+        with self.lock:
+            index = bisect.bisect_left(self.uids, uid)
+            if index < len(self.uids) and self.uids[index] == uid:
+                del self.uids[index]
+                del self.flags[uid], self.modseqs[uid]
+
+    def set_flags(self, uid, flags):
+        with self.lock:
+            self.highestmodseq += 1
+            self.flags[uid] = tuple(flags)
+            self.modseqs[uid] = self.highestmodseq
+
+    def uid_set(self, message_set):
+        ''' Returns the existing UIDs in an IMAP message-set (i.e. "1:3,7,10:*"), in ascending order '''
+        highest = self.uids[-1] if self.uids else 0
+        result = set()
+        for item in message_set.split(","):
+            first, _, last = item.partition(":")
+            first = highest if first == "*" else int(first)
+            last = first if not last else highest if last == "*" else int(last)
+            first, last = min(first, last), max(first, last)
+            start, end = bisect.bisect_left(self.uids, first), bisect.bisect_right(self.uids, last)
+            result.update(self.uids[start:end])
+        return sorted(result)
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+
+    ''' Serves one IMAP connection '''
+
+    def handle(self):
+        self.mailbox = None
+        self.authenticated = False
+        self.send(b"* OK [CAPABILITY IMAP4rev1 IDLE CONDSTORE] Lynx fake IMAP server ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+            command, _, args = rest.partition(b" ")
+            command = command.upper().decode('ascii', 'replace')
+            time.sleep(self.server.latency)
+            if command == "UID":
+                command, _, args = args.partition(b" ")
+                command = "UID_" + command.upper().decode('ascii', 'replace')
+            self.server.commands[command] = self.server.commands.get(command, 0) + 1
+            handler = getattr(self, f"do_{command}", None)
+            if handler is None:
+                self.send(tag + b" BAD Unknown command")
+            elif command not in ("CAPABILITY", "LOGIN", "LOGOUT", "NOOP") and not self.authenticated:
+                self.send(tag + b" NO Not authenticated")
+            elif handler(tag, args) is False:
+                return
+
+    def send(self, *lines):
+        self.wfile.write(b"".join(line + b"\r\n" for line in lines))
+        self.wfile.flush()
+
+    def arguments(self, args):
+        return [match.group(1).replace(b'\\"', b'"').replace(b'\\\\', b'\\') if match.group(1) is not None
+            else match.group(2) for match in ATOM_PATTERN.finditer(args)]
+
+    def find_mailbox(self, name):
+        name = name.decode('utf-8')
+        for mailbox in self.server.mailboxes.values():
+            if mailbox.name == name or (name.upper() == "INBOX" and mailbox.name.upper() == "INBOX"):
+                return mailbox
+        return None
+
+    def do_CAPABILITY(self, tag, args):
+        self.send(b"* CAPABILITY IMAP4rev1 IDLE CONDSTORE", tag + b" OK CAPABILITY completed")
+
+    def do_LOGIN(self, tag, args):
+        arguments = self.arguments(args)
+        if arguments[:2] == [self.server.email.encode('utf-8'), self.server.pwd.encode('utf-8')]:
+            self.authenticated = True
+            self.send(tag + b" OK LOGIN completed")
+        else:
+            self.send(tag + b" NO [AUTHENTICATIONFAILED] Invalid credentials")
+
+    def do_LOGOUT(self, tag, args):
+        self.send(b"* BYE Logging out", tag + b" OK LOGOUT completed")
+        return False
+
+    def do_NOOP(self, tag, args):
+        self.send(tag + b" OK NOOP completed")
+
+    def do_LIST(self, tag, args):
+        for mailbox in self.server.mailboxes.values():
+            attributes = " ".join(("\\HasNoChildren",) + mailbox.attributes)
+            self.send(f'* LIST ({attributes}) "/" "{mailbox.name}"'.encode('utf-8'))
+        self.send(tag + b" OK LIST completed")
+
+    def do_STATUS(self, tag, args):
+        name, _, items = args.partition(b" (")
+        mailbox = self.find_mailbox(self.arguments(name)[0])
+        if mailbox is None:
+            return self.send(tag + b" NO Mailbox does not exist")
+        values = {
+            "MESSAGES": len(mailbox.uids), "UIDNEXT": mailbox.uidnext, "UIDVALIDITY": mailbox.uidvalidity,
+            "HIGHESTMODSEQ": mailbox.highestmodseq, "UNSEEN": sum(1 for flags in mailbox.flags.values()
+                if "\\Seen" not in flags),
+        }
+        status = " ".join(f"{item} {values[item]}" for item in items.rstrip(b")").decode('ascii').upper().split()
+            if item in values)
+        self.send(f'* STATUS "{mailbox.name}" ({status})'.encode('utf-8'), tag + b" OK STATUS completed")
+
+    def do_SELECT(self, tag, args, mode=b"READ-WRITE"):
+        mailbox = self.find_mailbox(self.arguments(args)[0])
+        if mailbox is None:
+            return self.send(tag + b" NO Mailbox does not exist")
+        self.mailbox = mailbox
+        self.send(
+            b"* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)",
+            b"* %d EXISTS" % len(mailbox.uids),
+            b"* OK [UIDVALIDITY %d] UIDs valid" % mailbox.uidvalidity,
+            b"* OK [UIDNEXT %d] Predicted next UID" % mailbox.uidnext,
+            b"* OK [HIGHESTMODSEQ %d] Highest" % mailbox.highestmodseq,
+            tag + b" OK [" + mode + b"] Completed",
+        )
+
+    def do_EXAMINE(self, tag, args):
+        self.do_SELECT(tag, args, b"READ-ONLY")
+
+    def do_IDLE(self, tag, args):
+        ''' Reports new messages with EXISTS until the client sends DONE '''
+        mailbox, known = self.mailbox, len(self.mailbox.uids) if self.mailbox else 0
+        self.send(b"+ idling")
+        while True:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                self.rfile.readline()
+                return self.send(tag + b" OK IDLE terminated")
+            if mailbox is not None and len(mailbox.uids) != known:
+                known = len(mailbox.uids)
+                self.send(b"* %d EXISTS" % known)
+
+    def do_UID_SEARCH(self, tag, args):
+        mailbox = self.mailbox
+        criteria = args.decode('ascii').upper().split()
+        uids = list(mailbox.uids)
+        index = 0
+        while index < len(criteria):
+            criterion = criteria[index]
+            if criterion == "UID":
+                selected = set(mailbox.uid_set(criteria[index + 1]))
+                uids = [uid for uid in uids if uid in selected]
+                index += 1
+            elif criterion in ("SEEN", "UNSEEN"):
+                uids = [uid for uid in uids if ("\\Seen" in mailbox.flags[uid]) == (criterion == "SEEN")]
+            index += 1
+        self.send(b"* SEARCH " + " ".join(map(str, uids)).encode('ascii'), tag + b" OK SEARCH completed")
+
+    def do_UID_FETCH(self, tag, args):
+        mailbox = self.mailbox
+        message_set, _, items = args.partition(b" ")
+        changed = CHANGEDSINCE_PATTERN.search(items)
+        header_fields = HEADER_FIELDS_PATTERN.search(items)
+        section = None if header_fields else SECTION_PATTERN.search(items)
+        uids = mailbox.uid_set(message_set.decode('ascii'))
+        for uid in uids:
+            if changed and mailbox.modseqs[uid] <= int(changed.group(1)):
+                continue
+            seq = bisect.bisect_left(mailbox.uids, uid) + 1
+            fields = [b"UID %d" % uid]
+            if b"FLAGS" in items:
+                fields.append(b"FLAGS (" + " ".join(mailbox.flags[uid]).encode('ascii') + b")")
+            if b"MODSEQ" in items or changed:
+                fields.append(b"MODSEQ (%d)" % mailbox.modseqs[uid])
+            literal = None
+            if b"BODYSTRUCTURE" in items:
+                fields.append(b"BODYSTRUCTURE " + mailbox.generate(uid).bodystructure)
+            if header_fields:
+                names = header_fields.group(1).decode('ascii').upper().split()
+                literal = mailbox.generate(uid).header_block(names) + b"\r\n"
+                fields.append(b"BODY[HEADER.FIELDS (" + header_fields.group(1).upper() + b")]")
+            elif b"RFC822" in items:
+                literal = mailbox.generate(uid).raw
+                fields.append(b"RFC822")
+            elif section:
+                literal = mailbox.generate(uid).section(section.group(1).decode('ascii'))
+                name = b"BODY[" + section.group(1) + b"]"
+                if section.group(2):
+                    offset = int(section.group(2))
+                    literal = literal[offset:offset + int(section.group(3))]
+                    name += b"<%d>" % offset
+                fields.append(name)
+            response = b"* %d FETCH (" % seq + b" ".join(fields)
+            if literal is not None:
+                response += b" {%d}\r\n" % len(literal) + literal
+            self.wfile.write(response + b")\r\n")
+        self.send(tag + b" OK FETCH completed")
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    ''' Serves one SMTP connection, delivered messages are kept in FakeMailServer.delivered '''
+
+    def handle(self):
+        self.authenticated = False
+        self.recipients = []
+        self.send(b"220 Lynx fake SMTP server ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, args = line.rstrip(b"\r\n").partition(b" ")
+            command = command.upper()
+            time.sleep(self.server.latency)
+            if command in (b"EHLO", b"HELO"):
+                self.send(b"250-fakeserver.lynx", b"250-AUTH PLAIN", b"250 SIZE 52428800")
+            elif command == b"AUTH":
+                mechanism, _, response = args.partition(b" ")
+                expected = b"\0" + self.server.email.encode('utf-8') + b"\0" + self.server.pwd.encode('utf-8')
+                if mechanism.upper() == b"PLAIN" and base64.b64decode(response or b"=") == expected:
+                    self.authenticated = True
+                    self.send(b"235 Authentication successful")
+                else:
+                    self.send(b"535 Authentication failed")
+            elif command in (b"MAIL", b"RCPT"):
+                if command == b"MAIL":
+                    self.recipients = []
+                elif self.authenticated:
+                    self.recipients.append(args.partition(b"<")[2].partition(b">")[0].decode('utf-8'))
+                self.send(b"250 OK" if self.authenticated else b"530 Authentication required")
+            elif command == b"DATA":
+                self.send(b"354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for line in self.rfile:
+                    if line == b".\r\n":
+                        break
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+                refused = next((self.server.refused[r] for r in self.recipients if r in self.server.refused), None)
+                self.recipients = []
+                if refused is not None:
+                    self.send(refused)
+                    continue
+                self.server.delivered.append(b"".join(lines))
+                self.send(b"250 OK queued")
+            elif command in (b"NOOP", b"RSET"):
+                self.send(b"250 OK")
+            elif command == b"QUIT":
+                return self.send(b"221 Bye")
+            else:
+                self.send(b"502 Command not implemented")
+
+    def send(self, *lines):
+        self.wfile.write(b"".join(line + b"\r\n" for line in lines))
+        self.wfile.flush()
+
+
+class ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeMailServer():
+
+    '''
+        FakeMailServer - IMAP and SMTP stand-ins served from background threads
+        Args:
+            messages: number of synthetic messages in the inbox
+            email, pwd: the only credentials accepted by both servers
+            latency: seconds added before every response
+            seen_ratio: share of inbox messages with the \\Seen flag
+            attachment_size: if set, every message carries an attachment of this many bytes
+            imap_port, smtp_port: 0 picks free ports
+    '''
+
+    def __init__(self, messages=100, email="user@example.com", pwd="password", latency=0, seen_ratio=1.0,
+            attachment_size=0, host="127.0.0.1", imap_port=0, smtp_port=0):
+        self.logger = logging.getLogger(__name__)
+        self.mailboxes = {
+            "inbox": Mailbox("INBOX", messages, seen_ratio, attachment_size),
+            "sent": Mailbox("Sent", 0, attributes=("\\Sent",)),
+            "archive": Mailbox("Archive", 0, attributes=("\\Archive",)),
+        }
+        self.delivered = []
+        self.commands = {} # IMAP command name (eg. "UID_FETCH") -> times received, for tests and measurements
+        # Recipient -> reply sent instead of accepting a message for it, eg. {"a@example.com": b"451 Try again"}
+        self.refused = {}
+        self.imap = ThreadingServer((host, imap_port), IMAPHandler)
+        self.smtp = ThreadingServer((host, smtp_port), SMTPHandler)
+        for server in (self.imap, self.smtp):
+            server.mailboxes, server.delivered, server.commands = self.mailboxes, self.delivered, self.commands
+            server.refused = self.refused
+            server.email, server.pwd, server.latency = email, pwd, latency
+        self.threads = []
+
+    @property
+    def imap_address(self):
+        return self.imap.server_address
+
+    @property
+    def smtp_address(self):
+        return self.smtp.server_address
+
+    @property
+    def inbox(self):
+        return self.mailboxes["inbox"]
+
+    def start(self):
+        for server in (self.imap, self.smtp):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.logger.debug(f"Fake IMAP server on {self.imap_address}, SMTP on {self.smtp_address}")
+        return self
+
+    def stop(self):
+        for server in (self.imap, self.smtp):
+            server.shutdown()
+            server.server_close()
+        self.threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local IMAP/SMTP server with synthetic mail")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--seen-ratio", type=float, default=1.0)
+    parser.add_argument("--attachment-size", type=int, default=0)
+    parser.add_argument("--email", default="user@example.com")
+    parser.add_argument("--pwd", default="password")
+    parser.add_argument("--imap-port", type=int, default=1143)
+    parser.add_argument("--smtp-port", type=int, default=1025)
+    args = parser.parse_args()
+    server = FakeMailServer(args.messages, args.email, args.pwd, args.latency, args.seen_ratio,
+        args.attachment_size, imap_port=args.imap_port, smtp_port=args.smtp_port).start()
+    (host, imap_port), (_, smtp_port) = server.imap_address, server.smtp_address
+    print(f"LYNX_IMAP_SERVER={host} LYNX_IMAP_SERVER_PORT={imap_port} "
+        f"LYNX_SMTP_SERVER={host} LYNX_SMTP_SERVER_PORT={smtp_port} LYNX_MAIL_SSL=0")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
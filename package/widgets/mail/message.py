@@ -0,0 +1,77 @@
+'''
+    message.py
+
+    - MessageSummary: compact record with the header fields displayed by the dashboard
+    - BodyCache: size-bounded LRU cache for message bodies, which are only fetched when a message is opened
+'''
+
+import re
+import html
+from collections import OrderedDict
+
+
+# Maximum total size (in bytes) of cached message bodies
+BODY_CACHE_SIZE = 4 * 1024 * 1024
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+class MessageSummary():
+
+    ''' Header fields of a single message, the body is loaded separately (see EmailSession.load_body) '''
+
+    __slots__ = ("mailbox", "uidvalidity", "uid", "subject", "sender", "date", "message_id", "flags", "modseq")
+
+    def __init__(self, uid, subject=None, sender=None, date=None, message_id=None, flags=(), modseq=None,
+            mailbox=None, uidvalidity=None):
+        self.mailbox = mailbox
+        self.uidvalidity = uidvalidity
+        self.uid = uid
+        self.subject = subject
+        self.sender = sender
+        self.date = date
+        self.message_id = message_id
+        self.flags = flags
+        self.modseq = modseq
+
+    @property
+    def key(self):
+        ''' Identifies the message (and its body) as long as the mailbox keeps its UIDVALIDITY '''
+        return (self.mailbox, self.uidvalidity, self.uid)
+
+    def __repr__(self):
+        return f"MessageSummary(uid={self.uid}, subject={self.subject!r})"
+
+
+def html_text(text):
+    ''' Strips an HTML document down to its text '''
+    return html.unescape(TAG_PATTERN.sub(" ", text))
+
+
+class BodyCache():
+
+    ''' Keeps the most recently opened message bodies, evicts the least recently used ones above 'max_size' bytes '''
+
+    def __init__(self, max_size=BODY_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.bodies = OrderedDict()
+
+    def get(self, key):
+        body = self.bodies.get(key)
+        if body is not None:
+            self.bodies.move_to_end(key)
+        return body
+
+    def put(self, key, body):
+        if key in self.bodies:
+            self.size -= len(self.bodies.pop(key).encode('utf-8'))
+        self.bodies[key] = body
+        self.size += len(body.encode('utf-8'))
+        while self.size > self.max_size and len(self.bodies) > 1:
+            _, evicted = self.bodies.popitem(last=False)
+            self.size -= len(evicted.encode('utf-8'))
+
+    def clear(self):
+        self.bodies.clear()
+        self.size = 0
@@ -0,0 +1,171 @@
+'''
+    outbox.py
+
+    - Sends emails in the background, so the UI never waits on the SMTP server
+    - Messages are queued in the message store first, so nothing is lost if the application is closed
+    - One authenticated SMTP_SSL connection is kept open per session and reused for every queued message
+    - Failed sends are retried with exponential backoff
+'''
+
+import logging
+
+import time
+import smtplib
+import threading
+from email.message import EmailMessage
+from email.policy import default as default_policy
+from email.parser import BytesParser
+
+
+# Retries are scheduled after RETRY_DELAY * 2^attempts seconds, but never later than MAX_RETRY_DELAY
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 10 * 60
+# Messages which could not be sent after this many attempts are dropped
+MAX_ATTEMPTS = 8
+# The SMTP connection is closed if nothing was sent for this many seconds
+SMTP_IDLE_TIMEOUT = 120
+# Connections idle for longer than this are checked with a NOOP before they are reused
+SMTP_CHECK_INTERVAL = 30
+
+# Errors after which the connection has to be opened again
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+
+class Outbox():
+
+    '''
+        Outbox - Queue of outgoing messages, sent by a worker thread
+        Args:
+            host, port: address of the SMTP server
+            use_ssl: connect with SMTP_SSL (plain SMTP is only meant for local test servers)
+            email, pwd: credentials of the sender
+            store: MessageStore in which queued messages are kept
+            on_sent, on_failed: optional callbacks, called with (message_id, subject) from the worker thread
+    '''
+
+    def __init__(self, host, port, email, pwd, store, timeout=None, on_sent=None, on_failed=None, use_ssl=True):
+        self.logger = logging.getLogger(__name__)
+        self.host, self.port = host, port
+        self.use_ssl = use_ssl
+        self.email, self.pwd = email, pwd
+        self.store = store
+        self.timeout = timeout
+        self.on_sent, self.on_failed = on_sent, on_failed
+        self.smtp = None
+        self.last_used = 0
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def start(self):
+        ''' Starts the worker thread, messages left in the queue by a previous session are sent too '''
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+
+    def send(self, to, subject, body):
+        ''' Queues a new message and returns its id immediately '''
+        message = EmailMessage()
+        message["From"] = self.email
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+        message_id = self.store.queue_outgoing(self.email, message.as_bytes())
+        self.logger.debug(f"Queued message #{message_id}.")
+        self.wakeup.set()
+        return message_id
+
+    def run(self):
+        while not self.stopped.is_set():
+            item = self.store.next_outgoing(self.email)
+            now = time.time()
+            if item is None or item[3] > now:
+                # Nothing to send right now, close the connection if it has been idle for too long
+                if self.smtp is not None and time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT:
+                    self.disconnect()
+                delay = SMTP_IDLE_TIMEOUT if item is None else min(item[3] - now, SMTP_IDLE_TIMEOUT)
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+            self.deliver(*item)
+        self.disconnect()
+
+    def deliver(self, message_id, raw, attempts, next_attempt):
+        ''' Sends one queued message, reconnecting if needed '''
+        message = BytesParser(policy=default_policy).parsebytes(raw)
+        try:
+            if self.smtp is not None and time.monotonic() - self.last_used > SMTP_CHECK_INTERVAL:
+                if not self.is_alive():
+                    self.disconnect()
+            if self.smtp is None:
+                self.connect()
+            self.smtp.send_message(message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as err:
+            if getattr(err, 'smtp_code', 0) >= 500 or isinstance(err, smtplib.SMTPRecipientsRefused):
+                # Permanent failure, retrying will not help
+                self.fail(message_id, message, err)
+            else:
+                self.retry(message_id, message, attempts, err)
+            return
+        except CONNECTION_ERRORS as err:
+            self.disconnect()
+            self.retry(message_id, message, attempts, err)
+            return
+        except smtplib.SMTPException as err:
+            self.disconnect()
+            self.retry(message_id, message, attempts, err)
+            return
+        self.last_used = time.monotonic()
+        self.store.remove_outgoing(message_id)
+        self.logger.debug(f"Sent message #{message_id}.")
+        if self.on_sent is not None:
+            self.on_sent(message_id, message["Subject"])
+
+    def retry(self, message_id, message, attempts, err):
+        attempts += 1
+        if attempts >= MAX_ATTEMPTS:
+            self.fail(message_id, message, err)
+            return
+        delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+        self.logger.debug(f"Could not send message #{message_id}, retrying in {delay}s [{err}]")
+        self.store.postpone_outgoing(message_id, attempts, time.time() + delay)
+
+    def fail(self, message_id, message, err):
+        self.logger.error(f"Giving up on message #{message_id} [{err}]")
+        self.store.remove_outgoing(message_id)
+        if self.on_failed is not None:
+            self.on_failed(message_id, message["Subject"])
+
+    def connect(self):
+        if self.use_ssl:
+            self.smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            self.smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            self.smtp.login(self.email, self.pwd)
+        except Exception:
+            self.disconnect()
+            raise
+        self.last_used = time.monotonic()
+        self.logger.debug(f"Opened a new connection to '{self.host}'")
+
+    def is_alive(self):
+        try:
+            return self.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def disconnect(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            pass
+        self.smtp = None
+
+    def stop(self):
+        ''' Stops the worker thread, queued messages stay in the store for the next session '''
+        self.stopped.set()
+        self.wakeup.set()
+        self.worker = None
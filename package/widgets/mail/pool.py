@@ -0,0 +1,217 @@
+'''
+    pool.py
+
+    - Keeps authenticated IMAP connections alive so they can be reused across requests
+    - Idle connections are kept warm with NOOP keepalives and are logged out after a timeout
+    - Dropped connections are detected when they are handed out and replaced transparently
+'''
+
+import logging
+
+import time
+import imaplib
+import threading
+from contextlib import contextmanager
+
+
+# Maximum number of open connections per session
+POOL_SIZE = 2
+# Connections which are not used for this long (in seconds) are logged out
+POOL_IDLE_TIMEOUT = 600
+# Idle connections are sent a NOOP after this many seconds
+KEEPALIVE_INTERVAL = 60
+
+# Errors which mean that the connection itself is no longer usable
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+def quote(arg):
+    ''' Quotes a string argument (eg. a mailbox name with spaces) the same way imaplib does '''
+    return '"' + arg.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class IMAPConnectionPool():
+
+    '''
+        IMAPConnectionPool - Hands out authenticated IMAP connections
+        Args:
+            host, port: address of the IMAP server
+            use_ssl: connect with IMAP4_SSL (plain IMAP4 is only meant for local test servers)
+            email, pwd: credentials used to authenticate every connection
+            size: maximum number of connections open at the same time
+            idle_timeout: seconds after which an unused connection is closed
+            keepalive: seconds between NOOPs sent on idle connections
+            timeout: socket timeout for new connections
+    '''
+
+    def __init__(self, host, port, email, pwd, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+            keepalive=KEEPALIVE_INTERVAL, timeout=None, use_ssl=True):
+        self.logger = logging.getLogger(__name__)
+        self.host, self.port = host, port
+        self.use_ssl = use_ssl
+        self.email, self.pwd = email, pwd
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.timeout = timeout
+        # (connection, last_used, last_checked) entries, most recently used at the end
+        self.idle = []
+        self.open_connections = 0
+        self.closed = False
+        self.lock = threading.Condition()
+        self.stopped = threading.Event()
+        self.keepalive_thread = None
+
+    def connect(self):
+        ''' Opens and authenticates a new connection '''
+        if self.use_ssl:
+            conn = imaplib.IMAP4_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = imaplib.IMAP4(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.login(self.email, self.pwd)
+            # Servers usually advertise more capabilities (IDLE, CONDSTORE, ...) once logged in
+            retcode, data = conn.capability()
+            if retcode == 'OK':
+                conn.capabilities = tuple(data[-1].upper().decode('ascii').split())
+        except Exception:
+            self.discard(conn)
+            raise
+        conn.selected_mailbox = None
+        self.logger.debug(f"Opened a new connection to '{self.host}'")
+        return conn
+
+    def open(self):
+        '''
+            - Opens the first connection, raises if the credentials are rejected
+            - Starts the keepalive thread
+        '''
+        with self.lock:
+            self.open_connections += 1
+        try:
+            conn = self.connect()
+        except Exception:
+            with self.lock:
+                self.open_connections -= 1
+            raise
+        self.release(conn)
+        if self.keepalive_thread is None:
+            self.keepalive_thread = threading.Thread(target=self.keepalive_loop, daemon=True)
+            self.keepalive_thread.start()
+
+    def acquire(self):
+        ''' Returns a live connection, waits if all 'size' connections are in use '''
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise imaplib.IMAP4.error("Connection pool is closed")
+                if self.idle:
+                    conn, _, last_checked = self.idle.pop()
+                    break
+                if self.open_connections < self.size:
+                    self.open_connections += 1
+                    conn, last_checked = None, None
+                    break
+                self.lock.wait()
+        # Network operations are done without holding the lock
+        try:
+            if conn is None:
+                return self.connect()
+            if time.monotonic() - last_checked < self.keepalive or self.is_alive(conn):
+                return conn
+            # Connection was dropped by the server, replace it
+            self.logger.debug("Found a stale connection, reconnecting.")
+            self.discard(conn)
+            return self.connect()
+        except Exception:
+            with self.lock:
+                self.open_connections -= 1
+                self.lock.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        ''' Returns a connection to the pool, broken connections are closed instead '''
+        with self.lock:
+            if broken or self.closed:
+                self.open_connections -= 1
+            else:
+                now = time.monotonic()
+                self.idle.append((conn, now, now))
+            self.lock.notify()
+        if broken or self.closed:
+            self.discard(conn)
+
+    @contextmanager
+    def connection(self, mailbox=None):
+        '''
+            Context manager around acquire/release
+            - If 'mailbox' is given, it is selected (only if it isn't already selected on this connection)
+        '''
+        conn = self.acquire()
+        try:
+            if mailbox is not None and conn.selected_mailbox != mailbox:
+                retcode, _ = conn.select(quote(mailbox))
+                if retcode != 'OK':
+                    raise imaplib.IMAP4.error(f"Could not select '{mailbox}'")
+                conn.selected_mailbox = mailbox
+            yield conn
+        except CONNECTION_ERRORS:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def is_alive(self, conn):
+        try:
+            retcode, _ = conn.noop()
+            return retcode == 'OK'
+        except Exception:
+            return False
+
+    def discard(self, conn):
+        ''' Logs out a connection, ignoring any errors '''
+        try:
+            conn.logout()
+        except Exception:
+            pass
+
+    def keepalive_loop(self):
+        ''' Sends NOOPs on idle connections and closes the ones idle for longer than 'idle_timeout' '''
+        while not self.stopped.wait(self.keepalive):
+            with self.lock:
+                now = time.monotonic()
+                # Take out connections which need attention, leave the rest available
+                expired = [e for e in self.idle if now - e[1] >= self.idle_timeout]
+                stale = [e for e in self.idle if e not in expired and now - e[2] >= self.keepalive]
+                self.idle = [e for e in self.idle if e not in expired and e not in stale]
+                self.open_connections -= len(expired)
+                self.lock.notify_all()
+            for conn, _, _ in expired:
+                self.logger.debug("Closing idle connection.")
+                self.discard(conn)
+            for conn, last_used, _ in stale:
+                if not self.is_alive(conn):
+                    self.release(conn, broken=True)
+                    continue
+                with self.lock:
+                    if self.closed:
+                        self.open_connections -= 1
+                        self.discard(conn)
+                        continue
+                    # Keep 'last_used' so the connection still expires after 'idle_timeout'
+                    self.idle.insert(0, (conn, last_used, time.monotonic()))
+                    self.lock.notify()
+
+    def close(self):
+        ''' Logs out all idle connections, connections in use are closed when released '''
+        self.stopped.set()
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.open_connections -= len(idle)
+            self.lock.notify_all()
+        for conn, _, _ in idle:
+            self.discard(conn)
@@ -0,0 +1,591 @@
+'''
+    session.py
+
+    - Provides easy API to access an email account
+    - All IMAP traffic goes through a pool of authenticated connections (see pool.py)
+    - Fetched headers are kept in a local message store (see store.py), so only changes are
+        downloaded after the first sync
+    - Opening a message only downloads its text part, attachments are streamed to disk on request
+        (see structure.py)
+'''
+
+import logging
+
+import os
+import re
+import ssl
+import time
+import email
+import select
+import bisect
+import imaplib
+import itertools
+from email.policy import default as default_policy
+
+from .pool import IMAPConnectionPool, POOL_SIZE, POOL_IDLE_TIMEOUT, CONNECTION_ERRORS
+from .store import MessageStore
+from .message import MessageSummary, BodyCache, BODY_CACHE_SIZE, html_text
+from .structure import CHUNK_SIZE, Decoder, parse_bodystructure, text_part
+from .outbox import Outbox
+
+
+# Defaults, can be overridden per session or with the environment (i.e. to use a local test server,
+#   see fakeserver.py)
+SMTP_SERVER = os.environ.get("LYNX_SMTP_SERVER", "smtp.gmail.com")
+SMTP_SERVER_PORT = int(os.environ.get("LYNX_SMTP_SERVER_PORT", 465))
+
+IMAP_SERVER = os.environ.get("LYNX_IMAP_SERVER", "imap.gmail.com")
+IMAP_SERVER_PORT = int(os.environ.get("LYNX_IMAP_SERVER_PORT", 993))
+
+# TLS can only be turned off for local test servers
+USE_SSL = os.environ.get("LYNX_MAIL_SSL", "1") != "0"
+
+CONN_TIMEOUT = 5
+
+# Number of messages requested by a single FETCH command
+FETCH_BATCH_SIZE = 500
+# Number of messages shown on the dashboard at once
+PAGE_SIZE = 50
+# Only these headers are downloaded, message bodies are never touched
+HEADER_FIELDS = ("SUBJECT", "FROM", "DATE", "MESSAGE-ID")
+HEADER_QUERY = f"(UID FLAGS BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+# Same as HEADER_QUERY, used when the server supports CONDSTORE
+MODSEQ_HEADER_QUERY = f"(UID FLAGS MODSEQ BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+
+# Used to look at the parts of a message when it is opened
+STRUCTURE_QUERY = "(BODYSTRUCTURE)"
+# Saved attachments go here
+ATTACHMENT_DIR = "./attachments"
+
+# Messages with this flag are listed on the dashboard (same as the 'SEEN' search criteria)
+LISTED_FLAG = "\\Seen"
+
+UID_PATTERN = re.compile(rb"UID (\d+)")
+FLAGS_PATTERN = re.compile(rb"FLAGS \(([^)]*)\)")
+MODSEQ_PATTERN = re.compile(rb"MODSEQ \((\d+)\)")
+STATUS_PATTERN = re.compile(rb"(MESSAGES|UIDNEXT|UIDVALIDITY|HIGHESTMODSEQ) (\d+)")
+EXISTS_PATTERN = re.compile(rb"\* \d+ (EXISTS|RECENT)")
+
+# Servers drop IDLE after 30 minutes, so it is restarted a bit earlier
+IDLE_RENEW_INTERVAL = 25 * 60
+# How often (in seconds) the IDLE loop checks if it was asked to stop
+IDLE_TICK = 0.5
+# NOOP interval used for servers without IDLE support
+POLL_INTERVAL = 1
+
+
+def message_sets(nums, batch_size=FETCH_BATCH_SIZE, newest_first=False):
+    '''
+        Splits a list of message numbers into IMAP message-sets of at most 'batch_size' messages
+        - Consecutive numbers are collapsed into ranges, i.e. [1, 2, 3, 7] -> "1:3,7"
+        - If 'newest_first' is set, the set with the highest numbers comes first
+    '''
+    nums = sorted((int(n) for n in nums), reverse=newest_first)
+    for start in range(0, len(nums), batch_size):
+        ranges, batch = [], sorted(nums[start:start + batch_size])
+        first = last = batch[0]
+        for n in batch[1:]:
+            if n == last + 1:
+                last = n
+                continue
+            ranges.append(f"{first}:{last}" if first != last else str(first))
+            first = last = n
+        ranges.append(f"{first}:{last}" if first != last else str(first))
+        yield ",".join(ranges)
+
+
+def parse_header_response(data, mailbox=None, uidvalidity=None):
+    '''
+        Parses the response of a header-only FETCH command
+        - 'data' is the list returned by imaplib, where every message is a tuple (metadata, headers)
+            followed by a bytes object which may carry the rest of the metadata (eg. b' FLAGS (\\Seen))')
+        - Yields a MessageSummary for every message
+    '''
+    for i, part in enumerate(data):
+        if not isinstance(part, tuple):
+            continue
+        meta, headers = part
+        # Some servers send UID/FLAGS after the header literal
+        if i + 1 < len(data) and isinstance(data[i + 1], bytes):
+            meta += data[i + 1]
+        mail = email.message_from_bytes(headers, policy=default_policy)
+        uid, flags, modseq = UID_PATTERN.search(meta), FLAGS_PATTERN.search(meta), MODSEQ_PATTERN.search(meta)
+        yield MessageSummary(
+            uid=int(uid.group(1)) if uid else None,
+            subject=header_value(mail, "Subject"),
+            sender=header_value(mail, "From"),
+            date=header_value(mail, "Date"),
+            message_id=header_value(mail, "Message-ID"),
+            flags=tuple(flags.group(1).decode('ascii').split()) if flags else (),
+            modseq=int(modseq.group(1)) if modseq else None,
+            mailbox=mailbox,
+            uidvalidity=uidvalidity,
+        )
+
+
+def part_text(raw, part):
+    ''' Decodes a downloaded text part (BodyPart) into readable text '''
+    decoder = Decoder(part.encoding)
+    data = decoder.feed(raw) + decoder.flush()
+    try:
+        text = data.decode(part.charset, 'replace')
+    except LookupError: # Unknown charset
+        text = data.decode('utf-8', 'replace')
+    if part.subtype == 'html':
+        text = html_text(text)
+    return text.strip()
+
+
+def header_value(mail, name):
+    ''' Returns a decoded header as a plain string, malformed headers are returned as they are '''
+    try:
+        value = mail[name]
+    except Exception:
+        value = next((v for k, v in mail.raw_items() if k.lower() == name.lower()), None)
+    return str(value) if value is not None else None
+
+
+def parse_flags_response(data):
+    '''
+        Parses the response of a 'FETCH (UID FLAGS)' command (without any literals)
+        - Yields (uid, flags, modseq) for every message
+    '''
+    for line in data:
+        if not isinstance(line, bytes):
+            continue
+        uid, flags, modseq = UID_PATTERN.search(line), FLAGS_PATTERN.search(line), MODSEQ_PATTERN.search(line)
+        if uid and flags:
+            flags = tuple(flags.group(1).decode('ascii').split())
+            yield int(uid.group(1)), flags, int(modseq.group(1)) if modseq else 0
+
+
+class EmailSession():
+
+    ''' Provides easy access to email services '''
+
+    def __init__(self, pool_size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, store=None, body_cache_size=BODY_CACHE_SIZE,
+            imap_server=None, imap_port=None, smtp_server=None, smtp_port=None, use_ssl=None):
+        '''
+            Starts an IMAP session on given IMAP server (IMAP_SERVER by default)
+            - Servers, ports and 'use_ssl' which are not given are taken from the module defaults
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.imap_server = imap_server or IMAP_SERVER
+        self.imap_port = imap_port or IMAP_SERVER_PORT
+        self.smtp_server = smtp_server or SMTP_SERVER
+        self.smtp_port = smtp_port or SMTP_SERVER_PORT
+        self.use_ssl = USE_SSL if use_ssl is None else use_ssl
+        self.email = None
+        self.pwd = None
+        self.has_valid_creds = False
+        self.pool = None
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.store = store if store is not None else MessageStore()
+        self.bodies = BodyCache(body_cache_size)
+        self.history_uids = {} # (mailbox, uidvalidity) -> UIDs below the stored history
+        self.structures = {} # MessageSummary.key -> BodyParts of opened messages
+        self.outbox = None
+        # Called from the outbox thread with (message_id, subject)
+        self.on_sent = None
+        self.on_failed = None
+
+    def check_credentials(self, email, pwd):
+        ''' Logs in and keeps the authenticated connection in the pool for later requests '''
+        self.reset() # Discard connections of the previous user
+        try:
+            self.pool = IMAPConnectionPool(self.imap_server, self.imap_port, email, pwd, size=self.pool_size,
+                idle_timeout=self.idle_timeout, timeout=CONN_TIMEOUT, use_ssl=self.use_ssl)
+            self.pool.open()
+            self.email = email
+            self.pwd = pwd
+            self.logger.debug("Successfully logged in!")
+            self.has_valid_creds = True
+            # SMTP connection is only opened once there is something to send
+            self.outbox = Outbox(self.smtp_server, self.smtp_port, email, pwd, self.store, timeout=CONN_TIMEOUT,
+                on_sent=self.on_sent, on_failed=self.on_failed, use_ssl=self.use_ssl)
+            self.outbox.start()
+            return True
+        except Exception as err:
+            self.logger.debug("Login attempt was unsuccessful. [%s]", err)
+            self.pool = None
+            self.has_valid_creds = False
+            return False
+
+    def fetch_unread(self, batch_size=FETCH_BATCH_SIZE):
+        '''
+            Fetches unread emails from the email server
+            - Messages stored during earlier sessions are yielded first (after their flags are refreshed)
+            - Then messages newer than the stored ones are downloaded (see sync), followed by the
+                rest of the history (see fetch_older)
+        '''
+        if self.has_valid_creds:
+            try:
+                with self.pool.connection('inbox') as session:
+                    status = self.mailbox_status(session, 'inbox')
+                    new_uids = self.refresh(session, 'inbox', status)
+                    stored = self.store.messages(self.email, 'inbox')
+                    new = self.fetch_new(session, 'inbox', status, new_uids, batch_size)
+                    history = self.fetch_history(session, 'inbox', batch_size)
+                    for mail in itertools.chain(stored, new, history):
+                        if LISTED_FLAG in mail.flags:
+                            yield mail
+            except Exception as err:
+                # Broken connections are dropped by the pool and replaced on the next request
+                self.logger.error(f"Unknown error occurred [{err}]")
+                return
+        else:
+            # Code should never reach this point under normal circumstances
+            return
+
+    def fetch_page(self, before_uid=None, count=PAGE_SIZE):
+        '''
+            Returns (messages, has_more): up to 'count' listed messages with a UID lower than 'before_uid',
+                newest first
+            - The first page (before_uid=None) also syncs new messages
+            - Older messages are only downloaded once a page reaches past the stored history, so showing a
+                page takes the same time no matter how big the mailbox is
+        '''
+        if not self.has_valid_creds:
+            return [], False
+        try:
+            with self.pool.connection('inbox') as session:
+                if before_uid is None:
+                    for _ in self.sync(session, 'inbox', batch_size=count):
+                        pass
+                while True:
+                    page = self.store.page(self.email, 'inbox', before_uid, count, LISTED_FLAG)
+                    if len(page) == count:
+                        return page, True
+                    if self.fetch_older(session, 'inbox', count) is None:
+                        return page, False
+        except Exception as err:
+            self.logger.error(f"Unknown error occurred [{err}]")
+            return [], False
+
+    def watch(self, stop, batch_size=FETCH_BATCH_SIZE):
+        '''
+            Waits for new messages in the inbox and yields their headers as they arrive
+            - Uses IMAP IDLE when the server supports it, otherwise polls with NOOP every POLL_INTERVAL
+            - Every change reported by the server triggers an incremental sync
+            - Runs until 'stop' (threading.Event) is set, reconnects if the connection drops
+        '''
+        while self.has_valid_creds and not stop.is_set():
+            try:
+                with self.pool.connection('inbox') as session:
+                    supports_idle = 'IDLE' in session.capabilities
+                    self.logger.debug(f"Watching inbox for new mail ({'IDLE' if supports_idle else 'NOOP'})")
+                    while not stop.is_set():
+                        has_changes = self.idle(session, stop) if supports_idle else self.poll(session, stop)
+                        if has_changes and not stop.is_set():
+                            for mail in self.sync(session, 'inbox', batch_size=batch_size):
+                                if LISTED_FLAG in mail.flags:
+                                    yield mail
+            except CONNECTION_ERRORS as err:
+                self.logger.debug(f"Lost connection while watching inbox, reconnecting. [{err}]")
+                stop.wait(POLL_INTERVAL)
+            except Exception as err:
+                self.logger.error(f"Unknown error occurred [{err}]")
+                return
+
+    def fetch_folders(self, folders=None, batch_size=FETCH_BATCH_SIZE):
+        '''
+            Returns an async generator fetching new messages of several folders concurrently (see aio.py)
+            - Yields (folder, message) pairs, must be driven by an asyncio event loop
+        '''
+        from .aio import fetch_folders, FOLDERS
+        return fetch_folders(self.imap_server, self.imap_port, self.email, self.pwd, self.store,
+            folders or FOLDERS, batch_size, use_ssl=self.use_ssl)
+
+    def mailbox_status(self, session, mailbox):
+        '''
+            Returns MESSAGES, UIDNEXT, UIDVALIDITY (and HIGHESTMODSEQ if the server supports CONDSTORE)
+                of a mailbox as a dictionary
+            - If UIDVALIDITY changed since the last sync, the local copy of the mailbox is dropped
+        '''
+        items = "MESSAGES UIDNEXT UIDVALIDITY"
+        if 'CONDSTORE' in session.capabilities:
+            items += " HIGHESTMODSEQ"
+        retcode, data = session.status(mailbox, f"({items})")
+        if retcode != 'OK':
+            raise imaplib.IMAP4.error(f"Could not get status of '{mailbox}'")
+        status = { key.decode('ascii'): int(value) for key, value in STATUS_PATTERN.findall(data[0]) }
+        state = self.store.get_state(self.email, mailbox)
+        if state is not None and state[0] != status["UIDVALIDITY"]:
+            self.logger.debug(f"UIDVALIDITY of '{mailbox}' changed, syncing from scratch.")
+            self.store.reset_mailbox(self.email, mailbox)
+        return status
+
+    def sync(self, session, mailbox, status=None, batch_size=FETCH_BATCH_SIZE):
+        ''' Brings the local copy of a (selected) mailbox up to date and yields newly stored messages '''
+        if status is None:
+            status = self.mailbox_status(session, mailbox)
+        new_uids = self.refresh(session, mailbox, status)
+        yield from self.fetch_new(session, mailbox, status, new_uids, batch_size)
+
+    def refresh(self, session, mailbox, status):
+        '''
+            First (cheap) part of a sync, returns the UIDs of new messages which are not stored yet
+            - On the very first sync nothing is downloaded, the history is fetched later (see fetch_older)
+            - With CONDSTORE, flags of stored messages changed since the last sync are updated
+            - Messages expunged on the server are removed from the store
+        '''
+        uidvalidity = status["UIDVALIDITY"]
+        highestmodseq = status.get("HIGHESTMODSEQ", 0)
+        state = self.store.get_state(self.email, mailbox)
+        if state is None:
+            self.store.set_state(self.email, mailbox, uidvalidity, status["UIDNEXT"] - 1, highestmodseq,
+                status["UIDNEXT"])
+            return []
+        _, last_uid, modseq, first_uid = state
+        # Flag changes on messages we already have
+        if first_uid <= last_uid and modseq and highestmodseq > modseq:
+            retcode, data = session.uid('FETCH', f"{first_uid}:{last_uid}", f"(UID FLAGS) (CHANGEDSINCE {modseq})")
+            if retcode == 'OK':
+                changes = list(parse_flags_response(data))
+                self.store.update_flags(self.email, mailbox, uidvalidity, changes)
+                self.logger.debug(f"Updated flags of {len(changes)} messages.")
+        # New messages (UIDs above 'last_uid' may be stored already if the last sync was interrupted)
+        stored = self.store.uids(self.email, mailbox, uidvalidity, above=first_uid - 1)
+        new_uids, server_uids, searched_from = [], None, None
+        if status["UIDNEXT"] - 1 > last_uid or first_uid > 1:
+            # If only the newest part of the history is stored, it is compared with the server directly
+            searched_from = first_uid if first_uid > 1 else last_uid + 1
+            server_uids = self.search_uids(session, f"UID {searched_from}:*")
+            new_uids = sorted(uid for uid in server_uids if uid > last_uid and uid not in stored)
+        if first_uid <= 1 and len(stored) + len(new_uids) > status["MESSAGES"]:
+            searched_from, server_uids = 1, self.search_uids(session, "ALL")
+        # Messages removed on the server
+        if server_uids is not None:
+            removed = set(uid for uid in stored if uid >= searched_from) - server_uids
+            if removed:
+                self.store.remove_messages(self.email, mailbox, uidvalidity, removed)
+                self.logger.debug(f"Removed {len(removed)} expunged messages.")
+        if not new_uids:
+            self.store.set_state(self.email, mailbox, uidvalidity, last_uid, max(modseq, highestmodseq), first_uid)
+        return new_uids
+
+    def fetch_new(self, session, mailbox, status, uids, batch_size=FETCH_BATCH_SIZE):
+        ''' Second part of a sync, downloads headers of the given UIDs (newest first) and yields them once they are stored '''
+        if not uids:
+            return
+        uidvalidity = status["UIDVALIDITY"]
+        _, last_uid, modseq, first_uid = self.store.get_state(self.email, mailbox)
+        query = MODSEQ_HEADER_QUERY if "HIGHESTMODSEQ" in status else HEADER_QUERY
+        for mails in self.fetch_headers(session, mailbox, uidvalidity, uids, query, batch_size):
+            for mail in mails:
+                self.logger.debug(f"Fetched '{mail.subject}' email.")
+                yield mail
+        # Every new message is stored now
+        self.store.set_state(self.email, mailbox, uidvalidity, max(last_uid, max(uids)),
+            max(modseq, status.get("HIGHESTMODSEQ", 0)), first_uid)
+
+    def fetch_older(self, session, mailbox, count=PAGE_SIZE):
+        '''
+            Downloads headers of the next 'count' messages below the stored history, newest first
+            - Returns the downloaded messages, or None if the whole mailbox is stored already
+        '''
+        uidvalidity, last_uid, modseq, first_uid = self.store.get_state(self.email, mailbox)
+        if first_uid <= 1:
+            return None
+        # UIDs of the history are searched once per session
+        key = (mailbox, uidvalidity)
+        if key not in self.history_uids:
+            self.history_uids[key] = sorted(uid for uid in self.search_uids(session, f"UID 1:{first_uid - 1}")
+                if uid < first_uid)
+        history = self.history_uids[key]
+        end = bisect.bisect_left(history, first_uid)
+        uids = history[max(0, end - count):end]
+        mails = []
+        query = MODSEQ_HEADER_QUERY if 'CONDSTORE' in session.capabilities else HEADER_QUERY
+        for batch in self.fetch_headers(session, mailbox, uidvalidity, uids, query, count):
+            mails += batch
+        # Everything from the lowest fetched UID up is stored now
+        first_uid = uids[0] if end - count > 0 else 1
+        self.store.set_state(self.email, mailbox, uidvalidity, last_uid, modseq, first_uid)
+        return mails if uids else None
+
+    def fetch_history(self, session, mailbox, batch_size=FETCH_BATCH_SIZE):
+        ''' Yields the whole history below the stored messages, newest first '''
+        while True:
+            mails = self.fetch_older(session, mailbox, batch_size)
+            if mails is None:
+                return
+            yield from mails
+
+    def fetch_headers(self, session, mailbox, uidvalidity, uids, query, batch_size):
+        ''' Downloads headers of the given UIDs in batches (newest first), every batch is stored and yielded as a list '''
+        for message_set in message_sets(uids, batch_size, newest_first=True):
+            retcode, data = session.uid('FETCH', message_set, query)
+            if retcode != 'OK':
+                self.logger.debug(f"Could not fetch message-set '{message_set}'")
+                continue
+            mails = [mail for mail in parse_header_response(data, mailbox, uidvalidity) if mail.uid is not None]
+            self.store.add_messages(self.email, mailbox, uidvalidity, mails)
+            mails.sort(key=lambda mail: mail.uid, reverse=True)
+            yield mails
+
+    def search_uids(self, session, criteria):
+        retcode, data = session.uid('SEARCH', None, criteria)
+        if retcode != 'OK':
+            raise imaplib.IMAP4.error(f"UID SEARCH {criteria} failed")
+        return set(map(int, data[0].split()))
+
+    def idle(self, session, stop):
+        '''
+            Issues IDLE and waits until the server reports new messages, 'stop' is set or
+                IDLE_RENEW_INTERVAL passes
+            - Returns True if new messages were reported
+        '''
+        tag = session._new_tag()
+        session.send(tag + b" IDLE\r\n")
+        line = session.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE was rejected [{line}]")
+        has_changes, started = False, time.monotonic()
+        while not has_changes and not stop.is_set() and time.monotonic() - started < IDLE_RENEW_INTERVAL:
+            if not self.has_pending_data(session):
+                select.select([session.sock], [], [], IDLE_TICK)
+                continue
+            line = session.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("socket error: EOF")
+            has_changes = EXISTS_PATTERN.match(line) is not None
+        # End IDLE and wait for the tagged reply
+        session.send(b"DONE\r\n")
+        while True:
+            line = session.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("socket error: EOF")
+            if line.startswith(tag):
+                break
+            has_changes = has_changes or EXISTS_PATTERN.match(line) is not None
+        if not line.startswith(tag + b" OK"):
+            raise imaplib.IMAP4.error(f"IDLE failed [{line}]")
+        return has_changes
+
+    def poll(self, session, stop):
+        ''' Waits POLL_INTERVAL and sends a NOOP, returns True if the server reported new messages '''
+        if stop.wait(POLL_INTERVAL):
+            return False
+        session.noop()
+        _, exists = session.response('EXISTS')
+        return exists[0] is not None
+
+    def has_pending_data(self, session):
+        '''
+            Checks, without blocking, if a response line is waiting to be read
+            - imaplib reads through a buffered file, so data may be waiting there even when the
+                socket itself has nothing left to read
+        '''
+        timeout = session.sock.gettimeout()
+        session.sock.setblocking(False)
+        try:
+            return len(session.file.peek(1)) > 0
+        except (ssl.SSLWantReadError, BlockingIOError):
+            return False
+        finally:
+            session.sock.settimeout(timeout)
+
+    def load_body(self, summary):
+        '''
+            Returns the text of a message, downloading and decoding only its text part if it isn't cached
+            - 'summary' is a MessageSummary (as yielded by fetch_unread/watch)
+            - Attachments are never downloaded here (see attachments/save_attachment)
+        '''
+        body = self.bodies.get(summary.key)
+        if body is not None:
+            return body
+        with self.pool.connection(summary.mailbox) as session:
+            part = text_part(self.fetch_structure(session, summary))
+            raw = b"" if part is None else self.fetch_section(session, summary.uid, part.section)
+        body = "" if part is None else part_text(raw, part)
+        self.bodies.put(summary.key, body)
+        return body
+
+    def attachments(self, summary):
+        ''' Returns the attachments (BodyPart) of a message, without downloading them '''
+        parts = self.structures.get(summary.key)
+        if parts is None:
+            with self.pool.connection(summary.mailbox) as session:
+                parts = self.fetch_structure(session, summary)
+        return [part for part in parts if part is not text_part(parts) and part.is_attachment]
+
+    def save_attachment(self, summary, part, directory=ATTACHMENT_DIR, progress=None):
+        '''
+            Downloads an attachment into 'directory' and returns the path of the saved file
+            - The part is fetched in CHUNK_SIZE pieces and decoded as it arrives, so memory use does not
+                depend on the size of the attachment
+            - 'progress' is called with (downloaded bytes, size) after every chunk
+        '''
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.basename(part.filename or "") or f"{summary.uid}-{part.section}.{part.subtype or 'bin'}"
+        root, extension = os.path.splitext(name)
+        path, copy = os.path.join(directory, name), 1
+        while os.path.exists(path):
+            path, copy = os.path.join(directory, f"{root} ({copy}){extension}"), copy + 1
+        decoder, offset = Decoder(part.encoding), 0
+        try:
+            with self.pool.connection(summary.mailbox) as session, open(path + ".part", "wb") as file:
+                while True:
+                    chunk = self.fetch_section(session, summary.uid, part.section, offset, CHUNK_SIZE)
+                    file.write(decoder.feed(chunk))
+                    offset += len(chunk)
+                    if progress is not None:
+                        progress(offset, part.size)
+                    if len(chunk) < CHUNK_SIZE:
+                        break
+                file.write(decoder.flush())
+        except Exception:
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+            raise
+        os.replace(path + ".part", path)
+        self.logger.debug(f"Saved attachment '{name}' ({offset} bytes)")
+        return path
+
+    def fetch_structure(self, session, summary):
+        retcode, data = session.uid('FETCH', str(summary.uid), STRUCTURE_QUERY)
+        parts = parse_bodystructure(data) if retcode == 'OK' else []
+        if not parts:
+            raise imaplib.IMAP4.error(f"Could not fetch structure of message {summary.uid}")
+        self.structures[summary.key] = parts
+        return parts
+
+    def fetch_section(self, session, uid, section, offset=None, length=None):
+        ''' Downloads one part of a message (or 'length' bytes of it, starting at 'offset') '''
+        partial = "" if offset is None else f"<{offset}.{length}>"
+        retcode, data = session.uid('FETCH', str(uid), f"(BODY.PEEK[{section}]{partial})")
+        if retcode != 'OK':
+            raise imaplib.IMAP4.error(f"Could not fetch part {section} of message {uid}")
+        # Empty parts may come back as "" instead of a literal
+        return next((part[1] for part in data if isinstance(part, tuple)), b"")
+
+    def search(self, text=None, sender=None, mailbox=None):
+        '''
+            Searches synced messages of the current account (see MessageStore.search)
+            - Only reads the local store, so it works offline and does not wait for the server
+        '''
+        if not self.has_valid_creds:
+            return []
+        return self.store.search(self.email, text, sender, mailbox)
+
+    def send_email(self, to, subject, body):
+        ''' Queues an email in the outbox, it is sent in the background. Returns the id of the queued message '''
+        if not self.has_valid_creds:
+            return None
+        return self.outbox.send(to, subject, body)
+
+    def reset(self):
+        self.bodies.clear()
+        self.history_uids.clear()
+        self.structures.clear()
+        if self.outbox is not None:
+            self.outbox.stop()
+            self.outbox = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        self.email = None
+        self.pwd = None
+        self.has_valid_creds = False
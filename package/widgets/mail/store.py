@@ -0,0 +1,264 @@
+'''
+    store.py
+
+    - Local copy of the message headers fetched from the IMAP server
+    - Messages are keyed by (account, mailbox, UIDVALIDITY, UID), so a sync only has to ask the
+        server for UIDs above the last stored one
+    - History is synced from newest to oldest, every UID from 'first_uid' to 'last_uid' is stored
+        (first_uid = 1 means that the whole mailbox is stored)
+    - Subjects and senders are indexed with SQLite FTS5 (kept up to date by triggers), so messages can be
+        searched locally without asking the server
+    - Also keeps the outgoing messages queued by the outbox (see outbox.py) until they are sent
+    - By default, the store is set to 'messages.db' in the project root directory (next to 'database.json')
+'''
+
+import logging
+
+import re
+import sqlite3
+import threading
+
+from .message import MessageSummary
+
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS mailboxes (
+        account TEXT NOT NULL,
+        mailbox TEXT NOT NULL,
+        uidvalidity INTEGER NOT NULL,
+        last_uid INTEGER NOT NULL DEFAULT 0,
+        highestmodseq INTEGER NOT NULL DEFAULT 0,
+        first_uid INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (account, mailbox)
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        account TEXT NOT NULL,
+        mailbox TEXT NOT NULL,
+        uidvalidity INTEGER NOT NULL,
+        uid INTEGER NOT NULL,
+        subject TEXT,
+        sender TEXT,
+        date TEXT,
+        message_id TEXT,
+        flags TEXT NOT NULL DEFAULT '',
+        modseq INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (account, mailbox, uidvalidity, uid)
+    );
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account TEXT NOT NULL,
+        message BLOB NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL DEFAULT 0
+    );
+"""
+
+# Full-text index over the messages table, rows are matched by rowid
+SEARCH_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5 (
+        subject, sender, content='messages', content_rowid='rowid',
+        tokenize='porter unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER IF NOT EXISTS message_index_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO message_index (rowid, subject, sender) VALUES (new.rowid, new.subject, new.sender);
+    END;
+    CREATE TRIGGER IF NOT EXISTS message_index_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO message_index (message_index, rowid, subject, sender)
+            VALUES ('delete', old.rowid, old.subject, old.sender);
+    END;
+    CREATE TRIGGER IF NOT EXISTS message_index_update AFTER UPDATE OF subject, sender ON messages BEGIN
+        INSERT INTO message_index (message_index, rowid, subject, sender)
+            VALUES ('delete', old.rowid, old.subject, old.sender);
+        INSERT INTO message_index (rowid, subject, sender) VALUES (new.rowid, new.subject, new.sender);
+    END;
+"""
+
+# MessageSummary fields stored as they are
+COLUMNS = ("subject", "sender", "date", "message_id")
+# Maximum number of messages returned by a search
+SEARCH_LIMIT = 50
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class MessageStore():
+
+    '''
+        MessageStore - Keeps message headers and per-mailbox sync state on disk
+        - Can be used from multiple threads (IMAP watcher and email worker)
+    '''
+
+    STORE_PATH = "./messages.db"
+
+    def __init__(self, path=STORE_PATH):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # 'INSERT OR REPLACE' only runs delete triggers with recursive triggers enabled
+        self.db.execute("PRAGMA recursive_triggers = ON")
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(mailboxes)")]
+            if "first_uid" not in columns: # Stores created before paging was added
+                self.db.execute("ALTER TABLE mailboxes ADD COLUMN first_uid INTEGER NOT NULL DEFAULT 1")
+            self.has_index = self.create_index()
+
+    def create_index(self):
+        ''' Sets up the search index, returns False if SQLite was built without FTS5 '''
+        exists = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'message_index'").fetchone()
+        try:
+            self.db.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError as err:
+            self.logger.error(f"Search index is not available, falling back to a full scan [{err}]")
+            return False
+        if exists is None: # Stores created before the index was added
+            self.db.execute("INSERT INTO message_index (message_index) VALUES ('rebuild')")
+        return True
+
+    def get_state(self, account, mailbox):
+        '''
+            Returns (uidvalidity, last_uid, highestmodseq, first_uid) of a mailbox, or None if it was never synced
+        '''
+        with self.lock:
+            return self.db.execute(
+                "SELECT uidvalidity, last_uid, highestmodseq, first_uid FROM mailboxes "
+                "WHERE account = ? AND mailbox = ?", (account, mailbox)).fetchone()
+
+    def set_state(self, account, mailbox, uidvalidity, last_uid, highestmodseq, first_uid):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO mailboxes (account, mailbox, uidvalidity, last_uid, highestmodseq, first_uid) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (account, mailbox, uidvalidity, last_uid, highestmodseq, first_uid))
+
+    def reset_mailbox(self, account, mailbox):
+        ''' Drops everything stored for a mailbox, used when the server changes UIDVALIDITY '''
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM messages WHERE account = ? AND mailbox = ?", (account, mailbox))
+            self.db.execute("DELETE FROM mailboxes WHERE account = ? AND mailbox = ?", (account, mailbox))
+        self.logger.debug(f"Cleared local copy of '{mailbox}'")
+
+    def add_messages(self, account, mailbox, uidvalidity, mails):
+        ''' Stores a batch of messages (MessageSummary) in one transaction '''
+        rows = [
+            (account, mailbox, uidvalidity, mail.uid, *(getattr(mail, c) for c in COLUMNS),
+                " ".join(mail.flags), mail.modseq or 0)
+            for mail in mails
+        ]
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def update_flags(self, account, mailbox, uidvalidity, changes):
+        ''' Updates flags of stored messages, 'changes' is a list of (uid, flags, modseq) '''
+        rows = [(" ".join(flags), modseq, account, mailbox, uidvalidity, uid) for uid, flags, modseq in changes]
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE messages SET flags = ?, modseq = ? "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?", rows)
+
+    def remove_messages(self, account, mailbox, uidvalidity, uids):
+        rows = [(account, mailbox, uidvalidity, uid) for uid in uids]
+        with self.lock, self.db:
+            self.db.executemany(
+                "DELETE FROM messages WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?", rows)
+
+    def uids(self, account, mailbox, uidvalidity, above=0):
+        ''' Returns the set of stored UIDs (only the ones greater than 'above') '''
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT uid FROM messages WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid > ?",
+                (account, mailbox, uidvalidity, above)).fetchall()
+        return set(uid for uid, in rows)
+
+    def messages(self, account, mailbox):
+        ''' Yields stored messages (MessageSummary) of a mailbox, oldest first '''
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT uidvalidity, uid, flags, modseq, {', '.join(COLUMNS)} FROM messages "
+                "WHERE account = ? AND mailbox = ? ORDER BY uid", (account, mailbox)).fetchall()
+        for uidvalidity, uid, flags, modseq, *headers in rows:
+            yield MessageSummary(uid, *headers, flags=tuple(flags.split()), modseq=modseq,
+                mailbox=mailbox, uidvalidity=uidvalidity)
+
+    def page(self, account, mailbox, before_uid=None, count=50, flag=None):
+        '''
+            Returns up to 'count' stored messages with a UID lower than 'before_uid', newest first
+            - If 'flag' is given, only messages with that flag are returned
+        '''
+        query = "SELECT uidvalidity, uid, flags, modseq, " + ", ".join(COLUMNS) + " FROM messages " \
+            "WHERE account = ? AND mailbox = ? AND uid < ?"
+        args = [account, mailbox, before_uid if before_uid is not None else 2 ** 63 - 1]
+        if flag is not None:
+            query += " AND (' ' || flags || ' ') LIKE ?"
+            args.append(f"% {flag} %")
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY uid DESC LIMIT ?", (*args, count)).fetchall()
+        return [
+            MessageSummary(uid, *headers, flags=tuple(flags.split()), modseq=modseq,
+                mailbox=mailbox, uidvalidity=uidvalidity)
+            for uidvalidity, uid, flags, modseq, *headers in rows
+        ]
+
+    def search(self, account, text=None, sender=None, mailbox=None, limit=SEARCH_LIMIT):
+        '''
+            Returns up to 'limit' stored messages matching all words of 'text' (in subject or sender) and
+                of 'sender' (in sender only), newest first
+            - Words are stemmed and match as prefixes, case and accent insensitively, i.e. "invoices" matches
+                "Invoice" and "zoe" matches "Zoë"
+            - Only messages which were synced are found, the server is never asked
+        '''
+        text_words = WORD_PATTERN.findall(text or "")
+        sender_words = WORD_PATTERN.findall(sender or "")
+        if not text_words and not sender_words:
+            return []
+        args = [account]
+        if self.has_index:
+            terms = [f'"{word}"*' for word in text_words] + [f'sender : "{word}"*' for word in sender_words]
+            query = f"SELECT m.uidvalidity, m.uid, m.flags, m.modseq, m.mailbox, " \
+                f"{', '.join('m.' + c for c in COLUMNS)} FROM message_index " \
+                "JOIN messages m ON m.rowid = message_index.rowid " \
+                "WHERE message_index MATCH ? AND m.account = ?"
+            args.insert(0, " ".join(terms))
+        else:
+            query = f"SELECT uidvalidity, uid, flags, modseq, mailbox, {', '.join(COLUMNS)} FROM messages m " \
+                "WHERE account = ?"
+            for word in text_words:
+                query += " AND (subject LIKE ? OR sender LIKE ?)"
+                args += [f"%{word}%"] * 2
+            for word in sender_words:
+                query += " AND sender LIKE ?"
+                args.append(f"%{word}%")
+        if mailbox is not None:
+            query += " AND m.mailbox = ?"
+            args.append(mailbox)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY m.uid DESC LIMIT ?", (*args, limit)).fetchall()
+        return [
+            MessageSummary(uid, *headers, flags=tuple(flags.split()), modseq=modseq,
+                mailbox=mailbox, uidvalidity=uidvalidity)
+            for uidvalidity, uid, flags, modseq, mailbox, *headers in rows
+        ]
+
+    def queue_outgoing(self, account, message):
+        ''' Adds a raw message (bytes) to the outbox, returns its id '''
+        with self.lock, self.db:
+            return self.db.execute("INSERT INTO outbox (account, message) VALUES (?, ?)", (account, message)).lastrowid
+
+    def next_outgoing(self, account):
+        ''' Returns (id, message, attempts, next_attempt) of the message which is due first, or None '''
+        with self.lock:
+            return self.db.execute(
+                "SELECT id, message, attempts, next_attempt FROM outbox WHERE account = ? "
+                "ORDER BY next_attempt, id LIMIT 1", (account,)).fetchone()
+
+    def postpone_outgoing(self, message_id, attempts, next_attempt):
+        with self.lock, self.db:
+            self.db.execute("UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+                (attempts, next_attempt, message_id))
+
+    def remove_outgoing(self, message_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,206 @@
+'''
+    structure.py
+
+    - Parses BODYSTRUCTURE responses, so a message can be inspected without downloading it
+    - Only the text part of a message is fetched to display it, attachments are skipped
+    - Attachments are downloaded on request in fixed-size chunks and decoded while they are written
+        to disk, so a big attachment never has to fit in memory
+'''
+
+import re
+import binascii
+import itertools
+from email.header import decode_header, make_header
+
+
+# Bytes requested by a single partial FETCH while an attachment is streamed to disk
+CHUNK_SIZE = 64 * 1024
+
+TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"]+))')
+QUOTED_ESCAPE_PATTERN = re.compile(rb'\\(.)')
+
+# Sentinels returned by the tokenizer for list delimiters
+OPEN, CLOSE = object(), object()
+
+
+class BodyPart():
+
+    ''' A single (non-multipart) part of a message, 'section' is its IMAP part specifier (i.e. "1.2") '''
+
+    __slots__ = ("section", "type", "subtype", "params", "encoding", "size", "disposition", "filename")
+
+    def __init__(self, section, type, subtype, params=None, encoding=None, size=0, disposition=None, filename=None):
+        self.section = section
+        self.type = type
+        self.subtype = subtype
+        self.params = params or {}
+        self.encoding = encoding
+        self.size = size
+        self.disposition = disposition
+        self.filename = filename
+
+    @property
+    def is_attachment(self):
+        ''' Parts which are not displayed as the message text '''
+        if self.disposition == "attachment" or self.filename is not None:
+            return True
+        return self.type != "text"
+
+    @property
+    def charset(self):
+        return self.params.get("charset", "us-ascii")
+
+    def __repr__(self):
+        return f"BodyPart({self.section}, {self.type}/{self.subtype}, size={self.size}, filename={self.filename!r})"
+
+
+def tokens(data):
+    '''
+        Splits an IMAP response (as returned by imaplib) into tokens
+        - Lists are delimited by OPEN/CLOSE, NIL is None, strings and atoms are returned as str
+    '''
+    for part in data:
+        line, literal = part if isinstance(part, tuple) else (part, None)
+        if not isinstance(line, bytes):
+            continue
+        pos = 0
+        while True:
+            match = TOKEN_PATTERN.match(line, pos)
+            if match is None:
+                break
+            pos = match.end()
+            if match.group(1):
+                yield OPEN
+            elif match.group(2):
+                yield CLOSE
+            elif match.group(3) is not None:
+                yield QUOTED_ESCAPE_PATTERN.sub(rb'\1', match.group(3)).decode('utf-8', 'replace')
+            elif match.group(4) is not None:
+                yield (literal or b"").decode('utf-8', 'replace')
+            else:
+                atom = match.group(5).decode('utf-8', 'replace')
+                yield None if atom.upper() == "NIL" else atom
+
+
+def parse_lists(data):
+    ''' Returns the tokens of a response as nested lists '''
+    stack = [[]]
+    for token in tokens(data):
+        if token is OPEN:
+            stack.append([])
+        elif token is CLOSE:
+            if len(stack) > 1:
+                closed = stack.pop()
+                stack[-1].append(closed)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def parse_params(params):
+    ''' ("NAME" "value" ...) -> {"name": "value"} '''
+    if not isinstance(params, list):
+        return {}
+    return {str(key).lower(): value for key, value in zip(params[::2], params[1::2]) if key is not None}
+
+
+def decode_filename(name):
+    if name is None:
+        return None
+    try:
+        return str(make_header(decode_header(name)))
+    except Exception:
+        return name
+
+
+def parse_part(body, section):
+    '''
+        Flattens a parsed body structure into a list of BodyPart (multiparts are not included)
+        - See RFC 3501 section 7.4.2 for the layout of the fields
+    '''
+    if isinstance(body[0], list):
+        # Multipart: children come first, followed by the subtype and extension data
+        parts = []
+        for index, child in enumerate(itertools.takewhile(lambda item: isinstance(item, list), body), 1):
+            if child:
+                parts += parse_part(child, f"{section}.{index}" if section else str(index))
+        return parts
+    type, subtype = (body[0] or "").lower(), (body[1] or "").lower()
+    params = parse_params(body[2])
+    encoding = (body[5] or "7bit").lower() if len(body) > 5 else "7bit"
+    size = int(body[6]) if len(body) > 6 and str(body[6]).isdigit() else 0
+    # Extension data starts after the type specific fields
+    if type == "text":
+        extension = 8
+    elif type == "message" and subtype == "rfc822":
+        extension = 10
+    else:
+        extension = 7
+    disposition, disposition_params = None, {}
+    if len(body) > extension + 1 and isinstance(body[extension + 1], list):
+        disposition = (body[extension + 1][0] or "").lower()
+        disposition_params = parse_params(body[extension + 1][1] if len(body[extension + 1]) > 1 else None)
+    filename = disposition_params.get("filename") or params.get("name")
+    return [BodyPart(section or "1", type, subtype, params, encoding, size, disposition, decode_filename(filename))]
+
+
+def parse_bodystructure(data):
+    ''' Returns the BodyPart list from a 'UID FETCH <uid> (BODYSTRUCTURE)' response, or [] if there is none '''
+    for response in parse_lists(data):
+        if not isinstance(response, list):
+            continue
+        for key, value in zip(response[::2], response[1::2]):
+            if isinstance(key, str) and key.upper() == "BODYSTRUCTURE" and isinstance(value, list):
+                return parse_part(value, "")
+    return []
+
+
+def text_part(parts):
+    ''' Returns the part holding the message text, plain text is preferred over HTML '''
+    texts = [part for part in parts if part.type == "text" and part.disposition != "attachment"
+        and part.filename is None]
+    for subtype in ("plain", "html"):
+        for part in texts:
+            if part.subtype == subtype:
+                return part
+    return None
+
+
+class Decoder():
+
+    '''
+        Decoder - Incrementally decodes a transfer-encoded part (base64, quoted-printable or none)
+        - Input can be split at any byte, incomplete input is kept until the next chunk arrives
+    '''
+
+    def __init__(self, encoding):
+        self.encoding = (encoding or "7bit").lower()
+        self.pending = b""
+
+    def feed(self, chunk):
+        data = self.pending + chunk
+        if self.encoding == "base64":
+            data = b"".join(data.split())
+            end = len(data) - len(data) % 4
+            self.pending = data[end:]
+            return binascii.a2b_base64(data[:end]) if end else b""
+        if self.encoding == "quoted-printable":
+            # Only complete lines are decoded, so escapes and soft line breaks are never split
+            end = data.rfind(b"\n") + 1
+            self.pending = data[end:]
+            return binascii.a2b_qp(data[:end]) if end else b""
+        self.pending = b""
+        return data
+
+    def flush(self):
+        data, self.pending = self.pending, b""
+        if not data:
+            return b""
+        if self.encoding == "base64":
+            try:
+                return binascii.a2b_base64(data + b"=" * (-len(data) % 4))
+            except binascii.Error: # Truncated input
+                return b""
+        if self.encoding == "quoted-printable":
+            return binascii.a2b_qp(data)
+        return data
@@ -0,0 +1,10 @@
+'''
+    speech [module]
+
+    - Offline text-to-speech used to read emails aloud
+'''
+
+from .session import SpeechSession
+from .synthesizer import Synthesizer, SpeechError
+from .cache import ClipCache
+from .player import Player
@@ -0,0 +1,125 @@
+'''
+    cache.py
+
+    - Keeps synthesized clips on disk, keyed by a hash of the text and the voice settings
+    - When the cache grows above its size limit, the least recently used clips are deleted
+    - Clips are spoken emails, so the cache is cleared when the user logs out (see SpeechSession.reset)
+    - By default, clips are kept in 'speech-cache' in the project root directory
+'''
+
+import logging
+
+import os
+import time
+import hashlib
+import threading
+
+
+CACHE_DIR = "./speech-cache"
+# Maximum total size of cached clips (in bytes), about 25 minutes of espeak-ng audio
+CACHE_SIZE = 64 * 1024 * 1024
+
+
+class ClipCache():
+
+    '''
+        ClipCache - Size-bounded LRU cache of audio clips on disk
+        - Can be used from multiple threads (prefetching and reading aloud)
+        - Last use is kept in the file's modification time, so the order survives restarts
+    '''
+
+    def __init__(self, directory=CACHE_DIR, max_size=CACHE_SIZE):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # key -> [size, last_used]
+        self.clips = {}
+        for name in os.listdir(directory):
+            key, extension = os.path.splitext(name)
+            if extension != ".wav":
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            self.clips[key] = [stat.st_size, stat.st_mtime]
+        self.size = sum(size for size, _ in self.clips.values())
+        self.generation = 0 # Counts calls to clear, clips started before one are not added
+
+    @staticmethod
+    def key(text, identity=""):
+        return hashlib.sha256(f"{identity}\n{text}".encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".wav")
+
+    def get(self, key):
+        ''' Returns the path of a cached clip (and marks it as used), or None '''
+        with self.lock:
+            clip = self.clips.get(key)
+            if clip is None:
+                return None
+            clip[1] = time.time()
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError: # Deleted behind our back
+            with self.lock:
+                self.remove(key)
+            return None
+        return self.path(key)
+
+    def put(self, key, synthesize):
+        '''
+            Creates a clip with 'synthesize(path)' and adds it to the cache, returns its path
+            - The clip is written to a temporary file first, so a half written clip is never handed out
+            - Returns None if the cache was cleared while the clip was synthesized
+        '''
+        path = self.path(key)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        generation = self.generation
+        try:
+            synthesize(temporary)
+            with self.lock:
+                if generation != self.generation:
+                    return None
+                os.replace(temporary, path)
+                self.remove(key)
+                self.clips[key] = [os.path.getsize(path), time.time()]
+                self.size += self.clips[key][0]
+                self.evict(keep=key)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return path
+
+    def evict(self, keep=None):
+        ''' Deletes least recently used clips until the cache fits in 'max_size' '''
+        if self.size <= self.max_size:
+            return
+        for key in sorted(self.clips, key=lambda key: self.clips[key][1]):
+            if self.size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            self.remove(key)
+            self.logger.debug(f"Evicted clip {key[:8]}")
+
+    def clear(self):
+        ''' Deletes every clip, eg. when the user logs out (clips are spoken emails) '''
+        with self.lock:
+            self.generation += 1
+            for key in list(self.clips):
+                try:
+                    os.remove(self.path(key))
+                except FileNotFoundError:
+                    pass
+                self.remove(key)
+        self.logger.debug("Cleared speech cache")
+
+    def remove(self, key):
+        clip = self.clips.pop(key, None)
+        if clip is not None:
+            self.size -= clip[0]
@@ -0,0 +1,69 @@
+'''
+    player.py
+
+    - Plays WAV clips with the platform's command line player (winsound on Windows)
+    - Playback can be stopped from any thread
+'''
+
+import logging
+
+import sys
+import wave
+import threading
+import subprocess
+
+
+if sys.platform == "darwin":
+    PLAYER_COMMAND = ("afplay",)
+else:
+    PLAYER_COMMAND = ("aplay", "-q")
+
+
+class Player():
+
+    ''' Player - Plays one clip at a time, 'play' blocks until the clip ends or 'stop' is called '''
+
+    def __init__(self, command=PLAYER_COMMAND):
+        self.logger = logging.getLogger(__name__)
+        self.command = command
+        self.process = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def play(self, path):
+        ''' Returns False if playback was stopped before the clip ended '''
+        if sys.platform == "win32":
+            return self.play_winsound(path)
+        with self.lock:
+            if self.stopped.is_set():
+                return False
+            self.process = subprocess.Popen([*self.command, path], stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        self.process.wait()
+        with self.lock:
+            self.process = None
+        return not self.stopped.is_set()
+
+    def play_winsound(self, path):
+        ''' winsound can only be interrupted while playing asynchronously, so the clip's duration is waited out '''
+        import winsound
+        if self.stopped.is_set():
+            return False
+        with wave.open(path, 'rb') as clip:
+            duration = clip.getnframes() / clip.getframerate()
+        winsound.PlaySound(path, winsound.SND_FILENAME | winsound.SND_ASYNC)
+        return not self.stopped.wait(duration)
+
+    def stop(self):
+        ''' Stops the current clip, 'play' returns False until 'resume' is called '''
+        self.stopped.set()
+        if sys.platform == "win32":
+            import winsound
+            winsound.PlaySound(None, 0)
+            return
+        with self.lock:
+            if self.process is not None:
+                self.process.terminate()
+
+    def resume(self):
+        self.stopped.clear()
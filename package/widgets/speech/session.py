@@ -0,0 +1,177 @@
+'''
+    session.py
+
+    - Reads emails aloud, clips are synthesized once and then played from the cache (see cache.py)
+    - Clips for the next few messages are synthesized ahead of time by a background thread, so reading
+        a message starts at once
+    - Texts are spoken sentence by sentence (see stream.py), clips are cached per sentence
+'''
+
+import logging
+
+import threading
+import concurrent.futures
+from email.utils import parseaddr
+
+from .cache import ClipCache, CACHE_DIR, CACHE_SIZE
+from .player import Player
+from .stream import SpeechStream, split_sentences
+from .synthesizer import Synthesizer
+
+
+# Number of messages (after the one read last) which are synthesized ahead of time
+PREFETCH_COUNT = 5
+# Only the beginning of a body is prefetched, the rest is synthesized while it is read
+PREFETCH_SENTENCES = 3
+# Number of sentences synthesized at the same time while reading
+SYNTHESIS_WORKERS = 2
+
+
+def header_text(email):
+    ''' What is read out for an email before its body, 'email' is a MessageSummary '''
+    name, address = parseaddr(email.sender or "")
+    return f"Email from {name or address or 'unknown sender'}. {email.subject or 'No subject'}."
+
+
+class SpeechSession():
+
+    '''
+        SpeechSession - Reads emails aloud
+        - 'emails' is the list of emails in the order they will be read, the prefetcher works on the
+            PREFETCH_COUNT emails after the one read last
+    '''
+
+    def __init__(self, synthesizer=None, player=None, cache_dir=CACHE_DIR, cache_size=CACHE_SIZE,
+            prefetch_count=PREFETCH_COUNT, workers=SYNTHESIS_WORKERS):
+        self.logger = logging.getLogger(__name__)
+        self.synthesizer = synthesizer if synthesizer is not None else Synthesizer()
+        self.player = player if player is not None else Player()
+        self.cache = ClipCache(cache_dir, cache_size)
+        self.prefetch_count = prefetch_count
+        self.emails = []
+        self.bodies = {} # MessageSummary.key -> body text of upcoming emails
+        self.requested = set() # Keys of emails whose bodies were asked for (see missing_bodies)
+        self.position = 0 # Index of the email after the one read last
+        self.failed = set() # Texts the engine could not synthesize, not retried by the prefetcher
+        self.changed = threading.Condition()
+        self.stopped = threading.Event()
+        self.prefetcher = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="speech")
+        self.stream = None
+
+    def start(self):
+        if self.prefetcher is None:
+            self.stopped = threading.Event()
+            self.prefetcher = threading.Thread(target=self.prefetch, args=(self.stopped,), daemon=True)
+            self.prefetcher.start()
+
+    def add_email(self, email):
+        with self.changed:
+            self.emails.append(email)
+            self.changed.notify()
+
+    def add_body(self, email, body):
+        ''' Lets the prefetcher synthesize the body of an upcoming email too '''
+        with self.changed:
+            self.bodies[email.key] = body
+            self.changed.notify()
+
+    def upcoming(self):
+        ''' Emails the prefetcher should work on, next one first '''
+        with self.changed:
+            return self.emails[self.position:self.position + self.prefetch_count]
+
+    def missing_bodies(self):
+        ''' Returns upcoming emails whose bodies are needed (and were not asked for yet) '''
+        with self.changed:
+            missing = [email for email in self.upcoming() if email.key not in self.requested]
+            self.requested.update(email.key for email in missing)
+        return missing
+
+    def clip(self, text):
+        ''' Returns the path of the clip for 'text', synthesizing it if it isn't cached '''
+        key = ClipCache.key(text, self.synthesizer.identity)
+        path = self.cache.get(key)
+        if path is None:
+            path = self.cache.put(key, lambda path: self.synthesizer.synthesize(text, path))
+        return path
+
+    def is_cached(self, text):
+        return self.cache.get(ClipCache.key(text, self.synthesizer.identity)) is not None
+
+    def prefetch(self, stopped):
+        ''' Prefetcher thread, synthesizes clips for upcoming emails until the session is stopped '''
+        while not stopped.is_set():
+            with self.changed:
+                text = self.next_prefetch()
+                if text is None:
+                    if not stopped.is_set():
+                        self.changed.wait()
+                    continue
+            try:
+                self.clip(text)
+            except Exception as err:
+                self.logger.error(f"Could not prefetch speech [{err}]")
+                self.failed.add(text)
+
+    def next_prefetch(self):
+        ''' Returns the next text which should be synthesized ahead of time, or None '''
+        for email in self.upcoming():
+            texts = split_sentences(header_text(email))
+            with self.changed:
+                if email.key in self.bodies:
+                    texts += split_sentences(self.bodies[email.key])[:PREFETCH_SENTENCES]
+            for text in texts:
+                if text and text not in self.failed and not self.is_cached(text):
+                    return text
+        return None
+
+    def read_email(self, email, body=None):
+        '''
+            Reads the header (and body, if given) of an email aloud, blocks until done
+            - Returns False if reading was stopped
+        '''
+        with self.changed:
+            index = next((i for i, known in enumerate(self.emails) if known.key == email.key), None)
+            if index is not None:
+                self.position = index + 1
+                # Bodies of emails which were read already are not needed anymore
+                upcoming = set(known.key for known in self.upcoming())
+                self.bodies = {key: text for key, text in self.bodies.items() if key in upcoming}
+                self.changed.notify()
+        # Split the same way as the prefetcher does, so its clips are found
+        return self.play(split_sentences(header_text(email)) + split_sentences(body or ""))
+
+    def speak(self, text):
+        ''' Reads any text aloud, blocks until done. Returns False if it was stopped '''
+        return self.play(split_sentences(text))
+
+    def play(self, sentences):
+        self.stop_reading()
+        stream = self.stream = SpeechStream(sentences, self.clip, self.player, self.executor)
+        self.player.resume()
+        done = stream.run()
+        if self.stream is stream:
+            self.stream = None
+        return done
+
+    def stop_reading(self):
+        ''' Stops the text being read at once, sentences which were not synthesized yet are dropped '''
+        stream = self.stream
+        if stream is not None:
+            stream.cancel()
+        self.player.stop()
+
+    def reset(self):
+        ''' Stops reading and prefetching, forgets the emails of the current user and deletes their clips '''
+        self.stop_reading()
+        self.stopped.set()
+        self.cache.clear()
+        with self.changed:
+            self.emails = []
+            self.bodies.clear()
+            self.requested.clear()
+            self.position = 0
+            self.failed.clear()
+            self.changed.notify_all()
+        self.prefetcher = None
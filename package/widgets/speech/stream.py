@@ -0,0 +1,117 @@
+'''
+    stream.py
+
+    - Speaks long texts sentence by sentence, so the first sentence plays while the next ones are
+        still being synthesized
+    - Sentences are synthesized by a pool of workers and played strictly in order
+    - A stream can be cancelled from any thread, playback stops at once and queued sentences are dropped
+'''
+
+import logging
+
+import re
+import threading
+import concurrent.futures
+from collections import deque
+
+
+# Sentences synthesized ahead of the one being played
+LOOKAHEAD = 4
+# Short sentences are joined up to this many characters, longer ones are split
+MIN_CHUNK_SIZE = 40
+MAX_CHUNK_SIZE = 300
+# Seconds between checks for cancellation while waiting for a sentence
+POLL_INTERVAL = 0.05
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?;:])\s+|\n\s*\n")
+SPLIT_PATTERN = re.compile(r"(?<=[,)])\s+|\s+")
+
+
+def split_sentences(text):
+    '''
+        Splits text into chunks which are synthesized separately
+        - Chunks end at sentence boundaries (or blank lines), very short sentences are joined and very long
+            ones are split at commas (or spaces) so no chunk is longer than MAX_CHUNK_SIZE
+    '''
+    chunks, current = [], ""
+    for sentence in SENTENCE_PATTERN.split(text):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        while len(sentence) > MAX_CHUNK_SIZE:
+            cut = max((match.start() for match in SPLIT_PATTERN.finditer(sentence, 0, MAX_CHUNK_SIZE)), default=0)
+            cut = cut or MAX_CHUNK_SIZE
+            head, sentence = sentence[:cut].strip(), sentence[cut:].strip()
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(head)
+        current = f"{current} {sentence}".strip()
+        if len(current) >= MIN_CHUNK_SIZE:
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class SpeechStream():
+
+    '''
+        SpeechStream - Speaks one text
+        Args:
+            sentences: text to speak, split with split_sentences
+            clip: function returning the path of the clip for a sentence (synthesizing it if needed)
+            player: Player used for playback
+            executor: pool of synthesis workers
+            lookahead: maximum number of sentences synthesized ahead of playback
+    '''
+
+    def __init__(self, sentences, clip, player, executor, lookahead=LOOKAHEAD):
+        self.logger = logging.getLogger(__name__)
+        self.sentences = sentences
+        self.clip = clip
+        self.player = player
+        self.executor = executor
+        self.lookahead = lookahead
+        self.cancelled = threading.Event()
+        self.pending = deque()
+
+    def run(self):
+        ''' Speaks the whole text, blocks until done. Returns False if the stream was cancelled '''
+        upcoming = iter(self.sentences)
+        try:
+            while not self.cancelled.is_set():
+                # Keep the workers 'lookahead' sentences ahead of playback
+                while len(self.pending) < self.lookahead:
+                    sentence = next(upcoming, None)
+                    if sentence is None:
+                        break
+                    self.pending.append(self.executor.submit(self.clip, sentence))
+                if not self.pending:
+                    return True
+                path = self.wait(self.pending.popleft())
+                if path is not None and not self.player.play(path):
+                    self.cancelled.set()
+            return False
+        finally:
+            for future in self.pending:
+                future.cancel()
+            self.pending.clear()
+
+    def wait(self, future):
+        ''' Returns the clip of a sentence once it is ready, None if it failed or the stream was cancelled '''
+        while not self.cancelled.is_set():
+            try:
+                return future.result(timeout=POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                continue
+            except Exception as err:
+                # A sentence which cannot be synthesized is skipped, the rest is still read
+                self.logger.error(f"Could not synthesize sentence [{err}]")
+                return None
+        return None
+
+    def cancel(self):
+        self.cancelled.set()
+        self.player.stop()
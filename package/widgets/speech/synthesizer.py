@@ -0,0 +1,57 @@
+'''
+    synthesizer.py
+
+    - Turns text into WAV clips with an offline speech engine (espeak-ng by default)
+    - The engine runs as a subprocess, the text is passed on stdin so its length does not matter
+'''
+
+import logging
+
+import os
+import subprocess
+
+
+# '{voice}', '{rate}' and '{path}' are filled in for every clip
+TTS_COMMAND = ("espeak-ng", "-v", "{voice}", "-s", "{rate}", "-w", "{path}", "--stdin")
+VOICE = "en"
+RATE = 160 # Words per minute
+# Seconds allowed for a single clip
+TTS_TIMEOUT = 60
+
+
+class SpeechError(Exception):
+    pass
+
+
+class Synthesizer():
+
+    '''
+        Synthesizer - Runs the speech engine
+        Args:
+            command: engine command line, see TTS_COMMAND
+            voice, rate: passed on to the engine, also part of every cache key
+    '''
+
+    def __init__(self, command=TTS_COMMAND, voice=VOICE, rate=RATE):
+        self.logger = logging.getLogger(__name__)
+        self.command = command
+        self.voice = voice
+        self.rate = rate
+
+    @property
+    def identity(self):
+        ''' Clips made with a different engine or voice must not be taken from the cache '''
+        return f"{self.command[0]}|{self.voice}|{self.rate}"
+
+    def synthesize(self, text, path):
+        ''' Writes the clip for 'text' to 'path' '''
+        args = [arg.format(voice=self.voice, rate=self.rate, path=path) for arg in self.command]
+        try:
+            subprocess.run(args, input=text.encode('utf-8'), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                timeout=TTS_TIMEOUT, check=True)
+        except FileNotFoundError:
+            raise SpeechError(f"Speech engine '{self.command[0]}' is not installed")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as err:
+            raise SpeechError(f"Could not synthesize text [{err}]")
+        if not os.path.exists(path):
+            raise SpeechError("Speech engine did not write a clip")
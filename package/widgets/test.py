@@ -2,15 +2,29 @@
 
 import logging
 
-from fps import FingerprintSensor
+import os
+import tempfile
+
+from fps import FingerprintSensor, SensorRegistry
+from fps.emulator import SensorEmulator
 
 import base64
-from database import Database
+from database import DatabaseSession
+
+import time
+import threading
+import concurrent.futures
+from mail import EmailSession, MessageStore, IMAPConnectionPool, EventLoopThread
+from mail.fakeserver import FakeMailServer
+from speech import SpeechSession, ClipCache
+from speech.stream import SpeechStream, split_sentences, LOOKAHEAD, MAX_CHUNK_SIZE
+import json
+from voice import VoiceSession, COMMANDS
 
 
 def test_database():
 
-    db = Database()
+    db = DatabaseSession(os.path.join(tempfile.mkdtemp(), "database.db"))
 
     creds = ("a196c619fa@gmail.com", "0a6baa6ef716d698")
     data = ["00x00", *creds]
@@ -31,30 +45,623 @@ def test_database():
     assert found == True
     assert creds == credentials
 
+    ## Test 4: Lookup through the blind index, unknown keys are not found
+    assert db.storage.find(db.blind_index(key)) is not None
+    found, _ = db.get_credentials("0" * 32)
+    assert found == False
+
+    ## Test 5: Adding many users at once
+    keys = [f"{i:032d}" for i in range(100)]
+    assert db.add_many_credentials(((f"user{i}@gmail.com", "pwd"), k) for i, k in enumerate(keys)) == 100
+    assert db.get_credentials(keys[42]) == (True, ("user42@gmail.com", "pwd"))
+
+    ## Test 6: An interrupted migration leaves no database behind, the next one copies everything
+    from database import storage
+    from database.migrate import migrate
+    folder = tempfile.mkdtemp()
+    source, target = os.path.join(folder, "database.json"), os.path.join(folder, "database.db")
+    legacy = DatabaseSession(source)
+    legacy.add_many_credentials(((f"user{i}@gmail.com", "pwd"), k) for i, k in enumerate(keys[:10]))
+    legacy.storage.close()
+    add_many = storage.SQLiteStorage.add_many
+    def failing_add_many(self, records):
+        next(iter(records))
+        raise IOError("Disk full")
+    storage.SQLiteStorage.add_many = failing_add_many
+    try:
+        migrate(source, target)
+        assert False, "The migration should have failed"
+    except IOError:
+        pass
+    finally:
+        storage.SQLiteStorage.add_many = add_many
+    assert not any(name.startswith("database.db") or ".migrating" in name for name in os.listdir(folder))
+    assert migrate(source, target) == 10
+    migrated = DatabaseSession(target)
+    assert migrated.get_credentials(keys[7]) == (True, ("user7@gmail.com", "pwd"))
+    migrated.storage.close()
+
+    ## Test 7: Exports are only readable by their owner and import into another database as they are
+    from database.bulk import export_file, import_file
+    export = os.path.join(folder, "users.jsonl")
+    open(export, "w").close()
+    os.chmod(export, 0o644)
+    assert export_file(db, export) == 101
+    assert os.stat(export).st_mode & 0o777 == 0o600
+    copy = DatabaseSession(os.path.join(folder, "copy.db"))
+    assert import_file(copy, export) == 101
+    assert copy.get_credentials(key) == (True, creds)
+
+    ## Test 8: Keys of provisioning files are cut to 32 characters, like the keys of enrolled users
+    provisioning = os.path.join(folder, "users.csv")
+    with open(provisioning, "w") as file:
+        file.write(f"email,password,key\nnew@gmail.com,pwd,{'f' * 64}\n")
+    assert import_file(copy, provisioning) == 1
+    assert copy.get_credentials(("f" * 64)[:32]) == (True, ("new@gmail.com", "pwd"))
+    copy.storage.close()
+
     ## Clear Database
     db.erase_everything()
 
     print("[+] Completed all database tests, no error encountered")
 
 
-def test_fingerprint_sensor():
+def test_fingerprint_sensor(emulated=True):
+
+    # Runs on the emulator (fingers placed by timers) unless a real sensor should be used
+    emulator = SensorEmulator().start() if emulated else None
+    if emulated:
+        os.environ["LYNX_FPS_PORT"] = emulator.port
+        emulator.place_finger("test")
+    results = []
 
     ## Test 1: Make sure we can access the sensor
-    state = {"idle": True}
-    d = FingerprintSensor(state)
+    d = FingerprintSensor()
+    d.reset_connection() # Waits until the sensor answers
+    assert d.dev is not None
+    d.scan_complete_signal.connect(results.append)
+    d.enrollment_stage_two_complete_signal.connect(results.append)
 
     ## Test 2: Enroll a new user
     d.enroll_fingerprint()
+    enrolled, key = results[-1]
+    assert enrolled
 
     ## Test 3: Test if we can recognize the newly enrolled user
     d.scan()
+    assert results[-1] == (True, key)
+    if emulated:
+        emulator.place_finger("someone else")
+        d.scan()
+        assert results[-1] == (False, None)
+        emulator.remove_finger()
+
+    ## Test 4: A stopped scan returns at once
+    threading.Timer(1, d.stop).start()
+    start = time.monotonic()
+    d.scan() # Do not touch the sensor
+    assert time.monotonic() - start < 1.5
 
     # Clear database after tests
     d.clear_database()
+    if emulated:
+        emulator.stop()
+
+    ## Test 5: A replugged sensor is found again (emulator behind a link, which is removed and created again)
+    if emulated:
+        link = os.path.join(tempfile.mkdtemp(), "ttyUSB0")
+        os.environ["LYNX_FPS_PORT"] = link
+        emulator = SensorEmulator().start()
+        os.symlink(emulator.port, link)
+        d.reset_connection()
+        os.remove(link)
+        emulator.stop()
+        emulator = SensorEmulator().start()
+        threading.Timer(1, os.symlink, (emulator.port, link)).start()
+        start = time.monotonic()
+        d.reset_connection()
+        assert d.dev is not None and time.monotonic() - start < 2
+        os.remove(link)
+        emulator.stop()
 
     print("[+] Completed all fingerprint sensor tests, no error encountered")
 
 
+def test_sensor_registry():
+
+    from PyQt5 import QtCore
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    emulators = [SensorEmulator().start() for _ in range(2)]
+    os.environ["LYNX_FPS_PORT"] = os.pathsep.join(emulator.port for emulator in emulators)
+    emulators[0].place_finger("first")
+    registry = SensorRegistry()
+    scans = {}
+    registry.scan_complete_signal.connect(lambda device_id, message: scans.setdefault(device_id, []).append(message))
+
+    ## Test 1: Every sensor gets a worker
+    registry.connected_signal.connect(lambda _: len(registry.devices()) == 2 and app.quit())
+    registry.scan()
+    registry.start()
+    app.exec_()
+    assert sorted(registry.devices()) == sorted(emulator.port for emulator in emulators)
+
+    ## Test 2: Results are tagged with the sensor which scanned, the other one keeps waiting
+    QtCore.QTimer.singleShot(1000, app.quit)
+    app.exec_()
+    assert list(scans) == [emulators[0].port]
+
+    ## Test 3: A failed sensor is dropped, the other one is still served
+    registry.disconnected_signal.connect(lambda _: app.quit())
+    emulators[1].stop()
+    app.exec_()
+    assert registry.devices() == [emulators[0].port]
+
+    ## Test 4: Closing returns at once, ports are only released once their workers finished
+    start = time.monotonic()
+    registry.close()
+    assert time.monotonic() - start < 0.5 and emulators[0].port in registry.claimed
+    assert registry.wait() and not registry.claimed
+    emulators[0].stop()
+
+    print("[+] Completed all sensor registry tests, no error encountered")
+
+
+def test_template_cache():
+
+    emulator = SensorEmulator().start()
+    os.environ["LYNX_FPS_PORT"] = emulator.port
+    d = FingerprintSensor()
+    d.reset_connection()
+    results = []
+    d.scan_complete_signal.connect(results.append)
+    d.enrollment_stage_two_complete_signal.connect(results.append)
+    downloads = lambda: (emulator.commands.get("loadTemplate", 0), emulator.commands.get("downloadCharacteristics", 0))
+
+    def scan(finger):
+        emulator.place_finger(finger)
+        before = downloads()
+        d.scan()
+        return results[-1], downloads() != before
+
+    ## Test 1: A template enrolled by this host matches without being downloaded
+    emulator.place_finger("first")
+    d.enroll_fingerprint()
+    _, first = results[-1]
+    assert scan("first") == ((True, first), False)
+
+    ## Test 2: Enrolling another finger keeps the cache valid
+    emulator.place_finger("second")
+    d.enroll_fingerprint()
+    _, second = results[-1]
+    assert scan("first") == ((True, first), False)
+    assert scan("second") == ((True, second), False)
+
+    ## Test 3: A template deleted by another tool invalidates the cache, the next match downloads once
+    d.dev.deleteTemplate(1)
+    assert scan("first") == ((True, first), True)
+    assert scan("first") == ((True, first), False)
+
+    ## Test 4: A forgotten match (no user has it) is downloaded again
+    d.forget_last_match()
+    assert scan("first") == ((True, first), True)
+
+    ## Test 5: A template replaced at the same position (eg. by a restore) is downloaded, not taken for the old one
+    from fps import library
+    from fps.emulator import characteristics
+    library.SensorLibrary(d.dev).write(0, characteristics("second", "template"))
+    assert scan("second") == ((True, second), True)
+    assert scan("first") == ((False, None), False)
+
+    d.clear_database()
+    d.dev = None
+    emulator.stop()
+
+    print("[+] Completed all template cache tests, no error encountered")
+
+
+def test_template_library():
+
+    from fps import library
+    emulators = [SensorEmulator().start() for _ in range(2)]
+    os.environ["LYNX_FPS_PORT"] = emulators[0].port
+    d = FingerprintSensor()
+    d.reset_connection()
+    results = []
+    d.enrollment_stage_two_complete_signal.connect(results.append)
+    for finger in ("first", "second"):
+        emulators[0].place_finger(finger)
+        d.enroll_fingerprint()
+    keys = [key for _, key in results]
+    path = os.path.join(tempfile.mkdtemp(), "templates.fpl")
+
+    ## Test 1: Backup, an interrupted one resumes where it stopped
+    stop = threading.Event()
+    assert library.backup(d.dev, path, lambda count, total: stop.set(), stop) == 1
+    assert library.backup(d.dev, path) == 1
+    assert library.backup(d.dev, path) == 0
+
+    ## Test 2: Restore on another sensor, users are recognized with the same keys
+    os.environ["LYNX_FPS_PORT"] = emulators[1].port
+    d.reset_connection()
+    assert library.restore(path, d.dev) == 2
+    results.clear()
+    d.scan_complete_signal.connect(results.append)
+    for finger, key in zip(("first", "second"), keys):
+        emulators[1].place_finger(finger)
+        d.scan()
+        assert results[-1] == (True, key)
+
+    ## Test 3: Diff
+    backup = library.LibraryFile(path)
+    assert library.diff(backup, library.SensorLibrary(d.dev), compare=True) == {"missing": [], "changed": [], "extra": []}
+    backup.close()
+
+    ## Test 4: Templates round-trip byte for byte, templates of another length are refused instead of padded or cut
+    other = library.LibraryFile(os.path.join(tempfile.mkdtemp(), "templates.fpl"))
+    other.write(5, [position % 256 for position in range(512)])
+    for template in ([1] * 511, [1] * 513):
+        for target in (other, library.SensorLibrary(d.dev)):
+            try:
+                target.write(6, template)
+                assert False, "A template of the wrong length was written"
+            except ValueError:
+                pass
+    other.close()
+    other = library.LibraryFile(other.path)
+    assert other.positions() == {5} and other.read(5) == [position % 256 for position in range(512)]
+    assert library.SensorLibrary(d.dev).positions() == {0, 1}
+    other.close()
+
+    ## Test 5: Ports without a sensor are an error, no library file is created in their place
+    port = os.path.join(tempfile.mkdtemp(), "ttyUSB9")
+    os.symlink(emulators[0].port, port)
+    assert str(library.open_library(port, d.BAUD_RATE)) == port
+    for name in ("/dev/ttyUSB-lynx-missing", "COM9"):
+        try:
+            library.open_library(name, d.BAUD_RATE)
+            assert False, "A missing sensor was opened"
+        except IOError:
+            pass
+        assert not os.path.exists(name)
+
+    d.dev = None
+    for emulator in emulators:
+        emulator.stop()
+
+    print("[+] Completed all template library tests, no error encountered")
+
+
+def test_email_session():
+
+    with FakeMailServer(messages=120, seen_ratio=0.5, attachment_size=100000) as server:
+        imap, smtp = server.imap_address, server.smtp_address
+        session = EmailSession(store=MessageStore(":memory:"), imap_server=imap[0], imap_port=imap[1],
+            smtp_server=smtp[0], smtp_port=smtp[1], use_ssl=False)
+
+        ## Test 1: Login
+        assert session.check_credentials("user@example.com", "wrong") == False
+        assert session.check_credentials("user@example.com", "password") == True
+
+        ## Test 2: Newest page first, only read (listed) messages
+        page, has_more = session.fetch_page(count=20)
+        assert [mail.uid for mail in page] == sorted((mail.uid for mail in page), reverse=True)
+        assert all("\\Seen" in mail.flags for mail in page) and has_more
+
+        ## Test 3: Every listed message, nothing twice
+        uids = [mail.uid for mail in session.fetch_unread()]
+        assert len(uids) == len(set(uids)) == 60
+
+        ## Test 4: Body and attachment
+        assert "synthetic message" in session.load_body(page[0])
+        attachment, = session.attachments(page[0])
+        path = session.save_attachment(page[0], attachment, "./test-attachments")
+        assert os.path.getsize(path) == 100000
+        os.remove(path)
+        os.rmdir("./test-attachments")
+
+        ## Test 5: Outbox
+        session.send_email("someone@example.com", "Test", "Hello")
+        time.sleep(1)
+        assert len(server.delivered) == 1
+
+        ## Test 6: Pushed messages (IDLE) are filtered like listed ones
+        stop = threading.Event()
+        threading.Timer(1, server.inbox.append).start()
+        threading.Timer(2, server.inbox.append, (("\\Seen",),)).start()
+        watcher = session.watch(stop)
+        pushed = next(watcher)
+        stop.set()
+        watcher.close()
+        assert pushed.uid == server.inbox.uidnext - 1 and "\\Seen" in pushed.flags
+
+        ## Test 7: Headers are fetched in batches of message-set ranges, not one message at a time
+        from mail.session import message_sets
+        assert list(message_sets([7, 1, 3, 2, 9, 10], batch_size=4)) == ["1:3,7", "9:10"]
+        other = EmailSession(store=MessageStore(":memory:"), imap_server=imap[0], imap_port=imap[1], use_ssl=False)
+        other.check_credentials("user@example.com", "password")
+        server.commands.clear()
+        listed = [mail.uid for mail in other.fetch_unread(batch_size=25)]
+        assert len(listed) == len(set(listed)) == len(uids) + 1
+        assert server.commands["UID_FETCH"] == -(-len(server.inbox.uids) // 25)
+        other.reset()
+
+        ## Test 8: Pooled connections are reused, kept alive with NOOPs and closed once idle for too long
+        pool = IMAPConnectionPool(imap[0], imap[1], "user@example.com", "password", idle_timeout=1, keepalive=0.2,
+            use_ssl=False)
+        server.commands.clear()
+        pool.open()
+        for _ in range(5):
+            with pool.connection('inbox') as conn:
+                conn.noop()
+        assert server.commands["LOGIN"] == 1 and server.commands["SELECT"] == 1
+        time.sleep(0.5)
+        assert server.commands["NOOP"] > 5
+        time.sleep(1)
+        assert pool.idle == [] and pool.open_connections == 0
+        with pool.connection('inbox') as conn:
+            conn.noop()
+        assert server.commands["LOGIN"] == 2
+        pool.close()
+
+        ## Test 9: A new UIDVALIDITY drops the local copy, the mailbox is synced again from scratch
+        server.inbox.uidvalidity = 2
+        page, has_more = session.fetch_page(count=20)
+        assert len(page) == 20 and has_more and all(mail.uidvalidity == 2 for mail in page)
+        assert session.store.uids(session.email, 'inbox', 1) == set()
+        assert session.store.get_state(session.email, 'inbox')[0] == 2
+
+        ## Test 10: The outbox retries temporary failures and gives up on permanent ones
+        from mail import outbox
+        retry_delay, outbox.RETRY_DELAY = outbox.RETRY_DELAY, 0.5
+        sent, failed = [], []
+        session.outbox.on_sent = lambda message_id, subject: sent.append(message_id)
+        session.outbox.on_failed = lambda message_id, subject: failed.append(message_id)
+        server.refused.update({"busy@example.com": b"451 Try again later", "nobody@example.com": b"550 No such user"})
+        retried = session.send_email("busy@example.com", "Retried", "Hello")
+        bounced = session.send_email("nobody@example.com", "Bounced", "Hello")
+        time.sleep(0.3)
+        assert failed == [bounced] and sent == [] and session.store.next_outgoing(session.email)[:1] == (retried,)
+        del server.refused["busy@example.com"]
+        time.sleep(1)
+        assert sent == [retried] and session.store.next_outgoing(session.email) is None
+        outbox.RETRY_DELAY = retry_delay
+
+        ## Test 11: Pages follow each other without gaps or overlaps, the last one reports that it is the last
+        pages, before_uid, has_more = [], None, True
+        while has_more:
+            page, has_more = session.fetch_page(before_uid, count=20)
+            pages.append(page)
+            before_uid = page[-1].uid if page else None
+        listed = sorted((uid for uid in server.inbox.uids if "\\Seen" in server.inbox.flags[uid]), reverse=True)
+        assert [mail.uid for page in pages for mail in page] == listed
+        assert all(len(page) == 20 for page in pages[:-1]) and len(pages[-1]) < 20
+        page, _ = session.fetch_page(pages[0][4].uid, count=3)
+        assert [mail.uid for mail in page] == [mail.uid for mail in pages[0][5:8]]
+
+        ## Test 12: Local search, words match as stems and prefixes in any case
+        subjects = {uid: dict(server.inbox.generate(uid).headers)["Subject"] for uid in server.inbox.uids}
+        hits = session.search("INVOICES")
+        assert hits and [mail.uid for mail in hits] == sorted((uid for uid, subject in subjects.items()
+            if "invoice" in subject.lower()), reverse=True)
+        hits = session.search("invoice", sender="ali")
+        assert hits and all("Alice" in mail.sender and "invoice" in mail.subject.lower() for mail in hits)
+        assert session.search("nothing") == []
+
+        ## Test 13: Opening a message only downloads its text, attachments are streamed in chunks
+        from mail.structure import CHUNK_SIZE
+        mail, progress = pages[0][1], []
+        server.commands.clear()
+        assert "synthetic message" in session.load_body(mail)
+        assert server.commands["UID_FETCH"] == 2 # BODYSTRUCTURE and the text part
+        attachment, = session.attachments(mail)
+        path = session.save_attachment(mail, attachment, tempfile.mkdtemp(), lambda done, size: progress.append(done))
+        assert progress == list(range(CHUNK_SIZE, attachment.size, CHUNK_SIZE)) + [attachment.size] and len(progress) > 1
+        assert server.commands["UID_FETCH"] == 2 + len(progress) and os.path.getsize(path) == 100000
+
+        ## Test 14: Other folders are fetched concurrently, the store is written from outside the event loop
+        for mailbox, count in (("sent", 3), ("archive", 2)):
+            for _ in range(count):
+                server.mailboxes[mailbox].append(("\\Seen",))
+        writers, add_messages = [], session.store.add_messages
+        session.store.add_messages = lambda *args: (writers.append(threading.current_thread()), add_messages(*args))
+        loop = EventLoopThread()
+        async def fetch():
+            return [(folder, mail.uid) async for folder, mail in session.fetch_folders(("sent", "archive"))]
+        fetched = loop.submit(fetch()).result(10)
+        loop.stop()
+        assert sorted(fetched) == [("archive", 1), ("archive", 2), ("sent", 1), ("sent", 2), ("sent", 3)]
+        assert writers and loop.thread not in writers
+        assert session.store.uids(session.email, "Sent", 1) == {1, 2, 3}
+        del session.store.add_messages
+
+        session.reset()
+
+    print("[+] Completed all email session tests, no error encountered")
+
+
+class StubSynthesizer():
+
+    ''' Writes the text itself as the clip, records what it was asked to synthesize '''
+
+    identity = "stub"
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.texts = []
+
+    def synthesize(self, text, path):
+        time.sleep(self.delay)
+        with open(path, "w") as file:
+            file.write(text)
+        self.texts.append(text)
+
+
+class StubPlayer():
+
+    ''' "Plays" a clip by waiting 'duration' seconds, records the texts of the played clips '''
+
+    def __init__(self, duration=0):
+        self.duration = duration
+        self.played = []
+        self.stopped = threading.Event()
+
+    def play(self, path):
+        if self.stopped.is_set():
+            return False
+        with open(path) as file:
+            self.played.append(file.read())
+        return not self.stopped.wait(self.duration)
+
+    def stop(self):
+        self.stopped.set()
+
+    def resume(self):
+        self.stopped.clear()
+
+
+def test_speech_session():
+
+    from speech.session import header_text
+    with FakeMailServer(messages=4) as server:
+        imap = server.imap_address
+        session = EmailSession(store=MessageStore(":memory:"), imap_server=imap[0], imap_port=imap[1], use_ssl=False)
+        session.check_credentials("user@example.com", "password")
+        emails, _ = session.fetch_page(count=4)
+        session.reset()
+    synthesizer, player = StubSynthesizer(), StubPlayer()
+    speech = SpeechSession(synthesizer, player, cache_dir=tempfile.mkdtemp(), prefetch_count=2)
+    for email in emails:
+        speech.add_email(email)
+
+    ## Test 1: Headers of the next 'prefetch_count' emails are synthesized ahead of time
+    speech.start()
+    time.sleep(0.5)
+    assert synthesizer.texts == [header_text(email) for email in emails[:2]]
+
+    ## Test 2: A prefetched email is read from the cache, the prefetcher moves on to the next ones
+    assert speech.read_email(emails[0]) == True
+    assert player.played == [header_text(emails[0])]
+    time.sleep(0.5)
+    assert synthesizer.texts[2:] == [header_text(emails[2])]
+
+    ## Test 3: Least recently used clips are evicted, the order survives a restart
+    directory = tempfile.mkdtemp()
+    cache = ClipCache(directory, max_size=10)
+    for key in ("a", "b", "c"):
+        cache.put(key, lambda path: synthesizer.synthesize("clip", path))
+        time.sleep(0.01)
+        cache.get("a")
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    assert sorted(ClipCache(directory, max_size=10).clips) == ["a", "c"]
+
+    ## Test 4: Texts are split at sentence ends, short sentences are joined and long ones split
+    assert split_sentences("This is the first sentence of the message.\n\nHi.   Bye.") == \
+        ["This is the first sentence of the message.", "Hi. Bye."]
+    chunks = split_sentences(", ".join(["a few words"] * 100) + ".")
+    assert len(chunks) > 1 and all(len(chunk) <= MAX_CHUNK_SIZE for chunk in chunks)
+
+    ## Test 5: Cancelling a stream stops the player at once, queued sentences are never synthesized
+    sentences = [f"This is sentence number {i}, it is long enough to stand alone." for i in range(20)]
+    slow, stream_player = StubSynthesizer(delay=0.1), StubPlayer(duration=0.2)
+    executor = concurrent.futures.ThreadPoolExecutor(2)
+    stream = SpeechStream(sentences, lambda text: speech.cache.put(text, lambda path: slow.synthesize(text, path)),
+        stream_player, executor)
+    results = []
+    reader = threading.Thread(target=lambda: results.append(stream.run()))
+    reader.start()
+    time.sleep(0.5)
+    stream.cancel()
+    reader.join(0.2)
+    assert not reader.is_alive() and results == [False] and stream_player.stopped.is_set()
+    executor.shutdown(wait=True) # Synthesis workers exit once the running sentences are done
+    assert 0 < len(stream_player.played) < 5 and len(slow.texts) <= len(stream_player.played) + 2 + LOOKAHEAD
+
+    ## Test 6: Text which was read once is played from the cache
+    count = len(synthesizer.texts)
+    assert speech.speak("Read this twice.") == True and speech.speak("Read this twice.") == True
+    assert synthesizer.texts[count:] == ["Read this twice."] and player.played[-2:] == ["Read this twice."] * 2
+
+    ## Test 7: Logging out deletes the clips of the user
+    speech.reset()
+    assert os.listdir(speech.cache.directory) == [] and speech.cache.size == 0
+
+    print("[+] Completed all speech session tests, no error encountered")
+
+
+class ScriptedDecoder():
+
+    '''
+        Stands in for vosk.KaldiRecognizer, "hears" the words of SCRIPT (utterances of (word, end in seconds))
+            DECODER_DELAY seconds after they were spoken, an utterance ends after PAUSE seconds of silence
+    '''
+
+    SCRIPT = [[("read", 0.5)], [("hello", 1.2), ("log", 1.5), ("out", 1.8)], [("next", 2.9)]]
+    DECODER_DELAY = 0.2
+    PAUSE = 0.5
+
+    def __init__(self, model, rate, grammar):
+        self.rate = rate
+        self.position = 0
+        self.utterance = 0
+
+    def SetWords(self, enabled):
+        pass
+
+    def SetPartialWords(self, enabled):
+        pass
+
+    def result(self, words):
+        return {"text": " ".join(word for word, _ in words), "result": [{"word": w, "end": e} for w, e in words]}
+
+    def current(self):
+        return self.SCRIPT[self.utterance] if self.utterance < len(self.SCRIPT) else []
+
+    def AcceptWaveform(self, frame):
+        self.position += len(frame) // 2
+        words = self.current()
+        return bool(words) and self.position / self.rate >= words[-1][1] + self.PAUSE
+
+    def Result(self):
+        words = self.current()
+        self.utterance += 1
+        return json.dumps(self.result(words))
+
+    def PartialResult(self):
+        heard = [(w, e) for w, e in self.current() if e + self.DECODER_DELAY <= self.position / self.rate]
+        result = self.result(heard)
+        return json.dumps({"partial": result["text"], "partial_result": result["result"]})
+
+    def FinalResult(self):
+        words = [(w, e) for w, e in self.current() if e <= self.position / self.rate]
+        self.utterance += 1
+        return json.dumps(self.result(words))
+
+
+def test_voice_session():
+
+    ## Test 1: Commands are reported while the utterance goes on, the last one when the audio ends
+    session = VoiceSession(commands=COMMANDS, decoder_class=ScriptedDecoder)
+    frames = [(bytes(640), 16000)] * 150 # 3 seconds of 20ms frames, "next" is not decoded before the end
+    detections = list(session.recognize(frames))
+    assert [detection.command for detection in detections] == ["read", "logout", "next"]
+    assert all(detection.latency is not None and detection.latency < 0.3 for detection in detections)
+    assert detections[0].offset < 1.0 # Before the end of its utterance
+
+    ## Test 2: Recordings of single commands, eg. ./test-recordings/reply.wav (16-bit mono)
+    session = VoiceSession("../resources/models/vosk-model-small-en-us")
+    recordings = [command for command in ("read", "next", "reply", "compose", "logout", "stop")
+        if os.path.exists(f"./test-recordings/{command}.wav")]
+    if not recordings or session.load_model() is None:
+        print("[!] Skipped voice recording tests, recordings or model not found")
+        recordings = []
+    for command in recordings:
+        detections = session.recognize_file(f"./test-recordings/{command}.wav")
+        assert [detection.command for detection in detections] == [command]
+        assert detections[0].latency is None or detections[0].latency < 0.3
+
+    print("[+] Completed all voice session tests, no error encountered")
+
+
 if __name__ == "__main__":
 
     # Setup logging
@@ -71,4 +678,10 @@ if __name__ == "__main__":
 
     # Tests
     test_fingerprint_sensor()
+    test_sensor_registry()
+    test_template_cache()
+    test_template_library()
     test_database()
+    test_email_session()
+    test_speech_session()
+    test_voice_session()
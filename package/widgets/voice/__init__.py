@@ -0,0 +1,9 @@
+'''
+    voice [module]
+
+    - Offline voice commands (read, next, reply, compose, logout, stop)
+'''
+
+from .session import VoiceSession
+from .recognizer import CommandRecognizer, Detection, COMMANDS
+from .audio import wav_frames, microphone_frames
@@ -0,0 +1,64 @@
+'''
+    audio.py
+
+    - Sources of audio frames for the recognizer: the microphone, or a WAV file for offline testing
+    - Frames are raw 16-bit mono PCM, FRAME_DURATION seconds each
+'''
+
+import logging
+
+import time
+import wave
+import queue
+
+
+SAMPLE_RATE = 16000
+# Short frames keep the delay between speaking and decoding low
+FRAME_DURATION = 0.02
+
+
+def wav_frames(path, frame_duration=FRAME_DURATION, realtime=False):
+    '''
+        Yields (frame, sample rate) pairs from a 16-bit mono WAV file
+        - If 'realtime' is set, frames are yielded no faster than a microphone would deliver them
+    '''
+    with wave.open(path, 'rb') as clip:
+        if clip.getnchannels() != 1 or clip.getsampwidth() != 2:
+            raise ValueError(f"'{path}' is not a 16-bit mono WAV file")
+        rate = clip.getframerate()
+        samples = int(rate * frame_duration)
+        start = time.monotonic()
+        position = 0
+        while True:
+            frame = clip.readframes(samples)
+            if not frame:
+                return
+            position += len(frame) // 2
+            if realtime:
+                delay = start + position / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield frame, rate
+
+
+def microphone_frames(stop, rate=SAMPLE_RATE, frame_duration=FRAME_DURATION, device=None):
+    '''
+        Yields (frame, sample rate) pairs from the microphone until 'stop' (threading.Event) is set
+        - Needs the 'sounddevice' package
+    '''
+    import sounddevice
+    logger = logging.getLogger(__name__)
+    frames = queue.Queue()
+
+    def captured(data, count, timing, status):
+        if status:
+            logger.debug(f"Microphone status: {status}")
+        frames.put(bytes(data))
+
+    with sounddevice.RawInputStream(samplerate=rate, blocksize=int(rate * frame_duration), device=device,
+            dtype='int16', channels=1, callback=captured):
+        while not stop.is_set():
+            try:
+                yield frames.get(timeout=0.1), rate
+            except queue.Empty:
+                continue
@@ -0,0 +1,121 @@
+'''
+    recognizer.py
+
+    - Decodes audio frame by frame against a small command grammar (vosk)
+    - Commands are reported as soon as they show up in the partial hypothesis, without waiting for the
+        end of the utterance
+'''
+
+import logging
+
+import json
+import time
+
+
+# Spoken phrase -> command
+COMMANDS = {
+    "read": "read",
+    "next": "next",
+    "reply": "reply",
+    "compose": "compose",
+    "logout": "logout",
+    "log out": "logout",
+    "stop": "stop",
+}
+
+
+class Detection():
+
+    '''
+        A recognized command
+        - offset: position in the audio (seconds) at which it was recognized
+        - latency: seconds between the end of the spoken word and the command being reported
+            (decoding delay plus processing time), None if the recognizer gave no word timing
+    '''
+
+    __slots__ = ("command", "phrase", "offset", "latency")
+
+    def __init__(self, command, phrase, offset, latency=None):
+        self.command = command
+        self.phrase = phrase
+        self.offset = offset
+        self.latency = latency
+
+    def __repr__(self):
+        latency = "?" if self.latency is None else f"{self.latency * 1000:.0f}ms"
+        return f"Detection({self.command!r} at {self.offset:.2f}s, latency={latency})"
+
+
+class CommandRecognizer():
+
+    '''
+        CommandRecognizer - Incremental command decoder for one audio stream
+        Args:
+            model: vosk.Model
+            rate: sample rate of the audio
+            commands: spoken phrase -> command
+            decoder_class: used instead of vosk.KaldiRecognizer (same arguments and methods), eg. in tests
+    '''
+
+    def __init__(self, model, rate, commands=COMMANDS, decoder_class=None):
+        if decoder_class is None:
+            import vosk
+            decoder_class = vosk.KaldiRecognizer
+        self.logger = logging.getLogger(__name__)
+        self.commands = commands
+        self.rate = rate
+        # Anything outside the grammar is decoded as [unk] instead of being forced onto a command
+        grammar = json.dumps(sorted(commands) + ["[unk]"])
+        self.recognizer = decoder_class(model, rate, grammar)
+        self.recognizer.SetWords(True)
+        self.recognizer.SetPartialWords(True)
+        self.position = 0 # Samples fed so far
+        self.reported = 0 # Words of the current utterance which were already looked at
+
+    def feed(self, frame):
+        ''' Decodes one frame of audio, returns the commands recognized in it '''
+        started = time.perf_counter()
+        self.position += len(frame) // 2
+        if self.recognizer.AcceptWaveform(frame):
+            # End of an utterance, the next one starts from scratch
+            result = json.loads(self.recognizer.Result())
+            detections = self.detect(result.get("text", ""), result.get("result", []), started)
+            self.reported = 0
+        else:
+            result = json.loads(self.recognizer.PartialResult())
+            detections = self.detect(result.get("partial", ""), result.get("partial_result", []), started)
+        return detections
+
+    def flush(self):
+        ''' Ends the audio stream, returns the commands of the last utterance which were not reported yet '''
+        started = time.perf_counter()
+        result = json.loads(self.recognizer.FinalResult())
+        detections = self.detect(result.get("text", ""), result.get("result", []), started)
+        self.reported = 0
+        return detections
+
+    def detect(self, text, words, started):
+        ''' Looks for commands among the words which were not looked at yet '''
+        tokens = text.split()
+        detections = []
+        offset = self.position / self.rate
+        index = self.reported
+        while index < len(tokens):
+            for length in (2, 1):
+                phrase = " ".join(tokens[index:index + length])
+                if len(phrase.split()) == length and phrase in self.commands:
+                    break
+            else:
+                index += 1
+                continue
+            end = words[index + length - 1].get("end") if index + length - 1 < len(words) else None
+            latency = None if end is None else offset - end + time.perf_counter() - started
+            detections.append(Detection(self.commands[phrase], phrase, offset, latency))
+            index += length
+        # A partial single word could still become the start of a two word phrase ("log" -> "log out")
+        self.reported = index if not tokens or tokens[-1] not in self.prefixes else min(index, len(tokens) - 1)
+        return detections
+
+    @property
+    def prefixes(self):
+        return set(phrase.split()[0] for phrase in self.commands if " " in phrase)
@@ -0,0 +1,96 @@
+'''
+    session.py
+
+    - Listens for voice commands, fully offline (vosk model on disk)
+    - Audio is decoded in FRAME_DURATION frames as it arrives, a command is reported as soon as it is
+        recognized instead of at the end of the utterance
+    - Any source of (frame, rate) pairs can be listened to, so recorded WAV files work the same as the microphone
+'''
+
+import logging
+
+import os
+import threading
+
+from .audio import SAMPLE_RATE, microphone_frames, wav_frames
+from .recognizer import CommandRecognizer, COMMANDS
+
+
+MODEL_PATH = "./package/resources/models/vosk-model-small-en-us"
+
+
+class VoiceSession():
+
+    '''
+        VoiceSession - Turns speech into commands
+        Args:
+            model_path: directory of the vosk model
+            commands: spoken phrase -> command
+            decoder_class: used instead of vosk.KaldiRecognizer (see CommandRecognizer), it gets the model
+                path instead of a loaded model
+    '''
+
+    def __init__(self, model_path=MODEL_PATH, commands=COMMANDS, decoder_class=None):
+        self.logger = logging.getLogger(__name__)
+        self.model_path = model_path
+        self.commands = commands
+        self.decoder_class = decoder_class
+        self.model = None
+        self.stopped = threading.Event()
+
+    def load_model(self):
+        ''' Loads the model once, returns None if vosk or the model is not available '''
+        if self.decoder_class is not None:
+            return self.model_path
+        if self.model is None:
+            try:
+                import vosk
+                vosk.SetLogLevel(-1)
+            except ImportError:
+                self.logger.error("Voice commands need the 'vosk' package")
+                return None
+            if not os.path.isdir(self.model_path):
+                self.logger.error(f"Voice model not found in '{self.model_path}'")
+                return None
+            self.model = vosk.Model(self.model_path)
+        return self.model
+
+    def recognize(self, frames):
+        ''' Yields a Detection for every command spoken in 'frames' (iterable of (frame, rate) pairs) '''
+        model = self.load_model()
+        if model is None:
+            return
+        recognizer = None
+        for frame, rate in frames:
+            if recognizer is None:
+                recognizer = CommandRecognizer(model, rate, self.commands, self.decoder_class)
+            for detection in recognizer.feed(frame):
+                self.logger.debug(f"Heard {detection}")
+                yield detection
+        # A command at the very end of the audio is only in the final result
+        if recognizer is not None:
+            for detection in recognizer.flush():
+                self.logger.debug(f"Heard {detection}")
+                yield detection
+
+    def listen(self, callback, device=None):
+        '''
+            Calls 'callback' with every Detection from the microphone until stop_listening is called
+            - Blocks, run it on its own thread
+            - Returns at once if vosk or the model is missing, or if stop_listening was called already
+        '''
+        stopped = self.stopped
+        try:
+            for detection in self.recognize(microphone_frames(stopped, SAMPLE_RATE, device=device)):
+                if stopped.is_set():
+                    break
+                callback(detection)
+        except Exception as err:
+            self.logger.error(f"Could not listen for voice commands [{err}]")
+
+    def recognize_file(self, path, realtime=False):
+        ''' Returns the Detections for a recorded 16-bit mono WAV file '''
+        return list(self.recognize(wav_frames(path, realtime=realtime)))
+
+    def stop_listening(self):
+        self.stopped.set()